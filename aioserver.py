@@ -0,0 +1,399 @@
+# asyncio serving engine
+import io
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Longest request or header line, matching http.server
+MAX_LINE = 65536
+MAX_HEADERS = 100
+# Bytes a handler buffers before its thread waits for the socket to drain
+WRITE_BUFFER_SIZE = 256 * 1024
+# Largest slice given to loop.sendfile(), so the connection timeout bounds a
+# stall rather than a whole download
+SENDFILE_CHUNK = 4 * 1024 * 1024
+# Unread request bodies up to this size are discarded to keep the connection
+MAX_DRAIN = 64 * 1024
+
+class RequestHeadError(Exception):
+    """Raised when a request line or header line is too long"""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+def raise_fd_limit() -> Optional[int]:
+    """Raise the soft open-file limit to the hard limit.
+
+    Returns the new limit, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+async def read_head(reader: asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    """Read a request line and the header block that follows it.
+
+    Returns empty bytes at end of stream. Raises RequestHeadError if a line
+    exceeds the reader's limit.
+    """
+    try:
+        request_line = await reader.readline()
+    except ValueError:
+        raise RequestHeadError(HTTPStatus.REQUEST_URI_TOO_LONG)
+    if request_line in (b'', b'\r\n', b'\n'):
+        return request_line, b''
+
+    lines = []
+    # One line past the maximum lets http.client report too many headers
+    while len(lines) <= MAX_HEADERS + 1:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise RequestHeadError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        lines.append(line)
+        if line in (b'\r\n', b'\n', b''):
+            break
+    return request_line, b''.join(lines)
+
+def run_in_loop(loop: asyncio.AbstractEventLoop, coro, timeout: float):
+    """Run a coroutine on the event loop from a worker thread and wait for it"""
+    future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, timeout), loop)
+    # The extra second covers a loop that stopped before running the coroutine
+    return future.result(timeout + 1)
+
+class RequestReader:
+    """rfile for a handler running in a worker thread.
+
+    Header lines come from the head already read by the event loop; body
+    reads are forwarded to the connection's StreamReader and never go past
+    the request's Content-Length.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, loop: asyncio.AbstractEventLoop, timeout: float):
+        self._reader = reader
+        self._loop = loop
+        self.timeout = timeout
+        self._head = io.BytesIO()
+        self.body_remaining = 0
+
+    def start(self, head: bytes):
+        """Begin a new request whose header block is head"""
+        self._head = io.BytesIO(head)
+        self.body_remaining = 0
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._head.readline(size)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.body_remaining:
+            size = self.body_remaining
+        if size <= 0:
+            return b''
+        data = run_in_loop(self._loop, self._read_body(size), self.timeout)
+        self.body_remaining -= len(data)
+        return data
+
+    async def _read_body(self, size: int) -> bytes:
+        try:
+            return await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+class ResponseWriter:
+    """wfile for a handler running in a worker thread.
+
+    Writes are buffered. Past WRITE_BUFFER_SIZE the thread hands the buffer
+    to the event loop and waits for the socket to drain, so a slow client
+    throttles the handler instead of growing memory.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop, timeout: float):
+        self._writer = writer
+        self._loop = loop
+        self.timeout = timeout
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            run_in_loop(self._loop, self._send(self.take()), self.timeout)
+
+    def take(self) -> bytes:
+        """Remove and return whatever is buffered"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    async def _send(self, data: bytes):
+        self._writer.write(data)
+        await self._writer.drain()
+
+class AsyncRequestHandlerMixIn:
+    """Runs a BaseHTTPRequestHandler's request methods for AsyncServerMixIn.
+
+    One instance serves every request on a connection. The event loop reads
+    each request head; parsing headers and running do_<METHOD> happen on a
+    worker thread through RequestReader and ResponseWriter. A handler that
+    sets deferred_body leaves sending the file to the event loop, which uses
+    loop.sendfile() without holding a thread. request_done() and
+    connection_lost() are called on the event loop once a response has been
+    sent and once the connection has closed.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, server, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 loop: asyncio.AbstractEventLoop):
+        # StreamRequestHandler.__init__ would take over the connection, so
+        # the attributes it sets up are provided here instead
+        self.server = server
+        self.request = self.connection = None
+        self.client_address = writer.get_extra_info('peername')
+        self.directory = os.getcwd()
+        self.rfile = RequestReader(reader, loop, server.connection_timeout)
+        self.wfile = ResponseWriter(writer, loop, server.connection_timeout)
+        self.close_connection = True
+        # (open file, [(prefix, offset, count), ...], trailer) to sendfile()
+        self.deferred_body = None
+
+    def handle_request(self, request_line: bytes, head: bytes):
+        """Parse and dispatch one request; runs on a worker thread"""
+        self.raw_requestline = request_line
+        self.rfile.start(head)
+        self.deferred_body = None
+        self.close_connection = True
+        try:
+            if not self.parse_request():
+                self.close_connection = True
+                return
+            try:
+                self.rfile.body_remaining = max(0, int(self.headers.get('Content-Length', 0)))
+            except ValueError:
+                self.close_connection = True
+            mname = 'do_' + self.command
+            if not hasattr(self, mname):
+                self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+                return
+            getattr(self, mname)()
+        except OSError:
+            # Client went away or stalled past the connection timeout
+            self.close_connection = True
+        except Exception:
+            self.close_connection = True
+            self.server.handle_error(self.request, self.client_address)
+        finally:
+            self.finish_request_body()
+
+    def finish_request_body(self):
+        """Discard a small unread body, or give up on the connection"""
+        if self.close_connection:
+            return
+        if 'Transfer-Encoding' in self.headers or self.rfile.body_remaining > MAX_DRAIN:
+            self.close_connection = True
+            return
+        try:
+            while self.rfile.body_remaining and self.rfile.read(self.rfile.body_remaining):
+                pass
+        except OSError:
+            self.close_connection = True
+
+    def request_done(self):
+        """Hook called after each response, deferred body included, is sent or fails"""
+
+    def connection_lost(self):
+        """Hook called once the connection has closed"""
+
+    def reject(self, status: int):
+        """Send an error for a request whose head could not be read"""
+        self.requestline = ''
+        self.request_version = ''
+        self.command = ''
+        self.path = ''
+        self.close_connection = True
+        self.send_error(status)
+
+    def handle_expect_100(self) -> bool:
+        result = super().handle_expect_100()
+        # The client is waiting for this before it sends the body
+        self.wfile.flush()
+        return result
+
+class AsyncServerMixIn:
+    """Serve a socketserver.TCPServer's bound socket from an asyncio event loop.
+
+    Idle keep-alive connections cost a coroutine rather than a thread, so
+    one process can hold thousands of them. Blocking handler code runs on a
+    bounded pool of pool_size threads, and file bodies are streamed by the
+    event loop with loop.sendfile(). Requests on a connection, including
+    pipelined ones, are answered in order.
+    """
+    request_queue_size = 1024
+
+    def __init__(self, *args, pool_size: int = 16, keepalive_timeout: float = 15.0,
+                 connection_timeout: float = 60.0, **kwargs):
+        self.pool_size = max(1, pool_size)
+        self.keepalive_timeout = keepalive_timeout
+        self.connection_timeout = connection_timeout
+        self._executor = None
+        self._loop = None
+        self._stopping = None
+        self._shutdown_request = False
+        self._shut_down = threading.Event()
+        self._connections = set()
+        self._busy = set()
+        super().__init__(*args, **kwargs)
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """Run the event loop until shutdown() is called"""
+        if self._executor is None:
+            # Created here so pre-forked workers don't inherit pool threads
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                thread_name_prefix='raf-cdn-handler')
+        self._shut_down.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._shut_down.set()
+
+    def shutdown(self):
+        """Stop serve_forever() once in-flight requests finish, and wait for it"""
+        self._shutdown_request = True
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                pass  # Loop already closed
+        self._shut_down.wait()
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket,
+                                            limit=MAX_LINE + 2, backlog=self.request_queue_size)
+        try:
+            if not self._shutdown_request:
+                await self._stopping.wait()
+        finally:
+            # Stop accepting before closing the server, which would reset
+            # connections already accepted but not yet set up
+            self._loop.remove_reader(self.socket.fileno())
+            await self._wait_for_tasks(self._connections)
+            server.close()
+            # Idle keep-alive connections are dropped; busy ones, and new ones
+            # yet to send their first request, finish that request
+            for task in self._connections - self._busy:
+                task.cancel()
+            await self._wait_for_tasks()
+            self._loop = None
+
+    async def _wait_for_tasks(self, exclude=frozenset()):
+        """Wait until the only tasks left on the loop are this one and those in exclude"""
+        while True:
+            pending = asyncio.all_tasks() - exclude - {asyncio.current_task()}
+            if not pending:
+                return
+            await asyncio.wait(pending)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        self._connections.add(task)
+        # A connection accepted just before shutdown began still gets an
+        # answer, so handing the socket to a new server loses no requests
+        self._busy.add(task)
+        handler = self.RequestHandlerClass(self, reader, writer, loop)
+        try:
+            while True:
+                try:
+                    request_line, head = await asyncio.wait_for(read_head(reader), self.keepalive_timeout)
+                except RequestHeadError as e:
+                    await loop.run_in_executor(self._executor, handler.reject, e.status)
+                    await self._send_response(handler, writer)
+                    break
+                if not request_line:
+                    break
+
+                self._busy.add(task)
+                try:
+                    await loop.run_in_executor(self._executor, handler.handle_request, request_line, head)
+                    await self._send_response(handler, writer)
+                finally:
+                    handler.request_done()
+                    self._busy.discard(task)
+                if handler.close_connection or self._stopping.is_set():
+                    break
+        except OSError:
+            pass  # Reset, broken pipe or timeout
+        finally:
+            self._connections.discard(task)
+            self._busy.discard(task)
+            if handler.deferred_body is not None:
+                handler.deferred_body[0].close()
+            writer.close()
+            handler.connection_lost()
+
+    async def _send_response(self, handler, writer: asyncio.StreamWriter):
+        """Write what the handler buffered, then any deferred file body"""
+        writer.write(handler.wfile.take())
+        if handler.deferred_body is not None:
+            source, segments, trailer = handler.deferred_body
+            try:
+                await self._send_segments(handler, writer, source, segments)
+                if trailer:
+                    writer.write(trailer)
+            finally:
+                handler.deferred_body = None
+                source.close()
+        await asyncio.wait_for(writer.drain(), self.connection_timeout)
+
+    async def _send_segments(self, handler, writer: asyncio.StreamWriter, source,
+                             segments: List[Tuple[bytes, int, int]]):
+        # A handler's transfer, if set, paces the body: reserve(n) returns
+        # the seconds to wait before sending n more bytes
+        transfer = getattr(handler, 'transfer', None)
+        chunk = min(SENDFILE_CHUNK, transfer.chunk_size) if transfer is not None else SENDFILE_CHUNK
+        loop = asyncio.get_running_loop()
+        for prefix, offset, count in segments:
+            if prefix:
+                writer.write(prefix)
+            while count > 0:
+                size = min(count, chunk)
+                if transfer is not None:
+                    delay = transfer.reserve(size)
+                    if delay:
+                        await asyncio.sleep(delay)
+                sent = await asyncio.wait_for(loop.sendfile(writer.transport, source, offset, size),
+                                              self.connection_timeout)
+                if sent < size:
+                    # The file shrank under us; the body can't be completed
+                    handler.close_connection = True
+                    return
+                offset += sent
+                count -= sent
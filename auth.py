@@ -1,23 +1,659 @@
 # User Authentication and Activity System
+import os
 import json
+import time
+import hmac
 import hashlib
 import secrets
+import sqlite3
 import datetime
-from typing import Dict, List, Optional
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from metrics import PBKDF2_BUCKETS, Histogram
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Iterations used by hashes stored in the original "salt:hash" format
+LEGACY_KDF_ITERATIONS = 100000
+
+class HasherBusyError(Exception):
+    """Raised when the password hashing queue is full"""
+
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations).hex()
+
+def parse_password_hash(password_hash: str) -> Optional[Tuple[int, str, str]]:
+    """Split a stored hash into (iterations, salt, hex digest)"""
+    parts = password_hash.split('$')
+    if len(parts) == 4 and parts[0] == 'pbkdf2_sha256' and parts[1].isdigit():
+        return int(parts[1]), parts[2], parts[3]
+    parts = password_hash.split(':')
+    if len(parts) == 2:
+        return LEGACY_KDF_ITERATIONS, parts[0], parts[1]
+    return None
+
+class PasswordHasher:
+    """PBKDF2-SHA256 hashing on a bounded pool of worker threads.
+
+    hashlib releases the GIL while deriving keys, so worker threads run in
+    parallel with request threads. At most max_pending jobs may be running
+    or queued; beyond that calls fail fast with HasherBusyError instead of
+    tying up more request threads.
+    """
+
+    def __init__(self, iterations: int = 100000, workers: Optional[int] = None,
+                 max_pending: Optional[int] = None):
+        self.iterations = iterations
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending or self.workers * 4
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self.timings = Histogram(PBKDF2_BUCKETS)  # Seconds per derivation
+        self.pending = 0  # Hashes running or queued
+        self.rejected = 0
+        self._stats_lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise HasherBusyError('Password hashing queue is full')
+        with self._stats_lock:
+            self.pending += 1
+        try:
+            with self._pool_lock:
+                # Worker threads don't survive fork(), so each process starts its own
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='pbkdf2')
+                    self._pool_pid = os.getpid()
+                future = self._pool.submit(self._timed, fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future.result()
+
+    def _release(self):
+        with self._stats_lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.timings.observe(elapsed)
+
+    def stats(self) -> Dict:
+        """Counters for monitoring"""
+        with self._stats_lock:
+            return {
+                'timings': self.timings.snapshot(),
+                'pending': self.pending,
+                'rejected': self.rejected
+            }
+
+    def hash(self, password: str) -> str:
+        """Hash a password with a fresh salt at the configured cost"""
+        salt = secrets.token_hex(16)
+        derived = self._submit(_pbkdf2, password, salt, self.iterations)
+        return f"pbkdf2_sha256${self.iterations}${salt}${derived}"
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        """Check a password against a stored hash in either format"""
+        parsed = parse_password_hash(password_hash)
+        if parsed is None:
+            return False
+        iterations, salt, expected = parsed
+        derived = self._submit(_pbkdf2, password, salt, iterations)
+        return hmac.compare_digest(derived, expected)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether a stored hash uses an old format or a different cost"""
+        parsed = parse_password_hash(password_hash)
+        return parsed is None or parsed[0] != self.iterations
+
+class RateLimiter:
+    """Keyed token buckets: each key may spend burst tokens, refilled at rate per second.
+
+    Only the max_keys most recently used buckets are kept; an evicted key
+    simply starts again with a full bucket. Waits are capped at max_wait
+    seconds, which is also the wait once a bucket with rate 0 is empty.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000, max_wait: float = 3600):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.max_wait = max_wait
+        self._buckets = OrderedDict()  # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, tokens: float = 1.0) -> float:
+        """Spend tokens for key; returns 0 on success or seconds to wait"""
+        now = time.monotonic()
+        with self._lock:
+            available, last = self._buckets.pop(key, (self.burst, now))
+            available = min(self.burst, available + (now - last) * self.rate)
+            if available >= tokens:
+                available -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - available) / self.rate if self.rate > 0 else self.max_wait
+                wait = min(wait, self.max_wait)
+            self._buckets[key] = (available, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+class SessionStore:
+    """Interface for session backends.
+
+    A session maps a random ID to the user info it was created with and
+    expires ttl seconds after it was last used. Implementations must be
+    safe to call from concurrent request threads.
+    """
+    # Whether every process and node using the store sees the same sessions
+    shared = False
+
+    def create(self, user_info: Dict) -> str:
+        """Store user info under a new session ID and return the ID"""
+        raise NotImplementedError
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return user info for a live session and extend its expiry"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> Optional[Dict]:
+        """Remove a session and return its user info"""
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def start(self):
+        """Start any background maintenance in the serving process"""
+
+    def close(self):
+        """Stop background maintenance and write out anything buffered"""
+
+class MemorySessionStore(SessionStore):
+    """Thread-safe in-memory session store with sliding TTL and a size bound.
+
+    Sessions belong to the process that created them.
+    """
+
+    def __init__(self, ttl: int = 86400, max_sessions: int = 10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # session_id -> (expires_at, user_info), least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user_info: Dict) -> str:
+        """Store user info under a new session ID and return the ID"""
+        session_id = secrets.token_hex(32)
+        with self._lock:
+            self._sweep(time.monotonic())
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[session_id] = (time.monotonic() + self.ttl, user_info)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return user info for a live session and extend its expiry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def delete(self, session_id: str) -> Optional[Dict]:
+        """Remove a session and return its user info"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        return entry[1] if entry else None
+
+    def _sweep(self, now: float):
+        # Entries are kept in last-access order and share one TTL, so the
+        # expired ones are always at the front.
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            del self._sessions[session_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+class SQLiteSessionStore(SessionStore):
+    """Session store in a SQLite database shared by every process using it.
+
+    Extending a session's expiry on every request would turn each lookup
+    into a write, so get() only notes when a session was seen. A background
+    thread writes the new expiry times in one transaction every
+    touch_interval seconds, and only for sessions whose stored expiry is
+    more than touch_interval old, which bounds writes to one per active
+    session per interval. The same thread deletes expired sessions every
+    sweep_interval seconds. Expiry times are wall-clock so that separate
+    processes and nodes agree on them.
+
+    WAL mode suits processes on one host. For nodes sharing the database
+    over a network filesystem, use journal_mode='DELETE', which relies on
+    the filesystem's locks rather than shared memory.
+    """
+    shared = True
+
+    def __init__(self, db_file: str = '.sessions.db', ttl: int = 86400, max_sessions: int = 10000,
+                 touch_interval: float = 30.0, sweep_interval: float = 60.0, journal_mode: str = 'WAL'):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.touch_interval = touch_interval
+        self.sweep_interval = sweep_interval
+        self.journal_mode = journal_mode
+        self.writes = 0  # Session rows written by touches, for monitoring
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._touched = {}  # session_id -> last seen (wall clock), not yet written
+        self._stop = threading.Event()
+        self._maintainer = None
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(), so each process opens its own.
+        # Callers hold self._lock.
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        if self._conn_pid != os.getpid():
+            self._touched = {}  # The parent's pending touches are its own to write
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                user_info TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_by_expiry ON sessions (expires_at);
+        ''')
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    def create(self, user_info: Dict) -> str:
+        session_id = secrets.token_hex(32)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT INTO sessions (id, user_info, expires_at) VALUES (?, ?, ?)',
+                             (session_id, json.dumps(user_info), time.time() + self.ttl))
+                # Beyond the bound, the sessions closest to expiring go first
+                excess = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] - self.max_sessions
+                if excess > 0:
+                    conn.execute('''
+                        DELETE FROM sessions WHERE id IN
+                        (SELECT id FROM sessions ORDER BY expires_at LIMIT ?)
+                    ''', (excess,))
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._connect().execute('SELECT user_info, expires_at FROM sessions WHERE id = ?',
+                                          (session_id,)).fetchone()
+            if row is None:
+                return None
+            expires_at = row[1]
+            touched = self._touched.get(session_id)
+            if touched is not None:
+                expires_at = max(expires_at, touched + self.ttl)
+            if expires_at <= now:
+                return None
+            if now + self.ttl - row[1] > self.touch_interval:
+                self._touched[session_id] = now
+        return json.loads(row[0])
+
+    def delete(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            conn = self._connect()
+            self._touched.pop(session_id, None)
+            with conn:
+                row = conn.execute('SELECT user_info FROM sessions WHERE id = ?', (session_id,)).fetchone()
+                conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        return json.loads(row[0]) if row else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute('SELECT COUNT(*) FROM sessions WHERE expires_at > ?',
+                                           (time.time(),)).fetchone()[0]
+
+    def flush(self):
+        """Write the expiry of every session seen since the last flush"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            if not touched:
+                return
+            conn = self._connect()
+            with conn:
+                # A session deleted meanwhile simply matches no row
+                conn.executemany('UPDATE sessions SET expires_at = MAX(expires_at, ?) WHERE id = ?',
+                                 [(seen + self.ttl, session_id) for session_id, seen in touched.items()])
+            self.writes += len(touched)
+
+    def sweep(self) -> int:
+        """Delete expired sessions; returns how many"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def start(self):
+        """Flush touches and sweep expired sessions in a background thread"""
+        if self._maintainer is not None and self._maintainer.is_alive():
+            return
+        self._stop.clear()
+        self._maintainer = threading.Thread(target=self._maintain_loop,
+                                            name='session-store-maintainer', daemon=True)
+        self._maintainer.start()
+
+    def close(self):
+        self._stop.set()
+        if self._maintainer is not None:
+            self._maintainer.join()
+            self._maintainer = None
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            print(f"Session flush error: {e}")
+
+    def _maintain_loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                self.flush()
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.sweep_interval
+                    self.sweep()
+            except sqlite3.Error as e:
+                print(f"Session store maintenance error: {e}")
+            if self._stop.wait(self.touch_interval):
+                return
+
+class ActivityLog:
+    """Append-only JSONL activity log with a batching background writer.
+
+    log() only appends to a pending batch, so its cost doesn't depend on
+    the size of the log. A writer thread appends pending entries to the file
+    and fsyncs every flush_interval seconds, rotating the file once it
+    exceeds max_bytes. Queries are answered from an in-memory ring buffer
+    of the file's newest entries, which reads only what was appended since
+    the last query, so every worker process sees every worker's entries.
+    """
+
+    def __init__(self, path: str = 'activity_logs.jsonl', flush_interval: float = 1.0,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3,
+                 memory_entries: int = 1000, legacy_path: Optional[str] = 'activity_logs.json'):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.recent = deque(maxlen=memory_entries)
+        self._tail_files = None  # (st_dev, st_ino) of the file and .1 recent was read from
+        self._tail_offset = 0
+        self._init_process_state()
+        if legacy_path and not os.path.exists(path) and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        with self._tail_lock:
+            self._refresh()
+        # Entries queued before a fork belong to the parent's writer
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._init_process_state)
+
+    def _init_process_state(self):
+        self._cond = threading.Condition()
+        self._tail_lock = threading.Lock()
+        self._pending = []
+        self._writer = None
+        self._closed = False
+
+    def _import_legacy(self, legacy_path: str):
+        # One-off conversion from the old whole-file JSON array format
+        try:
+            with open(legacy_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not import {legacy_path}: {e}")
+            return
+        with open(self.path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+
+    def _refresh(self):
+        # Bring recent up to date with the file. Callers hold self._tail_lock.
+        files = (self._identity(self.path), self._identity(f'{self.path}.1'))
+        if files != self._tail_files:
+            # Rotated by some process since the last read: start over from
+            # the previous file, then follow the new one
+            self.recent.clear()
+            self._tail_files, self._tail_offset = files, 0
+            self._read_from(f'{self.path}.1', files[1], 0)
+        if files[0] is not None:
+            self._tail_offset += self._read_from(self.path, files[0], self._tail_offset)
+
+    @staticmethod
+    def _identity(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def _read_from(self, path: str, identity: Optional[Tuple[int, int]], offset: int) -> int:
+        # Append the complete lines after offset to recent; returns bytes read
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != identity:
+                return 0  # Rotated meanwhile; the next refresh starts over
+            f.seek(offset)
+            data = f.read()
+        # A line still being written is picked up by the next read
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.splitlines():
+            try:
+                self.recent.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # Torn write from a crash
+        return len(data)
+
+    def log(self, entry: Dict):
+        """Record an entry; it reaches disk within flush_interval seconds"""
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                self._pending.append(entry)
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop,
+                                                     name='activity-log-writer', daemon=True)
+                    self._writer.start()
+        if closed:
+            # Logged during shutdown, after the writer stopped
+            try:
+                self._write_batch([entry])
+            except OSError as e:
+                print(f"Activity log write error: {e}")
+
+    def query(self, limit: int = 50, offset: int = 0, username: Optional[str] = None,
+              action: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None) -> Tuple[List[Dict], int]:
+        """Return a page of recent entries, newest first, and the match count.
+
+        since/until are ISO 8601 timestamps compared against each entry's.
+        Entries are those in the log file, from every worker process, with
+        this process's pending ones flushed first.
+        """
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Activity log write error: {e}")
+        with self._tail_lock:
+            self._refresh()
+            entries = list(self.recent)
+        matches = [entry for entry in reversed(entries)
+                   if (username is None or entry.get('username') == username)
+                   and (action is None or entry.get('action') == action)
+                   and (since is None or entry.get('timestamp', '') >= since)
+                   and (until is None or entry.get('timestamp', '') <= until)]
+        return matches[offset:offset + limit], len(matches)
+
+    def flush(self):
+        """Write and fsync all pending entries now"""
+        with self._cond:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._write_batch(batch)
+
+    def close(self):
+        """Stop the writer after flushing everything still pending"""
+        with self._cond:
+            self._closed = True
+            writer = self._writer
+            self._cond.notify()
+        if writer is not None:
+            writer.join()
+        self.flush()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Activity log write error: {e}")
+            if closed:
+                return
+
+    def _write_batch(self, batch: List[Dict]):
+        data = ''.join(json.dumps(entry) + '\n' for entry in batch).encode('utf-8')
+        # Writers share the lock file and rotation takes it exclusively, so
+        # no process appends to a file being rotated or rotates it twice
+        lock_fd = os.open(f'{self.path}.lock', os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            self._flock(lock_fd, 'LOCK_SH')
+            # A single O_APPEND write keeps lines from concurrent processes whole
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            self._flock(lock_fd, 'LOCK_UN')
+            if self.max_bytes and size > self.max_bytes:
+                self._flock(lock_fd, 'LOCK_EX')
+                # Another process may have rotated while we waited
+                try:
+                    size = os.stat(self.path).st_size
+                except FileNotFoundError:
+                    size = 0
+                if size > self.max_bytes:
+                    self._rotate()
+        finally:
+            os.close(lock_fd)
+
+    @staticmethod
+    def _flock(fd: int, operation: str):
+        # Without fcntl only this process's writer thread is serialized
+        if fcntl is not None:
+            fcntl.flock(fd, getattr(fcntl, operation))
+
+    def _rotate(self):
+        # activity_logs.jsonl -> .1 -> .2 ... dropping the oldest
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.unlink(self.path)
 
 class UserManager:
-    def __init__(self, users_file='users.json', logs_file='activity_logs.json'):
+    """Users, sessions and activity log shared by every request handler.
+
+    A single instance is owned by the server; all public methods are safe
+    to call from concurrent request threads.
+    """
+
+    def __init__(self, users_file='users.json', session_ttl: int = 86400,
+                 max_sessions: int = 10000, activity_log: Optional[ActivityLog] = None,
+                 hasher: Optional[PasswordHasher] = None, sessions: Optional[SessionStore] = None):
         self.users_file = users_file
-        self.logs_file = logs_file
-        self.sessions = {}  # session_id -> user_info
-        self.users = self.load_users()
-        self.activity_logs = self.load_logs()
+        self._lock = threading.RLock()
+        self.hasher = hasher or PasswordHasher()
+        self.sessions = sessions if sessions is not None else MemorySessionStore(session_ttl, max_sessions)
+        self.activity_log = activity_log or ActivityLog()
+        self._users_mtime = None
+        self._users = self.load_users()
+
+    @property
+    def users(self) -> Dict:
+        """Current users, reloaded only when users_file changes on disk"""
+        try:
+            mtime = os.stat(self.users_file).st_mtime_ns
+        except OSError:
+            return self._users
+        if mtime != self._users_mtime:
+            with self._lock:
+                if mtime != self._users_mtime:
+                    try:
+                        self._users = self.load_users()
+                    except ValueError as e:
+                        # Edited by hand and not valid yet; retried on the next change
+                        print(f"Error loading {self.users_file}: {e}")
+        return self._users
         
     def load_users(self) -> Dict:
         """Load users from file or create default admin user"""
         try:
             with open(self.users_file, 'r') as f:
-                return json.load(f)
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                users = json.load(f)
+            self._users_mtime = mtime
+            return users
         except FileNotFoundError:
             # Create default admin user with password 'admin123'
             default_users = {
@@ -30,78 +666,96 @@ class UserManager:
             self.save_users(default_users)
             return default_users
     
-    def save_users(self, users: Dict):
-        """Save users to file"""
-        with open(self.users_file, 'w') as f:
-            json.dump(users, f, indent=2)
+    def reload_users(self):
+        """Re-read users_file even if its modification time looks unchanged.
+
+        Raises ValueError, keeping the current users, if the file is not valid JSON.
+        """
+        with self._lock:
+            self._users = self.load_users()
     
-    def load_logs(self) -> List:
-        """Load activity logs from file"""
+    def save_users(self, users: Dict):
+        """Replace users_file atomically, so other workers never read it half-written"""
+        directory = os.path.dirname(os.path.abspath(self.users_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
         try:
-            with open(self.logs_file, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
-    
-    def save_logs(self):
-        """Save activity logs to file"""
-        with open(self.logs_file, 'w') as f:
-            json.dump(self.activity_logs, f, indent=2)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(users, f, indent=2)
+            os.replace(temp_path, self.users_file)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._users_mtime = os.stat(self.users_file).st_mtime_ns
     
     def hash_password(self, password: str) -> str:
         """Hash password with salt"""
-        salt = secrets.token_hex(16)
-        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return f"{salt}:{hash_obj.hex()}"
+        return self.hasher.hash(password)
     
     def verify_password(self, password: str, password_hash: str) -> bool:
         """Verify password against hash"""
-        try:
-            salt, hash_hex = password_hash.split(':')
-            hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-            return hash_obj.hex() == hash_hex
-        except ValueError:
-            return False
+        return self.hasher.verify(password, password_hash)
     
     def authenticate(self, username: str, password: str) -> Optional[str]:
-        """Authenticate user and return session ID"""
-        if username in self.users:
-            user = self.users[username]
+        """Authenticate user and return session ID.
+
+        Raises HasherBusyError when too many hashes are already in flight.
+        """
+        user = self.users.get(username)
+        if user:
             if self.verify_password(password, user['password_hash']):
-                session_id = secrets.token_hex(32)
-                self.sessions[session_id] = {
+                if self.hasher.needs_rehash(user['password_hash']):
+                    self._rehash_password(username, password)
+                session_id = self.sessions.create({
                     'username': username,
                     'role': user['role'],
                     'login_time': datetime.datetime.now().isoformat()
-                }
+                })
                 self.log_activity(username, 'login', f'User logged in')
                 return session_id
         return None
     
+    def _rehash_password(self, username: str, password: str):
+        # Upgrade a verified password to the current format and cost
+        try:
+            password_hash = self.hash_password(password)
+        except HasherBusyError:
+            return  # Try again on a later login
+        with self._lock:
+            users = dict(self.users)
+            if username in users:
+                users[username] = dict(users[username], password_hash=password_hash)
+                self.save_users(users)
+                self._users = users
+    
     def get_user_from_session(self, session_id: str) -> Optional[Dict]:
         """Get user info from session ID"""
         return self.sessions.get(session_id)
     
     def logout(self, session_id: str) -> bool:
         """Logout user and remove session"""
-        if session_id in self.sessions:
-            user_info = self.sessions[session_id]
+        user_info = self.sessions.delete(session_id)
+        if user_info:
             self.log_activity(user_info['username'], 'logout', 'User logged out')
-            del self.sessions[session_id]
             return True
         return False
     
     def register_user(self, username: str, password: str, role: str = 'user') -> bool:
         """Register new user"""
-        if username in self.users:
-            return False
-        
-        self.users[username] = {
-            'password_hash': self.hash_password(password),
-            'role': role,
-            'created_at': datetime.datetime.now().isoformat()
-        }
-        self.save_users(self.users)
+        password_hash = self.hash_password(password)
+        with self._lock:
+            # Copy on write: readers iterate self._users without the lock,
+            # and a failed save leaves it as it is on disk
+            users = dict(self.users)
+            if username in users:
+                return False
+            
+            users[username] = {
+                'password_hash': password_hash,
+                'role': role,
+                'created_at': datetime.datetime.now().isoformat()
+            }
+            self.save_users(users)
+            self._users = users
         self.log_activity('admin', 'user_created', f'New user created: {username} with role: {role}')
         return True
     
@@ -113,12 +767,13 @@ class UserManager:
             'action': action,
             'details': details
         }
-        self.activity_logs.append(log_entry)
-        # Keep only last 1000 logs to prevent file from growing too large
-        if len(self.activity_logs) > 1000:
-            self.activity_logs = self.activity_logs[-1000:]
-        self.save_logs()
+        self.activity_log.log(log_entry)
+    
+    def get_activity_logs(self, limit: int = 50, **filters) -> List:
+        """Get recent activity logs, most recent first"""
+        return self.activity_log.query(limit, **filters)[0]
     
-    def get_activity_logs(self, limit: int = 50) -> List:
-        """Get recent activity logs"""
-        return self.activity_logs[-limit:][::-1]  # Return most recent first
\ No newline at end of file
+    def close(self):
+        """Flush anything still buffered to disk"""
+        self.sessions.close()
+        self.activity_log.close()
\ No newline at end of file
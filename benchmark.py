@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the RAF-CDN server.
+
+Starts server.py with different --workers/--threads settings and drives it
+with concurrent clients, reporting requests/sec and latency percentiles for
+each configuration.
+
+--suite instead runs a fixed set of scenarios against a copy of the server
+in a generated fixture directory (synthetic videos, users and activity
+log), recording throughput, latency percentiles and server RSS for each,
+and saves the results as JSON so runs on different commits can be compared
+with --compare.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Scenarios run by --suite, in order
+SUITE_SCENARIOS = ('static_small', 'video_large', 'video_range', 'api_videos',
+                   'activity_log', 'uploads', 'login_storm')
+
+# Fixture accounts; every generated user shares one password hash
+FIXTURE_ADMIN = ('admin', 'admin123')
+FIXTURE_PASSWORD = 'benchmark'
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def wait_for_port(host, port, timeout=10.0):
+    """Block until something accepts connections on host:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server did not start listening on {host}:{port}")
+
+def start_server(port, workers, threads, extra_args=(), server_dir=SCRIPT_DIR):
+    """Launch server_dir/server.py as a subprocess and wait until it is accepting"""
+    cmd = [sys.executable, os.path.join(server_dir, 'server.py'),
+           '--host', '127.0.0.1', '--port', str(port),
+           '--workers', str(workers), '--threads', str(threads), *extra_args]
+    # server.py reads server.config.json from its working directory
+    proc = subprocess.Popen(cmd, cwd=server_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port('127.0.0.1', port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+def stop_server(proc):
+    """Ask the server to shut down gracefully, killing it if it hangs"""
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def client_thread(port, requests, deadline, results):
+    """Issue requests in a loop until the deadline.
+
+    requests is a list of (method, path, body, headers) cycled in order,
+    each client starting at a random offset; results collects (status,
+    latency, body bytes) tuples, with status 0 for errors.
+    """
+    i = random.randrange(len(requests))
+    while time.monotonic() < deadline:
+        method, path, body, headers = requests[i % len(requests)]
+        i += 1
+        start = time.perf_counter()
+        received = 0
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            # Large bodies are counted, not kept
+            for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                received += len(chunk)
+            conn.close()
+            status = response.status
+        except OSError:
+            status = 0
+        results.append((status, time.perf_counter() - start, received))
+
+def client_process(args):
+    """Run a group of client threads and return their combined results"""
+    port, label, requests, duration, threads_per_process = args
+    deadline = time.monotonic() + duration
+    results = []
+    threads = [threading.Thread(target=client_thread, args=(port, requests, deadline, results))
+               for _ in range(threads_per_process)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return label, results
+
+def summarize(results, elapsed):
+    """Turn (status, latency, bytes) tuples into throughput and latency figures"""
+    latencies = sorted(latency for status, latency, _ in results if 200 <= status < 400)
+    received = sum(size for status, _, size in results if 200 <= status < 400)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'requests': len(latencies),
+        'errors': len(results) - len(latencies),
+        'statuses': statuses,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mib_per_s': received / elapsed / (1024 * 1024) if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+def run_mixed(port, groups, duration):
+    """Drive the server with several groups of clients at once.
+
+    groups maps a label to (requests, clients). Clients are spread over
+    several processes so the load generator itself isn't limited to one
+    core by the GIL. Returns a summary per label.
+    """
+    jobs = []
+    for label, (requests, clients) in groups.items():
+        processes = max(1, min(clients, os.cpu_count() or 1))
+        for i in range(processes):
+            threads = clients // processes + (1 if i < clients % processes else 0)
+            jobs.append((port, label, requests, duration, threads))
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(len(jobs)) as pool:
+        outputs = pool.map(client_process, jobs)
+    elapsed = time.perf_counter() - started
+
+    combined = {label: [] for label in groups}
+    for label, results in outputs:
+        combined[label].extend(results)
+    return {label: summarize(results, elapsed) for label, results in combined.items()}
+
+def get_requests(paths):
+    """Request specs for plain GETs of the given paths"""
+    return [('GET', path, None, {}) for path in paths]
+
+def login_requests(username='admin', password='admin123'):
+    """Request specs for a login storm"""
+    body = json.dumps({'username': username, 'password': password})
+    return [('POST', '/api/login', body, {'Content-Type': 'application/json'})]
+
+def run_load(port, paths, clients, duration):
+    """Drive the server with concurrent GET clients and summarise the results"""
+    return run_mixed(port, {'static': (get_requests(paths), clients)}, duration)['static']
+
+def parse_matrix(spec):
+    """Parse 'WORKERSxTHREADS,...' into a list of (workers, threads)"""
+    configs = []
+    for item in spec.split(','):
+        workers, threads = item.lower().split('x')
+        configs.append((int(workers), int(threads)))
+    return configs
+
+def main():
+    parser = argparse.ArgumentParser(description='RAF-CDN load benchmark')
+    parser.add_argument('--matrix', default=None,
+                        help='Comma-separated WORKERSxTHREADS configurations '
+                             '(default: 1x0,1x4,1x16,2x16,4x16, or 1x16 with --suite)')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent clients (default: 32)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per configuration (default: 5)')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='Path to request; repeat for a mix (default: /index.html, /style.css)')
+    parser.add_argument('--port', type=int, default=8765, help='First port for the servers under test (default: 8765)')
+    parser.add_argument('--login-clients', type=int, default=0,
+                        help='Also run this many clients hammering /api/login, reporting '
+                             'login throughput next to static latency (default: 0)')
+    parser.add_argument('--sessions', action='store_true',
+                        help='Instead of load testing a server, measure session lookups/sec for '
+                             'each session backend, using --clients threads')
+    parser.add_argument('--session-count', type=int, default=10000,
+                        help='Sessions to create per backend for --sessions (default: 10000)')
+    parser.add_argument('--suite', action='store_true',
+                        help='Run the scenario suite against generated fixtures and save JSON results')
+    parser.add_argument('--scenario', action='append', dest='scenarios', choices=SUITE_SCENARIOS,
+                        help='Suite scenario to run; repeat for several (default: all)')
+    parser.add_argument('--fixtures', metavar='DIR',
+                        help='Fixture directory for --suite, generated if missing and kept '
+                             '(default: a temporary directory)')
+    parser.add_argument('--videos', type=int, default=10000,
+                        help='Synthetic videos to generate (default: 10000)')
+    parser.add_argument('--large-video-mb', type=int, default=64,
+                        help='Size of the large video in MiB (default: 64)')
+    parser.add_argument('--users', type=int, default=100, help='Synthetic users to generate (default: 100)')
+    parser.add_argument('--log-entries', type=int, default=10000,
+                        help='Synthetic activity log entries to generate (default: 10000)')
+    parser.add_argument('--upload-kb', type=int, default=1024,
+                        help='Size of each upload in the uploads scenario in KiB (default: 1024)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Where --suite saves its results (default: benchmark-<commit>.json)')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Results of an earlier --suite run to show changes against')
+    args = parser.parse_args()
+
+    paths = args.paths or ['/index.html', '/style.css']
+
+    if args.suite:
+        run_suite(args)
+        return
+    args.matrix = args.matrix or '1x0,1x4,1x16,2x16,4x16'
+
+    if args.sessions:
+        run_session_benchmark(args)
+        return
+
+    if args.login_clients:
+        run_login_benchmark(args, paths)
+        return
+
+    print(f"{'workers':>7} {'threads':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for i, (workers, threads) in enumerate(parse_matrix(args.matrix)):
+        # A fresh port per run avoids waiting out the previous run's TIME_WAITs
+        port = args.port + i
+        proc = start_server(port, workers, threads)
+        try:
+            run_load(port, paths, min(args.clients, 4), 0.5)  # Warm-up
+            result = run_load(port, paths, args.clients, args.duration)
+        finally:
+            stop_server(proc)
+        print(f"{workers:>7} {threads:>7} {result['rps']:>10.1f} {result['p50_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['max_ms']:>9.2f} {result['errors']:>7}")
+
+def run_login_benchmark(args, paths):
+    """Measure login throughput and static-file latency under mixed load"""
+    print(f"{'workers':>7} {'threads':>7} {'static p50':>11} {'static p99':>11} "
+          f"{'login ok/s':>11} {'login p99':>10} {'429':>6} {'503':>6}")
+    for i, (workers, threads) in enumerate(parse_matrix(args.matrix)):
+        port = args.port + i
+        proc = start_server(port, workers, threads)
+        try:
+            run_load(port, paths, min(args.clients, 4), 0.5)  # Warm-up
+            results = run_mixed(port, {
+                'static': (get_requests(paths), args.clients),
+                'login': (login_requests(), args.login_clients)
+            }, args.duration)
+        finally:
+            stop_server(proc)
+        static, login = results['static'], results['login']
+        print(f"{workers:>7} {threads:>7} {static['p50_ms']:>11.2f} {static['p99_ms']:>11.2f} "
+              f"{login['rps']:>11.1f} {login['p99_ms']:>10.2f} "
+              f"{login['statuses'].get(429, 0):>6} {login['statuses'].get(503, 0):>6}")
+
+def session_lookup_thread(store, session_ids, deadline, latencies):
+    """Look up random sessions until the deadline, recording each latency"""
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        session_id = rng.choice(session_ids)
+        start = time.perf_counter()
+        if store.get(session_id) is None:
+            raise RuntimeError('Session lookup failed')
+        latencies.append(time.perf_counter() - start)
+
+def run_session_benchmark(args):
+    """Measure session lookups/sec and latency for each backend, in process"""
+    from auth import MemorySessionStore, SQLiteSessionStore
+
+    print(f"{'backend':>8} {'threads':>7} {'lookups/s':>11} {'p50 us':>8} {'p99 us':>8} {'row writes':>10}")
+    for backend in ('memory', 'sqlite'):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if backend == 'memory':
+                store = MemorySessionStore(max_sessions=args.session_count)
+            else:
+                # A short interval so the run includes several batched flushes
+                store = SQLiteSessionStore(os.path.join(temp_dir, 'sessions.db'),
+                                           max_sessions=args.session_count, touch_interval=1.0)
+            session_ids = [store.create({'username': f'user{i}', 'role': 'user'})
+                           for i in range(args.session_count)]
+            store.start()
+            deadline = time.monotonic() + args.duration
+            results = [[] for _ in range(args.clients)]
+            threads = [threading.Thread(target=session_lookup_thread,
+                                        args=(store, session_ids, deadline, latencies))
+                       for latencies in results]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+            store.close()
+
+        latencies = sorted(latency for latencies in results for latency in latencies)
+        writes = getattr(store, 'writes', 0)
+        print(f"{backend:>8} {args.clients:>7} {len(latencies) / elapsed:>11.0f} "
+              f"{percentile(latencies, 50) * 1e6:>8.1f} {percentile(latencies, 99) * 1e6:>8.1f} {writes:>10}")
+
+def generate_fixtures(directory, videos=10000, large_video_mb=64, users=100, log_entries=10000, seed=0):
+    """Build a self-contained server directory with synthetic content.
+
+    Copies the server's code and front end into directory and fills it
+    with videos random bytes (plus one of large_video_mb MiB), small static
+    assets, users and an activity log, all derived from seed so every run
+    serves the same data. The video catalog is indexed up front so the
+    server doesn't spend the run scanning. The settings are recorded in
+    fixtures.json so a later run can reuse the directory.
+    """
+    from auth import PasswordHasher
+    from catalog import VideoCatalog
+
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(SCRIPT_DIR):
+        if name.endswith(('.py', '.html', '.css', '.js')):
+            shutil.copy2(os.path.join(SCRIPT_DIR, name), directory)
+    shutil.copytree(os.path.join(SCRIPT_DIR, 'Public'), os.path.join(directory, 'Public'), dirs_exist_ok=True)
+
+    rng = random.Random(seed)
+    videos_dir = os.path.join(directory, 'Videos')
+    os.makedirs(videos_dir, exist_ok=True)
+    extensions = ('.mp4', '.webm', '.mkv', '.mov')
+    for i in range(videos):
+        with open(os.path.join(videos_dir, f'video-{i:05d}{extensions[i % len(extensions)]}'), 'wb') as f:
+            f.write(rng.randbytes(rng.randint(1024, 64 * 1024)))
+    with open(os.path.join(videos_dir, 'large.mp4'), 'wb') as f:
+        for _ in range(large_video_mb):
+            f.write(rng.randbytes(1024 * 1024))
+
+    assets_dir = os.path.join(directory, 'Assets')
+    os.makedirs(assets_dir, exist_ok=True)
+    for size in (1, 4, 16, 64):
+        with open(os.path.join(assets_dir, f'asset-{size}k.txt'), 'w') as f:
+            f.write(''.join(rng.choice('abcdefghij \n') for _ in range(size * 1024)))
+
+    # Hashed at the server's default cost so logins cost what they do in production
+    hasher = PasswordHasher()
+    admin_user, admin_password = FIXTURE_ADMIN
+    created_at = '2024-01-01T00:00:00'
+    user_hash = hasher.hash(FIXTURE_PASSWORD)
+    accounts = {f'user{i}': {'password_hash': user_hash, 'role': 'user', 'created_at': created_at}
+                for i in range(users)}
+    accounts[admin_user] = {'password_hash': hasher.hash(admin_password), 'role': 'admin',
+                            'created_at': created_at}
+    with open(os.path.join(directory, 'users.json'), 'w') as f:
+        json.dump(accounts, f, indent=2)
+
+    actions = ('login', 'logout', 'video_upload', 'video_delete')
+    with open(os.path.join(directory, 'activity_logs.jsonl'), 'w') as f:
+        for i in range(log_entries):
+            minute = i % (60 * 24 * 28)
+            f.write(json.dumps({
+                'timestamp': f'2024-02-{minute // 1440 + 1:02d}T{minute // 60 % 24:02d}:{minute % 60:02d}:00',
+                'username': f'user{rng.randrange(max(users, 1))}',
+                'action': rng.choice(actions),
+                'details': f'Synthetic entry {i}'
+            }) + '\n')
+
+    catalog = VideoCatalog(videos_dir, os.path.join(directory, 'video_catalog.db'))
+    catalog.reconcile()
+
+    with open(os.path.join(directory, 'fixtures.json'), 'w') as f:
+        json.dump({'videos': videos, 'large_video_mb': large_video_mb, 'users': users,
+                   'log_entries': log_entries, 'seed': seed}, f, indent=2)
+
+def write_fixture_config(directory, workers):
+    """Write the server.config.json a fixture server runs with"""
+    config = {
+        'metadata_workers': 0,  # Probing random bytes would compete with the scenarios
+        'dedup_storage': False,  # Every upload writes its whole body
+        'login_ip_rate': 1000000,  # Let the login storm reach password hashing
+        'login_ip_burst': 1000000,
+        'login_user_rate': 1000000,
+        'login_user_burst': 1000000,
+        # One token is used by every client, so workers must share sessions
+        'session_backend': 'sqlite' if workers > 1 else 'memory',
+    }
+    with open(os.path.join(directory, 'server.config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants.
+
+    Reads /proc, so returns None where that isn't available.
+    """
+    try:
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces; fields resume after ')'
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    except OSError:
+        return None
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+class RSSSampler:
+    """Samples the RSS of a server's process tree in a background thread"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self.peak = process_tree_rss(self.pid)
+        self._thread = threading.Thread(target=self._sample_loop, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return the current RSS"""
+        self._stop.set()
+        self._thread.join()
+        return self._sample()
+
+    def _sample(self):
+        rss = process_tree_rss(self.pid)
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+        return rss
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+def login_token(port, username, password):
+    """Log in to a running server and return the session token"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('POST', '/api/login', body=json.dumps({'username': username, 'password': password}),
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = json.loads(response.read())
+    conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"Login as {username} failed: {response.status} {data}")
+    return data['session_id']
+
+def upload_requests(token, size, count=8, seed=0):
+    """Request specs for multipart video uploads of size bytes"""
+    rng = random.Random(seed)
+    boundary = 'benchmark-boundary'
+    requests = []
+    for i in range(count):
+        body = (f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="video"; filename="upload-{i}.mp4"\r\n'
+                f'Content-Type: video/mp4\r\n\r\n').encode() + rng.randbytes(size) + f'\r\n--{boundary}--\r\n'.encode()
+        requests.append(('POST', '/api/upload-video', body, {
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Authorization': f'Bearer {token}'
+        }))
+    return requests
+
+def suite_scenarios(args, port):
+    """Map each suite scenario to (requests, clients) for a running fixture server"""
+    admin_token = login_token(port, *FIXTURE_ADMIN)
+    user_token = login_token(port, 'user0', FIXTURE_PASSWORD) if args.users else admin_token
+    large_size = args.large_video_mb * 1024 * 1024
+    rng = random.Random(0)
+    ranges = []
+    for _ in range(64):
+        start = rng.randrange(max(1, large_size - 1024 * 1024))
+        ranges.append(('GET', '/Videos/large.mp4', None, {'Range': f'bytes={start}-{start + 1024 * 1024 - 1}'}))
+    catalog_pages = [('GET', f'/api/videos?limit=100&sort={sort}', None, {'Authorization': f'Bearer {user_token}'})
+                     for sort in ('date', 'name', 'size')]
+    logins = [('POST', '/api/login', json.dumps({'username': f'user{i}', 'password': FIXTURE_PASSWORD}),
+               {'Content-Type': 'application/json'}) for i in range(max(args.users, 1))] \
+        if args.users else login_requests(*FIXTURE_ADMIN)
+    return {
+        'static_small': (get_requests(['/index.html', '/style.css', '/script.js'] +
+                                      [f'/Assets/asset-{size}k.txt' for size in (1, 4, 16, 64)]), args.clients),
+        # Few clients, as each one holds a whole file transfer
+        'video_large': (get_requests(['/Videos/large.mp4']), min(args.clients, 4)),
+        'video_range': (ranges, args.clients),
+        'api_videos': (catalog_pages, args.clients),
+        'activity_log': ([('GET', '/api/activity-log?limit=50', None, {'Authorization': f'Bearer {admin_token}'})],
+                         args.clients),
+        'uploads': (upload_requests(user_token, args.upload_kb * 1024), min(args.clients, 8)),
+        'login_storm': (logins, args.clients),
+    }
+
+def git_commit():
+    """Commit the benchmarked code is at, marked -dirty for uncommitted changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SCRIPT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+def run_suite(args):
+    """Run each scenario against a fixture server and save the results as JSON"""
+    scenarios = args.scenarios or list(SUITE_SCENARIOS)
+    temp_dir = None
+    fixtures = args.fixtures
+    if fixtures is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='raf-cdn-bench-')
+        fixtures = temp_dir.name
+    try:
+        settings_file = os.path.join(fixtures, 'fixtures.json')
+        if not os.path.exists(settings_file):
+            print(f"Generating fixtures in {fixtures} ...")
+            generate_fixtures(fixtures, args.videos, args.large_video_mb, args.users, args.log_entries)
+        else:
+            # Reused fixtures keep the sizes they were generated with, but
+            # run the code being benchmarked rather than a stale copy
+            with open(settings_file) as f:
+                settings = json.load(f)
+            for key in ('videos', 'large_video_mb', 'users', 'log_entries'):
+                setattr(args, key, settings[key])
+            for name in os.listdir(SCRIPT_DIR):
+                if name.endswith('.py'):
+                    shutil.copy2(os.path.join(SCRIPT_DIR, name), fixtures)
+
+        commit = git_commit()
+        report = {
+            'commit': commit,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'settings': {'clients': args.clients, 'duration': args.duration, 'videos': args.videos,
+                         'large_video_mb': args.large_video_mb, 'users': args.users,
+                         'log_entries': args.log_entries, 'upload_kb': args.upload_kb},
+            'results': {}
+        }
+        print(f"{'config':>6} {'scenario':>13} {'req/s':>9} {'MiB/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+              f"{'p99 ms':>8} {'RSS MiB':>8} {'errors':>7}")
+        for i, (workers, threads) in enumerate(parse_matrix(args.matrix or '1x16')):
+            label = f'{workers}x{threads}'
+            port = args.port + i
+            write_fixture_config(fixtures, workers)
+            proc = start_server(port, workers, threads, server_dir=fixtures)
+            try:
+                requests = suite_scenarios(args, port)
+                results = report['results'][label] = {}
+                for scenario in scenarios:
+                    scenario_requests, clients = requests[scenario]
+                    if scenario != 'uploads':
+                        run_mixed(port, {scenario: (scenario_requests, min(clients, 4))}, 0.5)  # Warm-up
+                    sampler = RSSSampler(proc.pid)
+                    sampler.start()
+                    result = run_mixed(port, {scenario: (scenario_requests, clients)}, args.duration)[scenario]
+                    rss = sampler.stop()
+                    result['clients'] = clients
+                    result['rss_mib'] = rss / (1024 * 1024) if rss is not None else None
+                    result['rss_peak_mib'] = sampler.peak / (1024 * 1024) if sampler.peak is not None else None
+                    results[scenario] = result
+                    peak = f"{result['rss_peak_mib']:>8.1f}" if result['rss_peak_mib'] is not None else f"{'-':>8}"
+                    print(f"{label:>6} {scenario:>13} {result['rps']:>9.1f} {result['mib_per_s']:>8.1f} "
+                          f"{result['p50_ms']:>8.2f} {result['p90_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                          f"{peak} {result['errors']:>7}")
+            finally:
+                stop_server(proc)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    output = args.output or f'benchmark-{commit}.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), report)
+
+def compare_results(baseline, current):
+    """Print how each scenario's throughput, p99 and peak RSS changed since baseline"""
+    def change(old, new):
+        if old is None or new is None or not old:
+            return f"{'-':>8}"
+        return f'{(new - old) / old * 100:>+7.1f}%'
+
+    print(f"\nChanges since {baseline.get('commit', 'baseline')} (req/s up is better; p99 and RSS down)")
+    print(f"{'config':>6} {'scenario':>13} {'req/s':>8} {'p99':>8} {'RSS':>8}")
+    for label, results in current['results'].items():
+        for scenario, result in results.items():
+            old = baseline.get('results', {}).get(label, {}).get(scenario)
+            if old is None:
+                continue
+            print(f"{label:>6} {scenario:>13} {change(old['rps'], result['rps'])} "
+                  f"{change(old['p99_ms'], result['p99_ms'])} "
+                  f"{change(old.get('rss_peak_mib'), result.get('rss_peak_mib'))}")
+
+if __name__ == "__main__":
+    main()
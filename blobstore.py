@@ -0,0 +1,353 @@
+# Content-addressed video storage
+import os
+import re
+import time
+import hashlib
+import secrets
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+from catalog import is_video_file
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+# Blob files with no database row are only removed once this old, so a
+# publish that has renamed its blob into place but not yet committed is safe
+ORPHAN_GRACE = 3600
+
+def is_sha256(value) -> bool:
+    """Whether value is a lowercase hex SHA-256 digest"""
+    return isinstance(value, str) and SHA256_PATTERN.fullmatch(value) is not None
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def same_file(a: str, b: str) -> bool:
+    """Whether two paths are links to the same inode; False if either is missing"""
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+class BlobStore:
+    """Videos stored once per distinct content, keyed by SHA-256.
+
+    Each blob lives under root/sha256/ and every name in the videos
+    directory is a hard link to one, so static serving, the catalog and
+    metadata extraction see ordinary files. SQLite records which blob each
+    name points at and how many names reference each blob; the last name to
+    go takes the blob with it. Changes take an immediate SQLite transaction,
+    which serialises them across threads and pre-forked workers. root and
+    the videos directory must be on the same filesystem.
+    """
+
+    def __init__(self, root: str = '.blobs', videos_dir: str = 'Videos',
+                 db_file: str = 'video_catalog.db', gc_interval: float = 3600):
+        self.root = root
+        self.videos_dir = videos_dir
+        self.db_file = db_file
+        self.gc_interval = gc_interval
+        self.temp_dir = os.path.join(root, 'tmp')
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._stop = threading.Event()
+        self._collector = None
+        os.makedirs(self.temp_dir, exist_ok=True)
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(), so each process opens its own.
+        # Callers hold self._lock.
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refs INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blob_names (
+                name TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blob_names_by_sha256 ON blob_names (sha256);
+        ''')
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[Tuple[sqlite3.Connection, List[str]]]:
+        """Yield a connection inside an immediate transaction and a list of
+        blob paths to delete once it commits"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            doomed = []
+            try:
+                yield conn, doomed
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        for path in doomed:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def blob_path(self, sha256: str) -> str:
+        """Where the blob with this digest is stored"""
+        return os.path.join(self.root, 'sha256', sha256[:2], sha256)
+
+    def has_blob(self, sha256: str, size: int) -> bool:
+        """Whether a blob with this digest and size is stored"""
+        with self._lock:
+            row = self._connect().execute('SELECT size FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        return row is not None and row[0] == size and os.path.exists(self.blob_path(sha256))
+
+    def publish(self, temp_path: str, name: str, sha256: str, size: int) -> Tuple[str, bool]:
+        """Store a fully written file and give it a name in the videos directory.
+
+        temp_path must be on the same filesystem as root; it is moved into
+        the store, or deleted if the content is already there. If name is
+        taken by different content, a numbered variant is used instead.
+        Returns the name the file was published under and whether its
+        content was already stored.
+        """
+        with self._transaction() as (conn, doomed):
+            path = self.blob_path(sha256)
+            row = conn.execute('SELECT size FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            deduplicated = row is not None and os.path.exists(path)
+            if deduplicated:
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                conn.execute('''
+                    INSERT INTO blobs (sha256, size, refs, created_at) VALUES (?, ?, 0, ?)
+                    ON CONFLICT (sha256) DO UPDATE SET size = excluded.size
+                ''', (sha256, size, time.time()))
+            return self._link(conn, doomed, name, sha256), deduplicated
+
+    def link(self, name: str, sha256: str) -> str:
+        """Give a stored blob another name without receiving its content.
+
+        Returns the name used, which is a numbered variant of name if name
+        is taken by different content. Raises KeyError if the blob isn't
+        stored.
+        """
+        with self._transaction() as (conn, doomed):
+            row = conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is None or not os.path.exists(self.blob_path(sha256)):
+                raise KeyError(sha256)
+            return self._link(conn, doomed, name, sha256)
+
+    def _link(self, conn: sqlite3.Connection, doomed: List[str], name: str, sha256: str) -> str:
+        blob = self.blob_path(sha256)
+        stem, ext = os.path.splitext(name)
+        candidate = name
+        number = 1
+        while os.path.lexists(os.path.join(self.videos_dir, candidate)):
+            if same_file(os.path.join(self.videos_dir, candidate), blob):
+                break
+            number += 1
+            candidate = f'{stem}-{number}{ext}'
+        else:
+            self._place_link(blob, candidate)
+        self._record_name(conn, doomed, candidate, sha256)
+        return candidate
+
+    def _place_link(self, blob: str, name: str):
+        # Linked under a hidden name first so the rename replaces atomically
+        temp_link = os.path.join(self.videos_dir, f'.link-{secrets.token_hex(8)}')
+        os.link(blob, temp_link)
+        try:
+            os.replace(temp_link, os.path.join(self.videos_dir, name))
+        except BaseException:
+            os.unlink(temp_link)
+            raise
+
+    def _record_name(self, conn: sqlite3.Connection, doomed: List[str], name: str, sha256: str):
+        row = conn.execute('SELECT sha256 FROM blob_names WHERE name = ?', (name,)).fetchone()
+        if row is not None and row[0] == sha256:
+            return
+        if row is not None:
+            self._release(conn, doomed, row[0])
+        conn.execute('INSERT OR REPLACE INTO blob_names (name, sha256) VALUES (?, ?)', (name, sha256))
+        conn.execute('UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?', (sha256,))
+
+    def _release(self, conn: sqlite3.Connection, doomed: List[str], sha256: str):
+        conn.execute('UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?', (sha256,))
+        if conn.execute('DELETE FROM blobs WHERE sha256 = ? AND refs <= 0', (sha256,)).rowcount:
+            doomed.append(self.blob_path(sha256))
+
+    def unlink(self, name: str) -> bool:
+        """Delete a name from the videos directory and drop its reference.
+
+        The blob is deleted along with its last name. Files that predate the
+        store are simply removed. Returns False if there was no such file.
+        """
+        path = os.path.join(self.videos_dir, name)
+        with self._transaction() as (conn, doomed):
+            row = conn.execute('SELECT sha256 FROM blob_names WHERE name = ?', (name,)).fetchone()
+            try:
+                os.unlink(path)
+                removed = True
+            except FileNotFoundError:
+                removed = False
+            if row is not None:
+                conn.execute('DELETE FROM blob_names WHERE name = ?', (name,))
+                self._release(conn, doomed, row[0])
+        return removed or row is not None
+
+    def migrate(self) -> Dict:
+        """Move existing files in the videos directory into the store.
+
+        Each file is hashed and either adopted as a new blob or replaced by
+        a link to an identical one, which frees its space. Files already in
+        the store are skipped, so the migration can be rerun at any time.
+        Returns counts of files adopted, deduplicated and skipped.
+        """
+        counts = {'adopted': 0, 'deduplicated': 0, 'skipped': 0}
+        if not os.path.isdir(self.videos_dir):
+            return counts
+        with os.scandir(self.videos_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)
+                     and is_video_file(entry.name) and not entry.name.startswith('.')]
+
+        for name in names:
+            path = os.path.join(self.videos_dir, name)
+            with self._lock:
+                row = self._connect().execute('SELECT sha256 FROM blob_names WHERE name = ?', (name,)).fetchone()
+            if row is not None and same_file(path, self.blob_path(row[0])):
+                counts['skipped'] += 1
+                continue
+            try:
+                before = os.stat(path)
+                sha256 = hash_file(path)
+            except OSError as e:
+                print(f"Blob migration error for {name}: {e}")
+                counts['skipped'] += 1
+                continue
+            with self._transaction() as (conn, doomed):
+                # Leave files that changed while they were being hashed for next time
+                try:
+                    after = os.stat(path)
+                except FileNotFoundError:
+                    after = None
+                if after is None or (after.st_ino, after.st_size, after.st_mtime_ns) != \
+                        (before.st_ino, before.st_size, before.st_mtime_ns):
+                    counts['skipped'] += 1
+                    continue
+                blob = self.blob_path(sha256)
+                stored = conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+                if stored is not None and os.path.exists(blob):
+                    self._place_link(blob, name)
+                    counts['deduplicated'] += 1
+                else:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    if os.path.exists(blob):
+                        os.unlink(blob)  # Left behind without a row
+                    os.link(path, blob)
+                    conn.execute('''
+                        INSERT INTO blobs (sha256, size, refs, created_at) VALUES (?, ?, 0, ?)
+                        ON CONFLICT (sha256) DO UPDATE SET size = excluded.size
+                    ''', (sha256, after.st_size, time.time()))
+                    counts['adopted'] += 1
+                self._record_name(conn, doomed, name, sha256)
+        return counts
+
+    def collect(self) -> Dict:
+        """Drop names whose file was deleted or replaced outside the store,
+        blobs nothing references and stale temporary files.
+
+        Returns counts of names and blobs removed.
+        """
+        with self._lock:
+            names = self._connect().execute('SELECT name, sha256 FROM blob_names').fetchall()
+        stale = [(name, sha256) for name, sha256 in names
+                 if not same_file(os.path.join(self.videos_dir, name), self.blob_path(sha256))]
+
+        with self._transaction() as (conn, doomed):
+            for name, sha256 in stale:
+                # Recheck under the lock in case the name was just published
+                if same_file(os.path.join(self.videos_dir, name), self.blob_path(sha256)):
+                    continue
+                if conn.execute('DELETE FROM blob_names WHERE name = ? AND sha256 = ?',
+                                (name, sha256)).rowcount:
+                    self._release(conn, doomed, sha256)
+            known = {sha256 for sha256, in conn.execute('SELECT sha256 FROM blobs')}
+        removed_blobs = len(doomed)
+
+        cutoff = time.time() - ORPHAN_GRACE
+        for parent, _, files in os.walk(os.path.join(self.root, 'sha256')):
+            for filename in files:
+                if filename not in known and self._remove_if_older(os.path.join(parent, filename), cutoff):
+                    removed_blobs += 1
+        for filename in os.listdir(self.temp_dir):
+            self._remove_if_older(os.path.join(self.temp_dir, filename), cutoff)
+        return {'names': len(stale), 'blobs': removed_blobs}
+
+    def _remove_if_older(self, path: str, cutoff: float) -> bool:
+        try:
+            # ctime, unlike mtime, is bumped when a file gains a link
+            if os.stat(path).st_ctime < cutoff:
+                os.unlink(path)
+                return True
+        except OSError:
+            pass
+        return False
+
+    def usage(self) -> Dict:
+        """Disk usage of the store and the space deduplication saves"""
+        with self._lock:
+            conn = self._connect()
+            blobs, stored = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            names, logical = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(b.size), 0)
+                FROM blob_names n JOIN blobs b ON b.sha256 = n.sha256
+            ''').fetchone()
+        return {
+            'names': names,
+            'blobs': blobs,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'saved_bytes': logical - stored,
+            'dedup_ratio': logical / stored if stored else 1.0
+        }
+
+    def start_collector(self):
+        """Run collect() every gc_interval seconds in the background"""
+        if self._collector is not None and self._collector.is_alive():
+            return
+        self._stop.clear()
+        self._collector = threading.Thread(target=self._collect_loop,
+                                           name='blob-store-collector', daemon=True)
+        self._collector.start()
+
+    def stop_collector(self):
+        """Stop the background collector"""
+        self._stop.set()
+        if self._collector is not None:
+            self._collector.join()
+            self._collector = None
+
+    def _collect_loop(self):
+        while not self._stop.wait(self.gc_interval):
+            try:
+                self.collect()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Blob store cleanup error: {e}")
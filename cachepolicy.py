@@ -0,0 +1,54 @@
+# Config-driven Cache-Control rules
+import re
+from typing import Dict, List, Optional
+
+# The cache_control rules used when the config doesn't set any
+DEFAULT_CACHE_RULES = [
+    # Generated directory listings; clients revalidate with the ETag
+    {'suffix': '/', 'value': 'no-cache'},
+    {'suffix': ['.css', '.js'], 'value': 'public, max-age=31536000, immutable'},
+    {'prefix': ['/RAF-Backend/', '/Assets/', '/Videos/'], 'value': 'public, max-age=3600'},
+]
+
+def _alternatives(patterns) -> str:
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not patterns or not all(isinstance(pattern, str) and pattern for pattern in patterns):
+        raise ValueError('prefix and suffix must be non-empty strings or lists of them')
+    return '|'.join(re.escape(pattern) for pattern in patterns)
+
+class CachePolicy:
+    """Cache-Control values for URL paths, from an ordered table of rules.
+
+    Each rule has a value and a prefix and/or suffix (a string or a list of
+    alternatives) that the path must match; the first matching rule wins
+    and paths no rule matches get no header. The whole table is compiled
+    into a single regular expression, so a lookup is one match however many
+    rules there are. Raises ValueError for a malformed table.
+    """
+
+    def __init__(self, rules: Optional[List[Dict]] = None):
+        self.rules = DEFAULT_CACHE_RULES if rules is None else rules
+        branches = []
+        self._values = {}
+        for i, rule in enumerate(self.rules):
+            if not isinstance(rule, dict) or not isinstance(rule.get('value'), str):
+                raise ValueError(f'cache_control rule {i + 1} needs a value')
+            if 'prefix' not in rule and 'suffix' not in rule:
+                raise ValueError(f'cache_control rule {i + 1} needs a prefix or suffix')
+            pattern = ''
+            if 'suffix' in rule:
+                # A lookahead, so a path can match the prefix and suffix of one rule with the same characters
+                pattern += f"(?=.*(?:{_alternatives(rule['suffix'])})$)"
+            if 'prefix' in rule:
+                pattern += f"(?:{_alternatives(rule['prefix'])})"
+            branches.append(f'(?P<r{i}>{pattern})')
+            self._values[f'r{i}'] = rule['value']
+        self._pattern = re.compile('|'.join(branches), re.DOTALL) if branches else None
+
+    def lookup(self, path: str) -> Optional[str]:
+        """Cache-Control value for a URL path without its query string"""
+        if self._pattern is None:
+            return None
+        match = self._pattern.match(path)
+        return self._values[match.lastgroup] if match else None
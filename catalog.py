@@ -0,0 +1,305 @@
+# Indexed video catalog
+import os
+import json
+import time
+import base64
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+# Public sort keys -> indexed columns
+SORT_COLUMNS = {
+    'name': 'name',
+    'size': 'size',
+    'date': 'uploaded_at'
+}
+
+def is_video_file(filename: str) -> bool:
+    """Check whether a filename has one of the supported video extensions"""
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+def encode_cursor(value, name: str) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps([value, name]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Decode a cursor produced by encode_cursor, raising ValueError if invalid"""
+    try:
+        value, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    return value, name
+
+class VideoCatalog:
+    """SQLite index of the files in the videos directory.
+
+    Uploads update the index directly and a background reconciler picks up
+    files added, changed or removed by other means, so listing endpoints
+    never have to scan the directory.
+    """
+
+    def __init__(self, videos_dir: str = 'Videos', db_file: str = 'video_catalog.db',
+                 rescan_interval: float = 60.0):
+        self.videos_dir = videos_dir
+        self.db_file = db_file
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._stop = threading.Event()
+        self._reconciler = None
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(), so each process opens its own.
+        # Callers hold self._lock.
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS videos (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                uploaded_at REAL NOT NULL,
+                owner TEXT
+            );
+            CREATE INDEX IF NOT EXISTS videos_by_date ON videos (uploaded_at, name);
+            CREATE INDEX IF NOT EXISTS videos_by_size ON videos (size, name);
+            CREATE INDEX IF NOT EXISTS videos_by_owner_date ON videos (owner, uploaded_at, name);
+            CREATE INDEX IF NOT EXISTS videos_by_owner_size ON videos (owner, size, name);
+            CREATE TABLE IF NOT EXISTS video_metadata (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                metadata TEXT,
+                error TEXT,
+                extracted_at REAL NOT NULL
+            );
+        ''')
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    def add(self, name: str, owner: Optional[str] = None):
+        """Record a file that was just written to the videos directory"""
+        stat = os.stat(os.path.join(self.videos_dir, name))
+        with self._lock:
+            conn = self._connect()
+            conn.execute('''
+                INSERT INTO videos (name, size, mtime, uploaded_at, owner)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    size = excluded.size,
+                    mtime = excluded.mtime,
+                    uploaded_at = excluded.uploaded_at,
+                    owner = excluded.owner
+            ''', (name, stat.st_size, stat.st_mtime, time.time(), owner))
+            conn.commit()
+
+    def remove(self, name: str):
+        """Drop a file from the index"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM videos WHERE name = ?', (name,))
+            conn.execute('DELETE FROM video_metadata WHERE name = ?', (name,))
+            conn.commit()
+
+    def get(self, name: str) -> Optional[Dict]:
+        """Return one indexed file, or None"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT size, mtime, uploaded_at, owner FROM videos WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        size, mtime, uploaded_at, owner = row
+        return {'name': name, 'size': size, 'mtime': mtime, 'uploaded_at': uploaded_at, 'owner': owner}
+
+    def list_videos(self, owner: Optional[str] = None, sort: str = 'date',
+                    descending: bool = True, min_size: Optional[int] = None,
+                    max_size: Optional[int] = None, since: Optional[float] = None,
+                    until: Optional[float] = None, cursor: Optional[str] = None,
+                    limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """Return one page of videos and the cursor for the next page.
+
+        Pages use keyset pagination on (sort column, name), so the cost of a
+        query depends on the page size rather than the catalog size.
+        Raises ValueError for an unknown sort key or a malformed cursor.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f'Unknown sort key: {sort}')
+        column = SORT_COLUMNS[sort]
+        direction = 'DESC' if descending else 'ASC'
+        op = '<' if descending else '>'
+
+        clauses = []
+        params = []
+        if owner is not None:
+            clauses.append('owner = ?')
+            params.append(owner)
+        if min_size is not None:
+            clauses.append('size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('size <= ?')
+            params.append(max_size)
+        if since is not None:
+            clauses.append('uploaded_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('uploaded_at <= ?')
+            params.append(until)
+        if cursor:
+            value, name = decode_cursor(cursor)
+            if column == 'name':
+                clauses.append(f'name {op} ?')
+                params.append(name)
+            else:
+                clauses.append(f'({column} {op} ? OR ({column} = ? AND name {op} ?))')
+                params.extend([value, value, name])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        order = f'{column} {direction}' if column == 'name' else f'{column} {direction}, name {direction}'
+        query = f'''
+            SELECT name, size, mtime, uploaded_at, owner FROM videos
+            {where} ORDER BY {order} LIMIT ?
+        '''
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[{'name': 0, 'size': 1, 'uploaded_at': 3}[column]], last[0])
+
+        metadata = self.get_metadata([(name, size, mtime) for name, size, mtime, _, _ in rows])
+        videos = [{
+            'name': name,
+            'size': size,
+            'mtime': mtime,
+            'uploaded_at': uploaded_at,
+            'owner': owner,
+            'metadata': metadata.get(name)
+        } for name, size, mtime, uploaded_at, owner in rows]
+        return videos, next_cursor
+
+    def get_metadata(self, files: List[Tuple[str, int, float]]) -> Dict[str, Dict]:
+        """Return extracted metadata for (name, size, mtime) tuples.
+
+        Files without metadata, or whose metadata was taken from a different
+        version of the file, are left out.
+        """
+        if not files:
+            return {}
+        current = {name: (size, mtime) for name, size, mtime in files}
+        placeholders = ','.join('?' * len(current))
+        with self._lock:
+            rows = self._connect().execute(f'''
+                SELECT name, size, mtime, metadata FROM video_metadata
+                WHERE name IN ({placeholders}) AND metadata IS NOT NULL
+            ''', list(current)).fetchall()
+        return {name: json.loads(metadata) for name, size, mtime, metadata in rows
+                if current[name] == (size, mtime)}
+
+    def has_metadata(self, name: str, size: int, mtime: float) -> bool:
+        """Whether extraction already ran, successfully or not, on this version of a file"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT 1 FROM video_metadata WHERE name = ? AND size = ? AND mtime = ?',
+                (name, size, mtime)).fetchone()
+        return row is not None
+
+    def set_metadata(self, name: str, size: int, mtime: float, metadata: Optional[Dict],
+                     error: Optional[str] = None):
+        """Store the outcome of extracting metadata from one version of a file"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('''
+                INSERT OR REPLACE INTO video_metadata (name, size, mtime, metadata, error, extracted_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (name, size, mtime, json.dumps(metadata) if metadata is not None else None,
+                  error, time.time()))
+            conn.commit()
+
+    def missing_metadata(self, limit: int = 1000) -> List[str]:
+        """Names of catalogued videos with no extraction for their current version"""
+        with self._lock:
+            rows = self._connect().execute('''
+                SELECT v.name FROM videos v
+                LEFT JOIN video_metadata m ON m.name = v.name AND m.size = v.size AND m.mtime = v.mtime
+                WHERE m.name IS NULL ORDER BY v.uploaded_at DESC LIMIT ?
+            ''', (limit,)).fetchall()
+        return [name for name, in rows]
+
+    def reconcile(self) -> Dict:
+        """Bring the index in line with the videos directory.
+
+        Returns counts of added, updated and removed entries.
+        """
+        on_disk = {}
+        if os.path.isdir(self.videos_dir):
+            with os.scandir(self.videos_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and is_video_file(entry.name):
+                        stat = entry.stat()
+                        on_disk[entry.name] = (stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            conn = self._connect()
+            indexed = {name: (size, mtime) for name, size, mtime
+                       in conn.execute('SELECT name, size, mtime FROM videos')}
+
+            added = [(name, size, mtime, mtime) for name, (size, mtime) in on_disk.items()
+                     if name not in indexed]
+            updated = [(size, mtime, name) for name, (size, mtime) in on_disk.items()
+                       if name in indexed and indexed[name] != (size, mtime)]
+            # A file missing from the scan may have been uploaded since
+            removed = [(name,) for name in indexed if name not in on_disk
+                       and not os.path.exists(os.path.join(self.videos_dir, name))]
+
+            # Files written by add() between the scan and this point are
+            # left alone by the conflict clause
+            conn.executemany('''
+                INSERT INTO videos (name, size, mtime, uploaded_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO NOTHING
+            ''', added)
+            conn.executemany('UPDATE videos SET size = ?, mtime = ? WHERE name = ?', updated)
+            conn.executemany('DELETE FROM videos WHERE name = ?', removed)
+            conn.executemany('DELETE FROM video_metadata WHERE name = ?', removed)
+            conn.commit()
+
+        return {'added': len(added), 'updated': len(updated), 'removed': len(removed)}
+
+    def start_reconciler(self):
+        """Reconcile now and then every rescan_interval seconds in the background"""
+        if self._reconciler is not None and self._reconciler.is_alive():
+            return
+        self._stop.clear()
+        self._reconciler = threading.Thread(target=self._reconcile_loop,
+                                            name='video-catalog-reconciler', daemon=True)
+        self._reconciler.start()
+
+    def stop_reconciler(self):
+        """Stop the background reconciler"""
+        self._stop.set()
+        if self._reconciler is not None:
+            self._reconciler.join()
+            self._reconciler = None
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                self.reconcile()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Catalog reconcile error: {e}")
+            if self._stop.wait(self.rescan_interval):
+                return
@@ -0,0 +1,217 @@
+# Compressed static asset delivery
+import os
+import zlib
+import gzip
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing; anything else (video, images, archives)
+# is assumed to be compressed already
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+)
+
+# Suffixes for each supported Content-Encoding, in order of preference
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'} if brotli else {'gzip': '.gz'}
+
+def is_compressible(content_type: str) -> bool:
+    """Whether a content type benefits from compression"""
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Parse Accept-Encoding into {coding: qvalue}"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+def negotiate_encoding(header: Optional[str]) -> Optional[str]:
+    """Pick the best supported encoding the client accepts, or None"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in ENCODING_SUFFIXES:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """Compress a whole payload at the highest level for the encoding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+class StreamCompressor:
+    """Incremental compressor for responses too large to precompress"""
+
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=5)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        else:
+            # wbits=31 selects the gzip container
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def finish(self) -> bytes:
+        return self._flush()
+
+class CompressedAssetCache:
+    """Sidecar cache of precompressed static files keyed by content hash.
+
+    Compressed copies live in cache_dir as <sha256><suffix>, so identical
+    files share one copy and a changed file gets a new one. An in-memory
+    index maps each source path and stat key to its sidecars.
+    """
+
+    def __init__(self, cache_dir: str = '.compressed', min_size: int = 256,
+                 max_size: int = 10 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.min_size = min_size
+        self.max_size = max_size
+        self._index = {}  # path -> (stat key, {encoding: sidecar path})
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def sidecars(self, path: str, fs: os.stat_result) -> Dict[str, str]:
+        """Return {encoding: sidecar path} for a file, building them if needed.
+
+        Returns an empty dict for files outside the precompression size
+        range; those are compressed on the fly instead.
+        """
+        if not self.min_size <= fs.st_size <= self.max_size:
+            return {}
+        key = (fs.st_ino, fs.st_mtime_ns, fs.st_size)
+        with self._lock:
+            entry = self._index.get(path)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+            build_lock = self._build_locks.setdefault(path, threading.Lock())
+
+        # Only one thread compresses a given file; the rest wait for it
+        with build_lock:
+            with self._lock:
+                entry = self._index.get(path)
+                if entry is not None and entry[0] == key:
+                    return entry[1]
+            sidecars = self._build(path)
+            with self._lock:
+                self._index[path] = (key, sidecars)
+        return sidecars
+
+    def forget(self, path: str):
+        """Drop a file's sidecars from the index, e.g. after they were deleted"""
+        with self._lock:
+            self._index.pop(path, None)
+
+    def _build(self, path: str) -> Dict[str, str]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        sidecars = {}
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            sidecar = os.path.join(self.cache_dir, digest + suffix)
+            if not os.path.exists(sidecar):
+                compressed = compress_bytes(data, encoding)
+                if len(compressed) >= len(data):
+                    continue  # Not worth it
+                fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(compressed)
+                os.replace(temp_path, sidecar)
+            sidecars[encoding] = sidecar
+        return sidecars
+
+    def precompress(self, paths: Iterable[str]) -> Tuple[int, int]:
+        """Build sidecars for every eligible file among paths and the trees under them.
+
+        Hidden files and directories and symlinks are skipped, as are files
+        that can't be read. Sidecars no longer belonging to any file are
+        deleted. Returns the number of files processed and the total bytes
+        saved by the best encoding.
+        """
+        files = 0
+        saved = 0
+        live = set()
+        for path in self._walk(paths):
+            try:
+                fs = os.stat(path)
+                sidecars = self.sidecars(path, fs)
+            except OSError as e:
+                print(f"Precompression error for {path}: {e}")
+                continue
+            if sidecars:
+                files += 1
+                live.update(sidecars.values())
+                saved += fs.st_size - min(os.path.getsize(s) for s in sidecars.values())
+        self._remove_stale(live)
+        return files, saved
+
+    def _walk(self, paths: Iterable[str]):
+        # Regular, compressible, non-hidden files; symlinks are never followed
+        cache_dir = os.path.abspath(self.cache_dir)
+        for root in paths:
+            if os.path.islink(root):
+                continue
+            if os.path.isfile(root):
+                candidates = [os.path.abspath(root)]
+            else:
+                candidates = []
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames[:] = [d for d in dirnames if not d.startswith('.')
+                                   and not os.path.islink(os.path.join(dirpath, d))
+                                   and os.path.abspath(os.path.join(dirpath, d)) != cache_dir]
+                    candidates.extend(os.path.abspath(os.path.join(dirpath, filename))
+                                      for filename in filenames if not filename.startswith('.'))
+            for path in candidates:
+                content_type = mimetypes.guess_type(path)[0] or ''
+                if is_compressible(content_type) and not os.path.islink(path):
+                    yield path
+
+    def _remove_stale(self, live):
+        # Sidecars of files that were deleted, changed or are no longer served
+        with self._lock:
+            for _, sidecars in self._index.values():
+                live.update(sidecars.values())
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            sidecar = os.path.join(self.cache_dir, name)
+            if sidecar in live:
+                continue
+            try:
+                os.unlink(sidecar)
+            except OSError as e:
+                print(f"Precompression error for {sidecar}: {e}")
@@ -0,0 +1,223 @@
+# Static file metadata and content caches
+import os
+import threading
+import email.utils
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional
+
+class FileMetadata(NamedTuple):
+    """Validators and headers derived from one version of a file"""
+    size: int
+    mtime: float
+    etag: str
+    content_type: str
+    last_modified: str
+
+def make_etag(fs: os.stat_result) -> str:
+    """Build a strong ETag from the inode, mtime and size of a file"""
+    return f'"{fs.st_ino:x}-{fs.st_mtime_ns:x}-{fs.st_size:x}"'
+
+class FileMetadataCache:
+    """Thread-safe LRU cache of path -> FileMetadata keyed by stat results.
+
+    An entry is only reused while the file's inode, mtime and size are
+    unchanged, so a modified file is picked up on the next request without
+    any explicit invalidation.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        # path -> (stat key, FileMetadata)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, fs: os.stat_result,
+            guess_type: Callable[[str], str]) -> FileMetadata:
+        """Return metadata for path, rebuilding it if the file has changed"""
+        key = (fs.st_ino, fs.st_mtime_ns, fs.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        metadata = FileMetadata(
+            size=fs.st_size,
+            mtime=fs.st_mtime,
+            etag=make_etag(fs),
+            content_type=guess_type(path),
+            last_modified=email.utils.formatdate(fs.st_mtime, usegmt=True)
+        )
+        with self._lock:
+            self._entries[path] = (key, metadata)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def invalidate(self, path: Optional[str] = None):
+        """Forget one path, or every entry when path is None"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        """Counters for monitoring"""
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate
+        }
+
+class HotFile(NamedTuple):
+    """A small file held entirely in memory, with its encoded variants"""
+    path: str
+    stat_key: tuple
+    metadata: FileMetadata
+    body: bytes
+    variants: Dict[str, bytes]  # Content-Encoding -> compressed body
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+class HotFileCache:
+    """Byte-bounded LRU cache of small static files keyed by URL path.
+
+    Hits are answered from memory without touching the filesystem. A
+    background thread re-stats cached files every revalidate_interval
+    seconds and drops any that changed or disappeared.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_file_size: int = 1024 * 1024,
+                 revalidate_interval: float = 1.0):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self._entries = OrderedDict()  # URL path -> HotFile
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._revalidator = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url_path: str) -> Optional[HotFile]:
+        """Return the cached file for a URL path, or None"""
+        with self._lock:
+            entry = self._entries.get(url_path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url_path)
+            self.hits += 1
+            return entry
+
+    def load(self, url_path: str, path: str, metadata: FileMetadata,
+             sidecars: Optional[Dict[str, str]] = None) -> Optional[HotFile]:
+        """Read a file and its compressed sidecars into the cache.
+
+        Returns None, caching nothing, if the file is too large or has
+        changed since metadata was taken.
+        """
+        if metadata.size > self.max_file_size or metadata.size > self.max_bytes:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                fs = os.fstat(f.fileno())
+                body = f.read()
+            variants = {}
+            for encoding, sidecar in (sidecars or {}).items():
+                with open(sidecar, 'rb') as f:
+                    variants[encoding] = f.read()
+        except OSError:
+            return None
+        if make_etag(fs) != metadata.etag:
+            return None
+
+        entry = HotFile(path, (fs.st_ino, fs.st_mtime_ns, fs.st_size), metadata, body, variants)
+        with self._lock:
+            old = self._entries.pop(url_path, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[url_path] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def invalidate_file(self, path: str):
+        """Drop every URL that maps to the given file"""
+        with self._lock:
+            for url_path in [u for u, e in self._entries.items() if e.path == path]:
+                self._bytes -= self._entries.pop(url_path).nbytes
+
+    def revalidate(self) -> int:
+        """Drop entries whose files changed on disk; returns how many"""
+        with self._lock:
+            entries = list(self._entries.items())
+        stale = []
+        for url_path, entry in entries:
+            try:
+                fs = os.stat(entry.path)
+                if (fs.st_ino, fs.st_mtime_ns, fs.st_size) == entry.stat_key:
+                    continue
+            except OSError:
+                pass
+            stale.append((url_path, entry))
+        with self._lock:
+            for url_path, entry in stale:
+                if self._entries.get(url_path) is entry:
+                    del self._entries[url_path]
+                    self._bytes -= entry.nbytes
+        return len(stale)
+
+    def start_revalidator(self):
+        """Re-stat cached files every revalidate_interval seconds in the background"""
+        if self._revalidator is not None and self._revalidator.is_alive():
+            return
+        self._stop.clear()
+        self._revalidator = threading.Thread(target=self._revalidate_loop,
+                                             name='hot-file-revalidator', daemon=True)
+        self._revalidator.start()
+
+    def stop_revalidator(self):
+        """Stop the background revalidator"""
+        self._stop.set()
+        if self._revalidator is not None:
+            self._revalidator.join()
+            self._revalidator = None
+
+    def _revalidate_loop(self):
+        while not self._stop.wait(self.revalidate_interval):
+            self.revalidate()
+
+    def stats(self) -> Dict:
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
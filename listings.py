@@ -0,0 +1,503 @@
+# Directory listings kept current by a filesystem watcher
+import os
+import sys
+import html
+import errno
+import ctypes
+import bisect
+import select
+import stat
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+from catalog import decode_cursor, encode_cursor, is_video_file
+from compression import compress_bytes
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# wd, mask, cookie, length of the name that follows
+EVENT_HEADER = struct.Struct('iIII')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico')
+
+def parse_directories_config(text: str) -> List[Dict]:
+    """Parse directories.config lines of the form name|icon|url.
+
+    Blank lines and # comments are skipped, as are malformed lines.
+    """
+    directories = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) != 3 or not all(parts):
+            continue
+        name, icon, url = parts
+        directories.append({'name': name, 'icon': icon, 'url': url})
+    return directories
+
+def entry_icon(name: str, is_dir: bool) -> str:
+    """Emoji shown next to an entry in an HTML listing"""
+    if is_dir:
+        return '📁'
+    lower = name.lower()
+    if is_video_file(lower):
+        return '🎥'
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return '🖼️'
+    return '📄'
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify.
+
+    Raises OSError where inotify is unavailable, so callers can fall back
+    to polling.
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = self._check(self._init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    @staticmethod
+    def _check(result: int) -> int:
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watch a directory and return its watch descriptor"""
+        return self._check(self._add_watch(self.fd, os.fsencode(path), mask))
+
+    def remove_watch(self, wd: int):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Wait up to timeout seconds and return (wd, mask, name) events"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryListing:
+    """The visible entries of one directory, updated one entry at a time.
+
+    Entries are kept in a dict and a sorted key list (directories first,
+    then by name), so a change costs one stat and one list insertion rather
+    than a rescan and a sort. The ETag and rendered HTML are derived from
+    the entries and rebuilt only after they change.
+    """
+
+    def __init__(self, path: str, url: str):
+        self.path = path
+        self.url = quote(url)
+        self._entries = {}  # name -> (is_dir, size, mtime)
+        self._keys = []  # sorted (not is_dir, name)
+        self._etag = None
+        self._html = {}  # (title, icon, encoding or None) -> rendered page
+        self._lock = threading.Lock()
+        self.scan()
+
+    def _stat(self, name: str) -> Optional[Tuple[bool, int, float]]:
+        try:
+            st = os.stat(os.path.join(self.path, name))
+        except OSError:
+            return None
+        is_dir = stat.S_ISDIR(st.st_mode)
+        return is_dir, 0 if is_dir else st.st_size, st.st_mtime
+
+    def _set(self, name: str, entry: Optional[Tuple[bool, int, float]]) -> bool:
+        # Callers hold self._lock
+        old = self._entries.get(name)
+        if old == entry:
+            return False
+        if old is not None:
+            key = (not old[0], name)
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            del self._entries[name]
+        if entry is not None:
+            bisect.insort(self._keys, (not entry[0], name))
+            self._entries[name] = entry
+        self._etag = None
+        self._html = {}
+        return True
+
+    def update(self, name: str) -> bool:
+        """Re-read one entry after a change; returns whether it differed"""
+        if name.startswith('.'):
+            return False
+        entry = self._stat(name)
+        with self._lock:
+            return self._set(name, entry)
+
+    def scan(self) -> bool:
+        """Compare every entry with the directory; returns whether any changed"""
+        found = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    found[entry.name] = (is_dir, 0 if is_dir else st.st_size, st.st_mtime)
+        except OSError:
+            pass
+        changed = False
+        with self._lock:
+            for name in [name for name in self._entries if name not in found]:
+                changed |= self._set(name, None)
+            for name, entry in found.items():
+                changed |= self._set(name, entry)
+        return changed
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def etag(self) -> str:
+        """Strong ETag derived from the entries, the same in every process"""
+        with self._lock:
+            if self._etag is None:
+                digest = hashlib.sha256()
+                for _, name in self._keys:
+                    digest.update(repr((name,) + self._entries[name]).encode('utf-8'))
+                self._etag = f'"{digest.hexdigest()[:32]}"'
+            return self._etag
+
+    def html_etag(self, title: str, icon: str) -> str:
+        """ETag of the HTML page, which also depends on its title and icon"""
+        digest = hashlib.sha256(f'{self.etag}\n{title}\n{icon}'.encode('utf-8'))
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def _describe(self, name: str) -> Dict:
+        is_dir, size, mtime = self._entries[name]
+        return {
+            'name': name,
+            'type': 'directory' if is_dir else 'file',
+            'size': size,
+            'mtime': mtime,
+            'url': self.url + quote(name) + ('/' if is_dir else '')
+        }
+
+    def page(self, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """Return up to limit entries after cursor and the cursor for the next page.
+
+        Raises ValueError for a malformed cursor.
+        """
+        start_key = None
+        if cursor:
+            is_file, name = decode_cursor(cursor)
+            start_key = (bool(is_file), str(name))
+        with self._lock:
+            start = bisect.bisect_right(self._keys, start_key) if start_key else 0
+            keys = self._keys[start:start + limit + 1]
+            entries = [self._describe(name) for _, name in keys[:limit]]
+        next_cursor = encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+        return entries, next_cursor
+
+    def render(self, title: str, icon: str, encoding: Optional[str] = None) -> bytes:
+        """The listing as an HTML page, compressed with encoding if given"""
+        with self._lock:
+            body = self._html.get((title, icon, encoding))
+            if body is not None:
+                return body
+            body = self._html.get((title, icon, None))
+            if body is None:
+                body = self._html[title, icon, None] = self._render_html(title, icon)
+            if encoding:
+                body = self._html[title, icon, encoding] = compress_bytes(body, encoding)
+            return body
+
+    def _render_html(self, title: str, icon: str) -> bytes:
+        # Callers hold self._lock
+        items = []
+        for _, name in self._keys:
+            is_dir, size, _ = self._entries[name]
+            href = quote(name) + ('/' if is_dir else '')
+            label = html.escape(name + ('/' if is_dir else ''))
+            detail = '' if is_dir else f'<span class="file-size">{format_size(size)}</span>'
+            items.append(f'            <div class="file-item">\n'
+                         f'                <span class="file-icon">{entry_icon(name, is_dir)}</span>\n'
+                         f'                <a href="{href}">{label}</a>{detail}\n'
+                         f'            </div>')
+        if not items:
+            items.append('            <div class="file-item">This directory is empty.</div>')
+        title = html.escape(title)
+        page = f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title} Directory - RAF-CDN</title>
+    <link rel="stylesheet" href="/style.css">
+    <style>
+        .back-link {{
+            display: inline-block;
+            margin-bottom: 20px;
+            padding: 10px 15px;
+            background: #667eea;
+            color: white;
+            text-decoration: none;
+            border-radius: 8px;
+        }}
+        .file-list {{
+            background: rgba(255, 255, 255, 0.95);
+            padding: 20px;
+            border-radius: 15px;
+            box-shadow: 0 4px 16px rgba(0, 0, 0, 0.1);
+        }}
+        .file-item {{
+            padding: 10px;
+            border-bottom: 1px solid #eee;
+            display: flex;
+            align-items: center;
+            gap: 10px;
+        }}
+        .file-item:last-child {{
+            border-bottom: none;
+        }}
+        .file-icon {{
+            font-size: 1.5rem;
+        }}
+        .file-size {{
+            margin-left: auto;
+            color: #718096;
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <header>
+            <h1>{html.escape(icon)} {title} Directory</h1>
+            <h2>{len(self._keys)} item(s)</h2>
+        </header>
+
+        <a href="../" class="back-link">← Back</a>
+
+        <div class="file-list">
+{chr(10).join(items)}
+        </div>
+    </div>
+</body>
+</html>
+'''
+        return page.encode('utf-8')
+
+class ListingCache:
+    """Cached directory listings and the parsed directories.config.
+
+    Listings are built on first request and then kept current by a watcher
+    thread: inotify on Linux, so each change updates just the entry it
+    names, or else a rescan of each cached directory every poll_interval
+    seconds. Requests never scan a directory themselves. At most
+    max_directories listings are cached, least recently used first out.
+    directories.config is parsed once and re-read only when it changes.
+    """
+
+    def __init__(self, config_file: str = 'Public/directories.config',
+                 max_directories: int = 256, poll_interval: float = 2.0):
+        self.config_file = os.path.abspath(config_file)
+        self.max_directories = max_directories
+        self.poll_interval = poll_interval
+        self.directories = []
+        self.prefixes = ()
+        self.config_etag = None
+        self._config_mtime = None
+        self._listings = OrderedDict()  # absolute path -> DirectoryListing
+        self._watches = {}  # watch descriptor -> absolute directory path
+        self._lock = threading.Lock()
+        self._inotify = None
+        self._stop = threading.Event()
+        self._watcher = None
+        self.reload_config()
+
+    def reload_config(self) -> bool:
+        """Parse directories.config if it changed; returns whether it did"""
+        try:
+            with open(self.config_file, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                if mtime == self._config_mtime:
+                    return False
+                data = f.read()
+        except OSError:
+            data, mtime = b'', None
+        directories = parse_directories_config(data.decode('utf-8', 'replace'))
+        self.directories = directories
+        # Local trees the config names, for the server to serve and list;
+        # never the server root
+        self.prefixes = tuple(directory['url'].rstrip('/') + '/' for directory in directories
+                              if directory['url'].startswith('/') and directory['url'].strip('/'))
+        self.config_etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+        self._config_mtime = mtime
+        return True
+
+    def describe(self, url: str) -> Tuple[str, str]:
+        """Title and icon for a directory URL, from directories.config when listed"""
+        for directory in self.directories:
+            if directory['url'].rstrip('/') == url.rstrip('/'):
+                return directory['name'], directory['icon']
+        return url.rstrip('/').rsplit('/', 1)[-1] or '/', '📁'
+
+    def get(self, path: str, url: str) -> DirectoryListing:
+        """The listing of the directory at path, served at the decoded URL path url"""
+        path = os.path.abspath(path)
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None:
+                self._listings.move_to_end(path)
+                return listing
+        listing = DirectoryListing(path, url)
+        with self._lock:
+            existing = self._listings.get(path)
+            if existing is not None:
+                return existing
+            self._listings[path] = listing
+            self._watch(path)
+            while len(self._listings) > self.max_directories:
+                evicted, _ = self._listings.popitem(last=False)
+                self._unwatch(evicted)
+        return listing
+
+    def _watch(self, path: str):
+        # Callers hold self._lock
+        if self._inotify is None:
+            return
+        try:
+            self._watches[self._inotify.add_watch(path)] = path
+        except OSError as e:
+            print(f"Listing watch error for {path}: {e}")
+
+    def _unwatch(self, path: str):
+        # Callers hold self._lock. The config directory stays watched.
+        if self._inotify is None or path == os.path.dirname(self.config_file):
+            return
+        for wd, watched in list(self._watches.items()):
+            if watched == path:
+                del self._watches[wd]
+                self._inotify.remove_watch(wd)
+
+    def start(self):
+        """Start the watcher thread in the serving process"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        try:
+            self._inotify = Inotify()
+        except OSError:
+            self._inotify = None
+        with self._lock:
+            self._watches = {}
+            self._watch(os.path.dirname(self.config_file))
+            for path in self._listings:
+                self._watch(path)
+            listings = list(self._listings.values())
+        # Catch up on anything that changed before the watches existed
+        for listing in listings:
+            listing.scan()
+        self.reload_config()
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, name='listing-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """Stop the watcher thread"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _watch_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._inotify is not None:
+                    self._handle_events(self._inotify.read_events(0.5))
+                else:
+                    self.poll()
+                    self._stop.wait(self.poll_interval)
+            except OSError as e:
+                print(f"Listing watcher error: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _handle_events(self, events: List[Tuple[int, int, str]]):
+        config_dir, config_name = os.path.split(self.config_file)
+        # Coalesce bursts so each entry is re-read once
+        changed = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.poll()
+                return
+            with self._lock:
+                path = self._watches.get(wd)
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) and path is not None:
+                    self._watches.pop(wd, None)
+                    self._listings.pop(path, None)
+                    continue
+            if path is not None and name:
+                changed.add((path, name))
+        for path, name in changed:
+            if path == config_dir and name == config_name:
+                self.reload_config()
+            with self._lock:
+                listing = self._listings.get(path)
+            if listing is not None:
+                listing.update(name)
+
+    def poll(self):
+        """Rescan every cached listing and check directories.config"""
+        self.reload_config()
+        with self._lock:
+            listings = list(self._listings.values())
+        for listing in listings:
+            listing.scan()
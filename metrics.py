@@ -0,0 +1,331 @@
+# Request metrics and sampling profiler
+import os
+import sys
+import json
+import time
+import bisect
+import tempfile
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+# Seconds; request latency
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Seconds; one PBKDF2 derivation
+PBKDF2_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Bytes per second; 1 MiB/s to 1 GiB/s
+THROUGHPUT_BUCKETS = tuple(float(2 ** n * 1024 * 1024) for n in range(11))
+
+# Innermost functions of threads that are blocked waiting for work
+IDLE_FUNCTIONS = frozenset(('wait', 'select', 'poll', 'accept', '_worker'))
+
+def format_labels(**labels) -> str:
+    """Render labels as the inside of a Prometheus label set"""
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                     .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels.items())
+
+class Histogram:
+    """Prometheus-style histogram; the owner is responsible for locking"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum}
+
+def merge_snapshots(snapshots: List[Dict]) -> Dict:
+    """Add up snapshots from several processes, sample by sample.
+
+    Families marked merge='max' describe state the processes share, so
+    the largest value is kept instead of the sum.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {'type': family['type'], 'help': family['help'],
+                                              'merge': family.get('merge', 'sum'), 'samples': {}})
+            for labels, value in family['samples'].items():
+                current = target['samples'].get(labels)
+                if current is None:
+                    target['samples'][labels] = json.loads(json.dumps(value))
+                elif family['type'] == 'histogram':
+                    current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                    current['sum'] += value['sum']
+                elif target['merge'] == 'max':
+                    target['samples'][labels] = max(current, value)
+                else:
+                    target['samples'][labels] = current + value
+    return merged
+
+def render_snapshot(snapshot: Dict) -> str:
+    """Format a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for name in sorted(snapshot):
+        family = snapshot[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family['samples'].items()):
+            if family['type'] != 'histogram':
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+                continue
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(value['buckets'] + ['+Inf'], value['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f"{name}_sum{suffix} {value['sum']}")
+            lines.append(f"{name}_count{suffix} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+class Metrics:
+    """Process-wide request metrics, exported in Prometheus text format.
+
+    Recording a request takes one lock and a few dictionary updates.
+    Component gauges (caches, sessions, hashing) are pulled from collectors
+    only when a snapshot is taken. With pre-forked workers, set share_dir:
+    each worker then writes its snapshot there periodically and render()
+    adds up every live worker's numbers.
+    """
+
+    def __init__(self, prefix: str = 'raf_cdn', share_dir: Optional[str] = None,
+                 share_interval: float = 5.0):
+        self.prefix = prefix
+        self.share_dir = share_dir
+        self.share_interval = share_interval
+        self.started = time.time()
+        self.active_connections = 0
+        self._requests = Counter()  # (route, status) -> requests
+        self._latency = {}  # route -> Histogram
+        self._bytes = Counter()  # route -> response body bytes
+        self._upload_bytes = 0
+        self._upload_seconds = 0.0
+        self._upload_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sharer = None
+
+    def add_collector(self, collector: Callable[[], Dict]):
+        """Register a callable returning {name: (type, help, {labels: value})}.
+
+        A fourth element of 'max' marks a value shared between processes.
+        """
+        self._collectors.append(collector)
+
+    def observe_request(self, route: str, status: int, seconds: float, nbytes: int):
+        """Record one finished request"""
+        with self._lock:
+            self._requests[(route, status)] += 1
+            histogram = self._latency.get(route)
+            if histogram is None:
+                histogram = self._latency[route] = Histogram()
+            histogram.observe(seconds)
+            if nbytes:
+                self._bytes[route] += nbytes
+
+    def observe_upload(self, nbytes: int, seconds: float):
+        """Record one completed upload"""
+        with self._lock:
+            self._upload_bytes += nbytes
+            self._upload_seconds += seconds
+            if seconds > 0:
+                self._upload_throughput.observe(nbytes / seconds)
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def snapshot(self) -> Dict:
+        """This process's metrics as {name: {'type', 'help', 'samples'}}"""
+        p = self.prefix
+        with self._lock:
+            snapshot = {
+                f'{p}_requests_total': {
+                    'type': 'counter', 'help': 'HTTP requests by route and status',
+                    'samples': {format_labels(route=route, status=status): count
+                                for (route, status), count in self._requests.items()}},
+                f'{p}_request_duration_seconds': {
+                    'type': 'histogram', 'help': 'Time from request to the end of the response',
+                    'samples': {format_labels(route=route): histogram.snapshot()
+                                for route, histogram in self._latency.items()}},
+                f'{p}_response_bytes_total': {
+                    'type': 'counter', 'help': 'Response body bytes sent by route',
+                    'samples': {format_labels(route=route): nbytes for route, nbytes in self._bytes.items()}},
+                f'{p}_active_connections': {
+                    'type': 'gauge', 'help': 'Open client connections',
+                    'samples': {'': self.active_connections}},
+                f'{p}_upload_bytes_total': {
+                    'type': 'counter', 'help': 'Bytes received in completed uploads',
+                    'samples': {'': self._upload_bytes}},
+                f'{p}_upload_seconds_total': {
+                    'type': 'counter', 'help': 'Time spent receiving completed uploads',
+                    'samples': {'': self._upload_seconds}},
+                f'{p}_upload_throughput_bytes_per_second': {
+                    'type': 'histogram', 'help': 'Average throughput of each completed upload',
+                    'samples': {'': self._upload_throughput.snapshot()}},
+            }
+        snapshot[f'{p}_uptime_seconds'] = {
+            'type': 'gauge', 'help': 'Seconds since the server started',
+            'samples': {'': time.time() - self.started}}
+        for collector in self._collectors:
+            for name, (kind, help_text, samples, *merge) in collector().items():
+                snapshot[f'{p}_{name}'] = {'type': kind, 'help': help_text, 'samples': samples,
+                                           'merge': merge[0] if merge else 'sum'}
+        return snapshot
+
+    def render(self) -> str:
+        """Prometheus text for this process, plus other workers when sharing"""
+        snapshots = [self.snapshot()]
+        if self.share_dir:
+            snapshots.extend(self._read_shared())
+        return render_snapshot(merge_snapshots(snapshots))
+
+    def _read_shared(self) -> List[Dict]:
+        snapshots = []
+        try:
+            names = os.listdir(self.share_dir)
+        except OSError:
+            return snapshots
+        for name in names:
+            pid, _, ext = name.partition('.')
+            if ext != 'json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.share_dir, name)
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                # A worker that died without cleaning up
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def write_shared(self):
+        """Publish this process's snapshot for the other workers"""
+        fd, temp_path = tempfile.mkstemp(dir=self.share_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, os.path.join(self.share_dir, f'{os.getpid()}.json'))
+
+    def start_sharing(self):
+        """Write snapshots to share_dir every share_interval seconds"""
+        if not self.share_dir or (self._sharer is not None and self._sharer.is_alive()):
+            return
+        self._stop.clear()
+        self._sharer = threading.Thread(target=self._share_loop, name='metrics-sharer', daemon=True)
+        self._sharer.start()
+
+    def stop_sharing(self):
+        """Stop sharing and withdraw this process's snapshot"""
+        self._stop.set()
+        if self._sharer is not None:
+            self._sharer.join()
+            self._sharer = None
+            try:
+                os.remove(os.path.join(self.share_dir, f'{os.getpid()}.json'))
+            except OSError:
+                pass
+
+    def _share_loop(self):
+        while True:
+            try:
+                self.write_shared()
+            except OSError as e:
+                print(f"Metrics share error: {e}")
+            if self._stop.wait(self.share_interval):
+                return
+
+class SamplingProfiler:
+    """Samples the stacks of busy threads and dumps them in folded format.
+
+    Every interval seconds the profiler records the Python stack of each
+    thread that isn't blocked waiting for work. Counts are written to path
+    every dump_interval seconds and on stop(), one "frame;frame;... count"
+    line per distinct stack, ready for flamegraph.pl or speedscope. Workers
+    other than the process that created the profiler append .<pid> to path.
+    """
+
+    def __init__(self, path: str, interval: float = 0.01, dump_interval: float = 10.0):
+        self.path = path
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._owner_pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def output_path(self) -> str:
+        return self.path if os.getpid() == self._owner_pid else f'{self.path}.{os.getpid()}'
+
+    def sample(self):
+        """Record the current stack of every busy thread"""
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def dump(self):
+        """Write the stacks collected so far"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.output_path)), prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(temp_path, self.output_path)
+
+    def start(self):
+        """Start sampling in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the final dump"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.dump()
+
+    def _run(self):
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_dump:
+                next_dump += self.dump_interval
+                try:
+                    self.dump()
+                except OSError as e:
+                    print(f"Profiler dump error: {e}")
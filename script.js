@@ -5,12 +5,24 @@ let directories = [
     { name: 'Videos', icon: '🎥', url: '/Videos/' }
 ];
 
-// Load directories from localStorage if available
+// Load directories from localStorage if available, otherwise from the
+// server's directories.config (the defaults above are used if that fails)
 function loadDirectories() {
     const saved = localStorage.getItem('cdn-directories');
     if (saved) {
         directories = JSON.parse(saved);
+        return;
     }
+    
+    fetch('/api/directories')
+        .then(response => response.ok ? response.json() : null)
+        .then(configured => {
+            if (configured && configured.length && !localStorage.getItem('cdn-directories')) {
+                directories = configured;
+                renderDirectories();
+            }
+        })
+        .catch(() => {});
 }
 
 // Save directories to localStorage
@@ -6,19 +6,250 @@ Supports configuration for production deployment.
 
 import http.server
 import socketserver
+import socket
 import os
+import posixpath
 import sys
 import argparse
 import json
-import cgi
+import math
+import signal
+import secrets
+import datetime
+import email.utils
+import time
 import shutil
-from urllib.parse import urlparse, parse_qs
-from auth import UserManager
+import select
+import subprocess
+import tempfile
+import threading
+import traceback
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, quote, unquote
+from auth import (ActivityLog, HasherBusyError, MemorySessionStore, PasswordHasher, RateLimiter,
+                  SQLiteSessionStore, UserManager)
+from aioserver import AsyncRequestHandlerMixIn, AsyncServerMixIn, raise_fd_limit
+from cachepolicy import CachePolicy, DEFAULT_CACHE_RULES
+from filecache import FileMetadataCache, HotFileCache
+from metrics import Metrics, SamplingProfiler, format_labels
+from shaping import BandwidthShaper
+from signing import SignatureError, URLSigner
+from blobstore import BlobStore, is_sha256
+from catalog import VideoCatalog, is_video_file
+from listings import ListingCache
+from videometa import MetadataExtractor
+from compression import (CompressedAssetCache, ENCODING_SUFFIXES, StreamCompressor,
+                         is_compressible, negotiate_encoding)
+from uploads import (MultipartReader, ResumableUploads, UploadError,
+                     parse_boundary, safe_filename, store_upload)
+
+# Resolved at import, before main() changes directory
+SERVER_SCRIPT = os.path.abspath(__file__)
+STARTUP_DIR = os.getcwd()
+# A replacement server started by hand_off() finds the listening socket
+# and the pipe to report readiness on in these environment variables
+LISTEN_FD_ENV = 'RAF_CDN_LISTEN_FD'
+READY_FD_ENV = 'RAF_CDN_READY_FD'
+# Seconds a replacement server has to start serving before it is abandoned
+HANDOFF_TIMEOUT = 120
+
+# Settings a SIGHUP applies to the running server; changes to any others
+# take effect on the next restart
+RELOADABLE_SETTINGS = frozenset((
+    'debug', 'require_signed_videos', 'signed_url_ttl', 'signed_url_max_ttl', 'url_signing_keys',
+    'metrics_token', 'max_upload_size', 'resumable_upload_ttl', 'resumable_upload_max_sessions',
+    'resumable_upload_quota', 'trust_proxy_headers',
+    'login_ip_rate', 'login_ip_burst', 'login_user_rate', 'login_user_burst', 'kdf_iterations',
+    'bandwidth_limit', 'bandwidth_connection_limit', 'bandwidth_user_limit', 'bandwidth_user_limits',
+    'bandwidth_bulk_threshold', 'listing_poll_interval', 'cache_control', 'cors_origin'
+))
+
+def encoded_etag(etag, encoding):
+    """ETag of a content-encoded variant of a representation"""
+    return f'{etag[:-1]}-{encoding}"'
+
+# Requests asking for more ranges than this get the whole file instead
+MAX_BYTE_RANGES = 32
+
+def parse_byte_ranges(header, size):
+    """Parse a Range header against a file of the given size.
+
+    Returns a list of inclusive (start, end) tuples, an empty list when no
+    range is satisfiable, or None when the header should be ignored
+    (unknown unit, bad syntax or too many ranges).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if not first:
+            # Suffix range: the final N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue
+            ranges.append((start, min(end, size - 1)))
+    
+    if len(ranges) > MAX_BYTE_RANGES:
+        return None
+    if len(ranges) > 1:
+        # Coalesce overlapping or adjacent ranges
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        ranges = merged
+    return ranges
+
+# (path, method) -> handler method for the fixed API routes
+API_ROUTES = {
+    ('/api/login', 'POST'): 'handle_login',
+    ('/api/logout', 'POST'): 'handle_logout',
+    ('/api/ensure-demo-user', 'POST'): 'handle_ensure_demo_user',
+    ('/api/activity-log', 'GET'): 'handle_activity_log',
+    ('/api/users', 'GET'): 'handle_get_users',
+    ('/api/videos', 'GET'): 'handle_get_videos',
+    ('/api/my-uploads', 'GET'): 'handle_get_my_uploads',
+    ('/api/create-user', 'POST'): 'handle_create_user',
+    ('/api/upload-video', 'POST'): 'handle_upload_video',
+    ('/api/uploads', 'POST'): 'handle_create_upload',
+    ('/api/metrics', 'GET'): 'handle_metrics',
+    ('/api/storage', 'GET'): 'handle_storage_usage',
+    ('/api/sign-url', 'POST'): 'handle_sign_url',
+    ('/api/listing', 'GET'): 'handle_get_listing',
+    ('/api/directories', 'GET'): 'handle_get_directories',
+}
+
+# Static paths whose requests get their own metrics route label
+STATIC_ROUTE_PREFIXES = ('/Videos/', '/Assets/', '/RAF-Backend/')
+# Directories served as static files, with their subdirectories
+SERVED_PREFIXES = STATIC_ROUTE_PREFIXES + ('/Public/',)
+# Files of the web UI; nothing else in the server root, which holds the
+# config, users, databases, logs and sources, is ever served
+UI_FILES = frozenset(('index.html', 'style.css', 'script.js', 'login.html', 'admin.html',
+                      'admin.js', 'user.html', 'user.js', 'favicon.ico'))
+# Server state, never served wherever it is configured to live
+STATE_FILE_SUFFIXES = ('.db', '.db-wal', '.db-shm', '.db-journal', '.jsonl')
+
+def is_served_path(url, prefixes=()):
+    """Whether a decoded URL path names something the server may serve.
+
+    Allows the UI files, the root (their index.html) and whatever is under
+    SERVED_PREFIXES or the extra directory prefixes, except dotfiles, which
+    include the blob store and the URL signing keys, and server state files.
+    """
+    if any(part.startswith('.') for part in url.split('/')):
+        return False
+    path = posixpath.normpath('/' + url.lstrip('/'))
+    if path.endswith(STATE_FILE_SUFFIXES):
+        return False
+    if is_listable_path(path, prefixes):
+        return True
+    return path == '/' or path[1:] in UI_FILES
+
+def is_listable_path(url, prefixes=()):
+    """Whether a decoded URL path is inside a served directory tree.
+
+    Only those trees are ever listed; the server root never is.
+    """
+    path = posixpath.normpath('/' + url.lstrip('/')).rstrip('/') + '/'
+    return path.startswith(SERVED_PREFIXES + tuple(prefixes))
+
+def served_paths(prefixes=()):
+    """Local files and directory trees is_served_path() allows, relative to the server root"""
+    return sorted(UI_FILES) + [prefix.strip('/') for prefix in SERVED_PREFIXES + tuple(prefixes)]
 
 class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.user_manager = UserManager()
-        super().__init__(*args, **kwargs)
+    # URL path a GET response may be cached under; set by do_GET()
+    hot_cache_key = None
+    # Per-request metrics state; reset by begin_request()
+    metrics_route = None
+    response_status = None
+    response_length = 0
+    # Expiry of the signed URL being served; set by authorize_static()
+    signed_expires = None
+    # Pacing for a bulk response body; set by send_head()
+    transfer = None
+    
+    def setup(self):
+        super().setup()
+        self.server.metrics.connection_opened()
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.metrics.connection_closed()
+    
+    def handle_one_request(self):
+        self.begin_request()
+        try:
+            super().handle_one_request()
+        finally:
+            # Also when the client disconnects mid-response, so the bulk
+            # transfer is released and the request still counted
+            self.end_request()
+    
+    def begin_request(self):
+        """Start timing a request"""
+        self.request_started = time.perf_counter()
+        self.metrics_route = None
+        self.response_status = None
+        self.response_length = 0
+        self.signed_expires = None
+        self.transfer = None
+    
+    def end_request(self):
+        """Record a finished request in the server's metrics"""
+        status = self.response_status
+        if self.transfer is not None:
+            self.transfer.close()
+            self.transfer = None
+        elif status is not None and self.response_length:
+            self.server.bandwidth.charge(self.response_length)
+        if status is None:
+            return  # Connection closed without a request
+        route = self.metrics_route
+        if route is None:
+            path = getattr(self, 'path', '')
+            route = next((prefix for prefix in STATIC_ROUTE_PREFIXES if path.startswith(prefix)), 'static')
+        nbytes = 0 if self.command == 'HEAD' or status in (204, 304) else self.response_length
+        self.server.metrics.observe_request(route, status, time.perf_counter() - self.request_started, nbytes)
+    
+    def send_response(self, code, message=None):
+        self.response_status = int(code)
+        super().send_response(code, message)
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self.response_length = int(value)
+        super().send_header(keyword, value)
+    
+    @property
+    def user_manager(self):
+        """Process-wide UserManager owned by the server"""
+        return self.server.user_manager
     
     def end_headers(self):
         # Security headers
@@ -29,22 +260,29 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Content-Security-Policy', 
                         "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'; font-src 'self' data:; img-src 'self' data:")
         
-        # CORS headers (for development - adjust for production)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        # CORS headers
+        self.send_header('Access-Control-Allow-Origin', self.server.config.get('cors_origin', '*'))
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, PUT, PATCH, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Upload-Offset')
+        self.send_header('Access-Control-Expose-Headers', 'Location, Upload-Offset, Upload-Length, X-Next-Cursor, X-Total-Count')
         
         # Cache control headers
-        if self.path.endswith(('.css', '.js')):
-            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
-        elif self.path.startswith(('/RAF-Backend/', '/Assets/', '/Videos/')):
-            self.send_header('Cache-Control', 'public, max-age=3600')
+        if self.signed_expires is not None:
+            # Shared caches must not keep serving a signed URL past its expiry
+            max_age = max(0, min(3600, int(self.signed_expires - time.time())))
+            self.send_header('Cache-Control', f'private, max-age={max_age}')
+        else:
+            cache_control = self.server.cache_policy.lookup(self.path.partition('?')[0])
+            if cache_control:
+                self.send_header('Cache-Control', cache_control)
         
         super().end_headers()
 
     def do_OPTIONS(self):
         """Handle preflight requests"""
+        self.metrics_route = 'options'
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def do_POST(self):
@@ -54,11 +292,27 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         else:
             self.send_error(404, "Not Found")
     
+    # Resumable uploads also use these methods; static files stay read-only
+    do_PUT = do_PATCH = do_DELETE = do_POST
+    
+    def do_HEAD(self):
+        """Handle HEAD requests"""
+        if self.path.startswith('/api/'):
+            self.handle_api_request()
+        elif self.authorize_static():
+            super().do_HEAD()
+    
     def do_GET(self):
         """Handle GET requests"""
         if self.path.startswith('/api/'):
             self.handle_api_request()
         else:
+            if not self.authorize_static():
+                return
+            if self.serve_hot_file():
+                return
+            self.hot_cache_key = urlparse(self.path).path
+            
             # Handle directory requests by serving index.html if it exists
             if self.path.endswith('/') and self.path != '/':
                 index_path = self.path + 'index.html'
@@ -68,46 +322,380 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
             # For root path, serve index.html (welcome page)
             if self.path == '/':
                 self.path = '/index.html'
-                
-            return super().do_GET()
+            
+            try:
+                return super().do_GET()
+            finally:
+                self.hot_cache_key = None
+    
+    def authorize_static(self):
+        """Refuse paths outside the served files and check the signature of a signed URL.
+
+        A request carrying sig, or for a video under /Videos/ when
+        require_signed_videos is set, must have a valid unexpired signature;
+        verifying it needs no session lookup. Returns False after sending an
+        error response.
+        """
+        path = unquote(urlparse(self.path).path)
+        if not is_served_path(path, self.server.listings.prefixes):
+            self.send_error(404, "File not found")
+            return False
+        
+        params = self.get_query_params()
+        required = (self.server.config.get('require_signed_videos')
+                    and path.startswith('/Videos/') and is_video_file(path))
+        if required or 'sig' in params:
+            try:
+                self.signed_expires = self.server.url_signer.verify(path, params)
+            except SignatureError as e:
+                self.send_error(403, str(e))
+                return False
+        return True
+    
+    def send_head(self):
+        """Send headers for a static file, honouring conditional, Range and
+        Accept-Encoding request headers.
+
+        Validators come from the server's metadata cache, so a revalidation
+        that ends in 304 never opens the file. Compressible files are served
+        from precompressed sidecars when possible and compressed on the fly
+        otherwise. Directory redirects are left to SimpleHTTPRequestHandler,
+        which calls list_directory() for directories without an index.html.
+        Returns an open file for copyfile() to send, or None.
+        """
+        self.byte_ranges = None
+        self.stream_encoding = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or path.endswith('/'):
+            return super().send_head()
+        
+        try:
+            fs = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        meta = self.server.file_metadata.get(path, fs, self.guess_type)
+        compressed_assets = self.server.compressed_assets
+        negotiable = compressed_assets is not None and is_compressible(meta.content_type)
+        
+        if self.is_not_modified(meta):
+            self.send_not_modified(meta, negotiable)
+            return None
+        
+        ranges = None
+        if 'Range' in self.headers and self.if_range_matches(meta):
+            ranges = parse_byte_ranges(self.headers['Range'], meta.size)
+        
+        if ranges == []:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{meta.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        
+        hot_cache = self.server.hot_cache
+        if hot_cache is not None and self.hot_cache_key and not ranges and meta.size <= hot_cache.max_file_size:
+            # Served from disk this time; later requests come from memory
+            hot_cache.load(self.hot_cache_key, path, meta,
+                           compressed_assets.sidecars(path, fs) if negotiable else None)
+        
+        # Byte ranges always refer to the identity encoding
+        encoding = None
+        body_path = path
+        if negotiable and not ranges:
+            encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+            if encoding:
+                sidecar = compressed_assets.sidecars(path, fs).get(encoding)
+                if sidecar:
+                    body_path = sidecar
+                elif meta.size > compressed_assets.max_size:
+                    self.stream_encoding = encoding
+                else:
+                    encoding = None  # Too small to be worth compressing
+        
+        try:
+            f = open(body_path, 'rb')
+        except OSError:
+            f = None
+        if f is None and body_path != path:
+            # Sidecar removed by a --precompress run; rebuilt on the next request
+            compressed_assets.forget(path)
+            encoding, body_path = None, path
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                pass
+        if f is None:
+            self.send_error(404, "File not found")
+            return None
+        
+        try:
+            if encoding:
+                self.send_response(200)
+                self.send_header('Content-Type', meta.content_type)
+                self.send_header('Content-Encoding', encoding)
+                if self.stream_encoding:
+                    # Length is unknown up front; closing the connection ends the body
+                    self.close_connection = True
+                else:
+                    self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            elif not ranges:
+                self.send_response(200)
+                self.send_header('Content-Type', meta.content_type)
+                self.send_header('Content-Length', str(meta.size))
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_response(206)
+                self.send_header('Content-Type', meta.content_type)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{meta.size}')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.byte_ranges = [(start, end, b'')]
+            else:
+                boundary = secrets.token_hex(12)
+                self.byte_ranges = []
+                length = 0
+                for start, end in ranges:
+                    part_header = (f'\r\n--{boundary}\r\n'
+                                   f'Content-Type: {meta.content_type}\r\n'
+                                   f'Content-Range: bytes {start}-{end}/{meta.size}\r\n\r\n').encode('latin-1')
+                    self.byte_ranges.append((start, end, part_header))
+                    length += len(part_header) + end - start + 1
+                self.byte_ranges_trailer = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+                length += len(self.byte_ranges_trailer)
+                self.send_response(206)
+                self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+                self.send_header('Content-Length', str(length))
+            
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', encoded_etag(meta.etag, encoding) if encoding else meta.etag)
+            self.send_header('Last-Modified', meta.last_modified)
+            if negotiable:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            if self.command == 'GET' and not self.stream_encoding and \
+                    self.server.bandwidth.is_bulk(self.response_length):
+                self.transfer = self.open_transfer()
+            return f
+        except:
+            f.close()
+            raise
+    
+    def list_directory(self, path):
+        """Send the watcher-maintained HTML listing of a directory.
+
+        Returns the page for copyfile() to send, or None after a 304.
+        """
+        url = unquote(urlparse(self.path).path)
+        listings = self.server.listings
+        if not is_listable_path(url, listings.prefixes):
+            self.send_error(404, "File not found")
+            return None
+        listing = listings.get(path, url)
+        title, icon = listings.describe(url)
+        etag = listing.html_etag(title, icon)
+        if self.etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return None
+        
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding')) \
+            if self.server.compressed_assets is not None else None
+        body = listing.render(title, icon, encoding)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', encoded_etag(etag, encoding) if encoding else etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return BytesIO(body)
+    
+    def open_transfer(self):
+        """Start pacing a bulk body, attributed to the signed-in user or else the client address"""
+        session_id = self.get_session_id()
+        user_info = self.user_manager.get_user_from_session(session_id) if session_id else None
+        if user_info:
+            return self.server.bandwidth.open(f"user:{user_info['username']}", user_info['username'])
+        return self.server.bandwidth.open(f'ip:{self.client_ip()}')
+    
+    def serve_hot_file(self):
+        """Answer a GET from the in-memory hot file cache.
+
+        Returns False on a miss, or for Range requests, which always go
+        through send_head().
+        """
+        hot_cache = self.server.hot_cache
+        if hot_cache is None or 'Range' in self.headers:
+            return False
+        entry = hot_cache.get(urlparse(self.path).path)
+        if entry is None:
+            return False
+        
+        meta = entry.metadata
+        negotiable = self.server.compressed_assets is not None and is_compressible(meta.content_type)
+        if self.is_not_modified(meta):
+            self.send_not_modified(meta, negotiable)
+            return True
+        
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding')) if entry.variants else None
+        body = entry.variants.get(encoding, entry.body) if encoding else entry.body
+        if body is entry.body:
+            encoding = None
+        
+        self.send_response(200)
+        self.send_header('Content-Type', meta.content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', encoded_etag(meta.etag, encoding) if encoding else meta.etag)
+        self.send_header('Last-Modified', meta.last_modified)
+        if negotiable:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+    
+    def send_not_modified(self, meta, negotiable):
+        """Send a 304 carrying the current validators"""
+        self.send_response(304)
+        self.send_header('ETag', meta.etag)
+        self.send_header('Last-Modified', meta.last_modified)
+        if negotiable:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+    
+    def etag_matches(self, etag):
+        """Check If-None-Match against an ETag; False when the header is absent"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is None:
+            return False
+        # Weak comparison, as required for If-None-Match; the tags of
+        # compressed variants match too
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        current = {etag} | {encoded_etag(etag, encoding) for encoding in ENCODING_SUFFIXES}
+        return '*' in tags or any(tag in current for tag in tags)
+    
+    def is_not_modified(self, meta):
+        """Check If-None-Match, or else If-Modified-Since, against file metadata"""
+        if 'If-None-Match' in self.headers:
+            return self.etag_matches(meta.etag)
+        
+        if 'If-Modified-Since' not in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since'])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=datetime.timezone.utc)
+        last_modified = datetime.datetime.fromtimestamp(meta.mtime, datetime.timezone.utc)
+        return last_modified.replace(microsecond=0) <= ims
+    
+    def if_range_matches(self, meta):
+        """Check whether a Range request may be served as partial content.
+
+        A missing If-Range always matches; otherwise the validator must be a
+        strong match for the current ETag or exactly the Last-Modified date.
+        """
+        if_range = self.headers.get('If-Range')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        return if_range == meta.etag or if_range == meta.last_modified
+    
+    def copyfile(self, source, outputfile):
+        """Send a file body, or the requested byte ranges, with sendfile()"""
+        outputfile.flush()
+        if getattr(self, 'stream_encoding', None):
+            compressor = StreamCompressor(self.stream_encoding)
+            for chunk in iter(lambda: source.read(64 * 1024), b''):
+                data = compressor.compress(chunk)
+                if data:
+                    self.response_length += len(data)
+                    outputfile.write(data)
+            data = compressor.finish()
+            self.response_length += len(data)
+            outputfile.write(data)
+            return
+        if not getattr(self, 'byte_ranges', None):
+            self.sendfile(source, 0)
+            return
+        
+        for start, end, part_header in self.byte_ranges:
+            if part_header:
+                outputfile.write(part_header)
+                outputfile.flush()
+            self.sendfile(source, start, end - start + 1)
+        if len(self.byte_ranges) > 1:
+            outputfile.write(self.byte_ranges_trailer)
+    
+    def sendfile(self, source, offset, count=None):
+        """Send count bytes of a file, or the rest of it, paced by the bulk transfer if any.
+
+        Without a transfer, source may also be an in-memory body such as a
+        directory listing.
+        """
+        transfer = self.transfer
+        if transfer is None:
+            self.connection.sendfile(source, offset, count)
+            return
+        if count is None:
+            count = os.fstat(source.fileno()).st_size - offset
+        while count > 0:
+            size = min(count, transfer.chunk_size)
+            transfer.wait(size)
+            sent = self.connection.sendfile(source, offset, size)
+            if not sent:
+                return  # The file shrank under us
+            offset += sent
+            count -= sent
     
     def handle_api_request(self):
         """Handle API requests"""
+        route = urlparse(self.path).path
+        args = ()
+        if route.startswith('/api/uploads/'):
+            name = 'handle_resumable_upload'
+            args = (route[len('/api/uploads/'):],)
+        elif route.startswith('/api/videos/') and self.command == 'DELETE':
+            name = 'handle_delete_video'
+            args = (unquote(route[len('/api/videos/'):]),)
+        else:
+            name = API_ROUTES.get((route, self.command))
+        self.metrics_route = name or 'api_not_found'
         try:
-            if self.path == '/api/login' and self.command == 'POST':
-                self.handle_login()
-            elif self.path == '/api/logout' and self.command == 'POST':
-                self.handle_logout()
-            elif self.path == '/api/ensure-demo-user' and self.command == 'POST':
-                self.handle_ensure_demo_user()
-            elif self.path == '/api/activity-log' and self.command == 'GET':
-                self.handle_activity_log()
-            elif self.path == '/api/users' and self.command == 'GET':
-                self.handle_get_users()
-            elif self.path == '/api/videos' and self.command == 'GET':
-                self.handle_get_videos()
-            elif self.path == '/api/my-uploads' and self.command == 'GET':
-                self.handle_get_my_uploads()
-            elif self.path == '/api/create-user' and self.command == 'POST':
-                self.handle_create_user()
-            elif self.path == '/api/upload-video' and self.command == 'POST':
-                self.handle_upload_video()
-            else:
+            if name is None:
                 self.send_error(404, "API endpoint not found")
+            else:
+                getattr(self, name)(*args)
+        except HasherBusyError:
+            self.send_busy_response()
         except Exception as e:
             print(f"API Error: {e}")
             self.send_json_response({'error': 'Internal server error'}, 500)
     
     def handle_login(self):
         """Handle user login"""
-        content_length = int(self.headers.get('Content-Length', 0))
-        post_data = self.rfile.read(content_length)
-        
         try:
-            data = json.loads(post_data.decode('utf-8'))
+            data = self.read_json_object()
             username = data.get('username')
             password = data.get('password')
             
+            # Throttle guessing per client and per account before paying for PBKDF2.
+            # Accounts are throttled per client too, so nobody can lock one out
+            client_ip = self.client_ip()
+            retry_after = self.server.login_ip_limiter.acquire(client_ip)
+            if not retry_after:
+                retry_after = self.server.login_user_limiter.acquire(f'{client_ip} {username}')
+            if retry_after:
+                self.send_json_response({'error': 'Too many login attempts'}, 429,
+                                        headers={'Retry-After': str(math.ceil(retry_after))})
+                return
+            
             session_id = self.user_manager.authenticate(username, password)
             
             if session_id:
@@ -121,8 +709,10 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
             else:
                 self.send_json_response({'error': 'Invalid credentials'}, 401)
                 
-        except json.JSONDecodeError:
+        except ValueError:
             self.send_json_response({'error': 'Invalid JSON'}, 400)
+        except HasherBusyError:
+            self.send_busy_response()
         except Exception as e:
             print(f"Login error: {e}")
             self.send_json_response({'error': 'Login failed'}, 500)
@@ -148,8 +738,25 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         if not self.check_admin_auth():
             return
         
-        logs = self.user_manager.get_activity_logs()
-        self.send_json_response(logs)
+        params = self.get_query_params()
+        try:
+            limit = int(params.get('limit', 50))
+            offset = int(params.get('offset', 0))
+            if not 1 <= limit <= 1000 or offset < 0:
+                raise ValueError
+        except ValueError:
+            self.send_json_response({'error': 'limit must be 1-1000 and offset >= 0'}, 400)
+            return
+        
+        logs, total = self.user_manager.activity_log.query(
+            limit=limit,
+            offset=offset,
+            username=params.get('username'),
+            action=params.get('action'),
+            since=params.get('since'),
+            until=params.get('until')
+        )
+        self.send_json_response(logs, headers={'X-Total-Count': str(total)})
     
     def handle_get_users(self):
         """Get users list (admin only)"""
@@ -171,21 +778,18 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         if not self.check_auth():
             return
         
-        videos_dir = 'Videos'
-        videos = []
-        
-        if os.path.exists(videos_dir):
-            for filename in os.listdir(videos_dir):
-                file_path = os.path.join(videos_dir, filename)
-                if os.path.isfile(file_path) and filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm')):
-                    stat = os.stat(file_path)
-                    videos.append({
-                        'name': filename,
-                        'size': stat.st_size,
-                        'uploaded_at': stat.st_mtime
-                    })
+        page = self.query_catalog()
+        if page is None:
+            return
+        videos, next_cursor = page
         
-        self.send_json_response(videos)
+        self.send_json_response([{
+            'name': video['name'],
+            'size': video['size'],
+            'uploaded_at': video['uploaded_at'],
+            'uploaded_by': video['owner'],
+            'metadata': video['metadata']
+        } for video in videos], headers=self.cursor_headers(next_cursor))
     
     def handle_get_my_uploads(self):
         """Get current user's uploads"""
@@ -193,34 +797,167 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         if not user_info:
             return
         
-        # For now, return all videos - in a real system, you'd track per-user uploads
-        videos_dir = 'Videos'
-        uploads = []
+        page = self.query_catalog(owner=user_info['username'])
+        if page is None:
+            return
+        uploads, next_cursor = page
         
-        if os.path.exists(videos_dir):
-            for filename in os.listdir(videos_dir):
-                file_path = os.path.join(videos_dir, filename)
-                if os.path.isfile(file_path) and filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm')):
-                    stat = os.stat(file_path)
-                    uploads.append({
-                        'name': filename,
-                        'size': stat.st_size,
-                        'timestamp': stat.st_mtime,
-                        'status': 'completed'
-                    })
+        self.send_json_response([{
+            'name': upload['name'],
+            'size': upload['size'],
+            'timestamp': upload['uploaded_at'],
+            'status': 'completed',
+            'metadata': upload['metadata']
+        } for upload in uploads], headers=self.cursor_headers(next_cursor))
+    
+    def query_catalog(self, owner=None):
+        """Fetch one page from the video catalog using the query string.
+
+        Supports sort=name|size|date, order=asc|desc, min_size, max_size,
+        since, until (Unix timestamps), limit (1-1000) and cursor.
+        Returns (videos, next_cursor), or None after sending a 400.
+        """
+        params = self.get_query_params()
+        try:
+            limit = int(params.get('limit', 100))
+            if not 1 <= limit <= 1000:
+                raise ValueError('limit must be between 1 and 1000')
+            order = params.get('order', 'desc')
+            if order not in ('asc', 'desc'):
+                raise ValueError('order must be asc or desc')
+            return self.server.catalog.list_videos(
+                owner=owner,
+                sort=params.get('sort', 'date'),
+                descending=order == 'desc',
+                min_size=int(params['min_size']) if 'min_size' in params else None,
+                max_size=int(params['max_size']) if 'max_size' in params else None,
+                since=float(params['since']) if 'since' in params else None,
+                until=float(params['until']) if 'until' in params else None,
+                cursor=params.get('cursor'),
+                limit=limit
+            )
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return None
+    
+    def read_json_object(self):
+        """Parse the request body as a JSON object; raises ValueError for anything else"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+        if not isinstance(data, dict):
+            raise ValueError('Expected a JSON object')
+        return data
+    
+    def get_query_params(self):
+        """Parse the query string, keeping the last value of each parameter"""
+        return {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+    
+    def cursor_headers(self, next_cursor):
+        """Pagination headers for a catalog page"""
+        return {'X-Next-Cursor': next_cursor} if next_cursor else None
+    
+    def handle_metrics(self):
+        """Prometheus metrics, for an admin session or the configured metrics_token"""
+        token = self.server.config.get('metrics_token')
+        session_id = self.get_session_id()
+        # Compared as bytes: compare_digest() rejects non-ASCII strings
+        if not (token and session_id and
+                secrets.compare_digest(session_id.encode('utf-8', 'surrogatepass'),
+                                       str(token).encode('utf-8', 'surrogatepass'))):
+            if not self.check_admin_auth():
+                return
         
-        self.send_json_response(uploads)
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_sign_url(self):
+        """Issue a signed, expiring URL for a file under /Videos/"""
+        if not self.check_auth():
+            return
+        
+        config = self.server.config
+        try:
+            data = self.read_json_object()
+            path = data.get('path')
+            ttl = float(data.get('ttl', config.get('signed_url_ttl', 3600)))
+        except (TypeError, ValueError):
+            self.send_json_response({'error': 'path required'}, 400)
+            return
+        
+        if not isinstance(path, str) or not path.startswith('/Videos/') or \
+                any(part.startswith('.') for part in path.split('/')):
+            self.send_json_response({'error': 'path must be a file under /Videos/'}, 400)
+            return
+        max_ttl = config.get('signed_url_max_ttl', 86400)
+        if not 0 < ttl <= max_ttl:
+            self.send_json_response({'error': f'ttl must be between 1 and {max_ttl} seconds'}, 400)
+            return
+        
+        url, expires = self.server.url_signer.sign(path, ttl)
+        self.send_json_response({'url': url, 'expires': expires})
+    
+    def handle_get_listing(self):
+        """One page of a directory listing as JSON.
+
+        Takes path (a directory URL such as /Videos/), limit (1-1000) and
+        cursor; entries come directories first, then by name. Needs a
+        session, and only served directory trees can be listed.
+        """
+        if not self.check_auth():
+            return
+        
+        params = self.get_query_params()
+        url = params.get('path', '/')
+        url = url if url.endswith('/') else url + '/'
+        path = self.translate_path(quote(url))
+        prefixes = self.server.listings.prefixes
+        if not (is_served_path(url, prefixes) and is_listable_path(url, prefixes)) or not os.path.isdir(path):
+            self.send_json_response({'error': 'Directory not found'}, 404)
+            return
+        
+        listing = self.server.listings.get(path, url)
+        etag = listing.etag
+        if self.etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        try:
+            limit = int(params.get('limit', 100))
+            if not 1 <= limit <= 1000:
+                raise ValueError('limit must be between 1 and 1000')
+            entries, next_cursor = listing.page(params.get('cursor'), limit)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'X-Total-Count': str(len(listing))}
+        headers.update(self.cursor_headers(next_cursor) or {})
+        self.send_json_response(entries, headers=headers)
+    
+    def handle_get_directories(self):
+        """Directories from Public/directories.config for the front page"""
+        listings = self.server.listings
+        etag = listings.config_etag
+        if self.etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_json_response(listings.directories, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
     
     def handle_create_user(self):
         """Create new user (admin only)"""
         if not self.check_admin_auth():
             return
         
-        content_length = int(self.headers.get('Content-Length', 0))
-        post_data = self.rfile.read(content_length)
-        
         try:
-            data = json.loads(post_data.decode('utf-8'))
+            data = self.read_json_object()
             username = data.get('username')
             password = data.get('password')
             role = data.get('role', 'user')
@@ -234,50 +971,262 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
             else:
                 self.send_json_response({'error': 'User already exists'}, 409)
                 
-        except json.JSONDecodeError:
+        except ValueError:
             self.send_json_response({'error': 'Invalid JSON'}, 400)
     
     def handle_upload_video(self):
-        """Handle video upload"""
+        """Handle video upload, streaming the file straight into Videos/"""
         user_info = self.check_auth()
         if not user_info:
             return
         
+        max_size = self.server.config.get('max_upload_size')
+        try:
+            content_length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_json_response({'error': 'Content-Length required'}, 411)
+            return
+        # Allow some slack for the multipart framing around the file itself
+        if max_size and content_length > max_size + 64 * 1024:
+            self.close_connection = True
+            self.send_json_response({'error': 'File too large'}, 413)
+            return
+        
         try:
             # Ensure Videos directory exists
             os.makedirs('Videos', exist_ok=True)
             
-            # Parse multipart form data
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': self.headers['Content-Type']}
-            )
+            reader = MultipartReader(self.rfile, parse_boundary(self.headers.get('Content-Type')), content_length)
+            result = None
+            for part in reader.parts():
+                if part.name == 'video' and part.filename and result is None:
+                    result = store_upload(part.chunks(), 'Videos', safe_filename(part.filename), max_size,
+                                          blob_store=self.server.blob_store)
             
-            video_field = form['video']
-            if video_field.filename:
-                # Save the uploaded file
-                filename = video_field.filename
-                file_path = os.path.join('Videos', filename)
-                
-                with open(file_path, 'wb') as f:
-                    shutil.copyfileobj(video_field.file, f)
-                
-                # Log the upload
-                self.user_manager.log_activity(
-                    user_info['username'], 
-                    'video_upload', 
-                    f'Uploaded video: {filename}'
-                )
-                
-                self.send_json_response({'success': True, 'filename': filename})
-            else:
+            if result is None:
                 self.send_json_response({'error': 'No file provided'}, 400)
+                return
+            
+            self.complete_upload(result, user_info)
                 
+        except UploadError as e:
+            # The rest of the body may be unread, so don't reuse the connection
+            self.close_connection = True
+            self.send_json_response({'error': str(e)}, e.status)
         except Exception as e:
             print(f"Upload error: {e}")
+            self.close_connection = True
             self.send_json_response({'error': 'Upload failed'}, 500)
     
+    def complete_upload(self, result, user_info):
+        """Index, log and acknowledge a video that has been stored in Videos/"""
+        file_path = os.path.abspath(os.path.join('Videos', result.filename))
+        self.server.file_metadata.invalidate(file_path)
+        if self.server.hot_cache is not None:
+            self.server.hot_cache.invalidate_file(file_path)
+        if is_video_file(result.filename):
+            self.server.catalog.add(result.filename, owner=user_info['username'])
+            if self.server.metadata_extractor is not None:
+                self.server.metadata_extractor.submit(result.filename)
+        self.server.metrics.observe_upload(result.size, result.seconds)
+        
+        # Log the upload
+        self.user_manager.log_activity(
+            user_info['username'], 
+            'video_upload', 
+            f'Uploaded video: {result.filename}'
+        )
+        if self.server.config.get('debug'):
+            print(f"Upload: {result.filename} {result.size} bytes in {result.seconds:.2f}s "
+                  f"({result.throughput / 1048576:.1f} MiB/s) sha256={result.sha256}")
+        
+        self.send_json_response({
+            'success': True,
+            'filename': result.filename,
+            'size': result.size,
+            'sha256': result.sha256,
+            'throughput': result.throughput,
+            'deduplicated': result.deduplicated
+        })
+    
+    def handle_create_upload(self):
+        """Start a resumable upload session"""
+        user_info = self.check_auth()
+        if not user_info:
+            return
+        
+        try:
+            data = self.read_json_object()
+            filename = data.get('filename')
+            size = int(data.get('size'))
+            sha256 = data.get('sha256')
+            if not isinstance(filename, (str, type(None))):
+                raise TypeError('filename must be a string')
+        except (TypeError, ValueError):
+            self.send_json_response({'error': 'filename and size required'}, 400)
+            return
+        if sha256 is not None and not is_sha256(sha256):
+            self.send_json_response({'error': 'sha256 must be 64 lowercase hex digits'}, 400)
+            return
+        
+        max_size = self.server.config.get('max_upload_size')
+        if not filename:
+            self.send_json_response({'error': 'filename and size required'}, 400)
+            return
+        if max_size and size > max_size:
+            self.send_json_response({'error': 'File too large'}, 413)
+            return
+        
+        try:
+            os.makedirs('Videos', exist_ok=True)
+            # With sha256 the session carries a challenge; proving it links
+            # stored content instead of receiving it
+            upload = self.server.resumable_uploads.create(user_info['username'], filename, size, sha256)
+        except UploadError as e:
+            self.send_json_response({'error': str(e)}, e.status)
+            return
+        
+        self.send_json_response(upload, 201, headers={
+            'Location': f"/api/uploads/{upload['upload_id']}",
+            'Upload-Offset': '0',
+            'Upload-Length': str(size)
+        })
+    
+    def handle_resumable_upload(self, subpath):
+        """Query, write to, finish or abort a resumable upload.
+
+        HEAD/GET /api/uploads/<id>          current offset and received ranges
+        PATCH/PUT /api/uploads/<id>         chunk at the Upload-Offset header
+        POST /api/uploads/<id>/complete     assemble and publish the video
+        POST /api/uploads/<id>/proof        link stored content matching the challenge
+        DELETE /api/uploads/<id>            abort
+        """
+        user_info = self.check_auth()
+        if not user_info:
+            return
+        
+        upload_id, _, action = subpath.partition('/')
+        uploads = self.server.resumable_uploads
+        upload = uploads.get(upload_id)
+        if upload is None or upload['owner'] != user_info['username']:
+            self.send_json_response({'error': 'Upload not found'}, 404)
+            return
+        
+        try:
+            if self.command in ('HEAD', 'GET') and not action:
+                self.send_upload_offset(upload, 200, body=self.command == 'GET')
+            elif self.command in ('PATCH', 'PUT') and not action:
+                try:
+                    offset = int(self.headers['Upload-Offset'])
+                    length = int(self.headers['Content-Length'])
+                except (TypeError, ValueError):
+                    self.close_connection = True
+                    self.send_json_response({'error': 'Upload-Offset and Content-Length required'}, 400)
+                    return
+                upload = uploads.write_chunk(upload_id, offset, length, self.rfile)
+                self.send_upload_offset(upload, 204)
+            elif self.command == 'POST' and action == 'complete':
+                result = uploads.finalize(upload_id)
+                self.complete_upload(result, user_info)
+            elif self.command == 'POST' and action == 'proof':
+                try:
+                    proof = self.read_json_object().get('proof')
+                    if not isinstance(proof, str):
+                        raise TypeError('proof must be a string')
+                except (TypeError, ValueError):
+                    self.send_json_response({'error': 'proof required'}, 400)
+                    return
+                result = uploads.prove(upload_id, proof)
+                self.complete_upload(result, user_info)
+            elif self.command == 'DELETE' and not action:
+                if upload['finalizing']:
+                    raise UploadError('Upload is being completed', 409)
+                uploads.abort(upload_id)
+                self.send_json_response({'success': True})
+            else:
+                self.send_error(404, "API endpoint not found")
+        except UploadError as e:
+            self.close_connection = True
+            self.send_json_response({'error': str(e)}, e.status)
+    
+    def send_upload_offset(self, upload, status, body=False):
+        """Report a resumable upload's progress in tus-style headers"""
+        headers = {
+            'Upload-Offset': str(upload['offset']),
+            'Upload-Length': str(upload['size']),
+            'Cache-Control': 'no-store'
+        }
+        if body:
+            self.send_json_response(upload, status, headers=headers)
+            return
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 204:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def handle_delete_video(self, name):
+        """Delete a video; its owner or an admin may do this"""
+        user_info = self.check_auth()
+        if not user_info:
+            return
+        
+        try:
+            name = safe_filename(name)
+        except UploadError:
+            self.send_json_response({'error': 'Video not found'}, 404)
+            return
+        video = self.server.catalog.get(name)
+        if video is None or not is_video_file(name):
+            self.send_json_response({'error': 'Video not found'}, 404)
+            return
+        if user_info['role'] != 'admin' and video['owner'] != user_info['username']:
+            self.send_json_response({'error': 'Not allowed to delete this video'}, 403)
+            return
+        
+        if self.server.blob_store is not None:
+            self.server.blob_store.unlink(name)
+        else:
+            try:
+                os.unlink(os.path.join('Videos', name))
+            except FileNotFoundError:
+                pass
+        self.server.catalog.remove(name)
+        file_path = os.path.abspath(os.path.join('Videos', name))
+        self.server.file_metadata.invalidate(file_path)
+        if self.server.hot_cache is not None:
+            self.server.hot_cache.invalidate_file(file_path)
+        
+        self.user_manager.log_activity(user_info['username'], 'video_delete', f'Deleted video: {name}')
+        self.send_json_response({'success': True})
+    
+    def handle_storage_usage(self):
+        """Blob store disk usage and space saved by deduplication (admin only)"""
+        if not self.check_admin_auth():
+            return
+        
+        if self.server.blob_store is None:
+            self.send_json_response({'error': 'Deduplicated storage is disabled'}, 404)
+            return
+        self.send_json_response(self.server.blob_store.usage())
+    
+    def client_ip(self):
+        """Address of the client, honouring proxy headers when configured"""
+        if self.server.config.get('trust_proxy_headers'):
+            forwarded = self.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+            real_ip = self.headers.get('X-Real-IP')
+            if real_ip:
+                return real_ip.strip()
+        return self.client_address[0]
+    
+    def send_busy_response(self):
+        """Tell the client to retry when password hashing is saturated"""
+        self.send_json_response({'error': 'Server busy, try again shortly'}, 503,
+                                headers={'Retry-After': '1'})
+    
     def get_session_id(self):
         """Extract session ID from Authorization header"""
         auth_header = self.headers.get('Authorization')
@@ -311,23 +1260,539 @@ class RAFCDNRequestHandler(http.server.SimpleHTTPRequestHandler):
         
         return True
     
-    def send_json_response(self, data, status=200):
+    def send_json_response(self, data, status=200, headers=None):
         """Send JSON response"""
         response = json.dumps(data).encode('utf-8')
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', str(len(response)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(response)
 
-def load_config():
-    """Load configuration from config file if it exists"""
-    config_file = 'server.config.json'
+class RAFCDNServer(socketserver.TCPServer):
+    """TCP server that owns the state shared by all request handlers"""
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, config=None, listen_fd=None):
+        config = config or {}
+        self.config = config
+        self.cache_policy = CachePolicy(config.get('cache_control'))
+        self.user_manager = UserManager(
+            sessions=create_session_store(config),
+            activity_log=ActivityLog(
+                flush_interval=config.get('activity_log_flush_interval', 1.0),
+                max_bytes=config.get('activity_log_max_bytes', 10 * 1024 * 1024),
+                backup_count=config.get('activity_log_backups', 3)
+            ),
+            hasher=PasswordHasher(
+                iterations=config.get('kdf_iterations', 100000),
+                workers=config.get('kdf_workers'),
+                max_pending=config.get('kdf_max_pending')
+            )
+        )
+        self.login_ip_limiter = RateLimiter(config.get('login_ip_rate', 1.0),
+                                            config.get('login_ip_burst', 10))
+        self.login_user_limiter = RateLimiter(config.get('login_user_rate', 0.2),
+                                              config.get('login_user_burst', 5))
+        self.file_metadata = FileMetadataCache()
+        self.compressed_assets = CompressedAssetCache() if config.get('compression', True) else None
+        hot_cache_size = config.get('hot_cache_size', 32 * 1024 * 1024)
+        self.hot_cache = HotFileCache(hot_cache_size, config.get('hot_cache_max_file', 1024 * 1024)) if hot_cache_size else None
+        self.catalog = VideoCatalog(rescan_interval=config.get('catalog_rescan_interval', 60))
+        self.blob_store = BlobStore() if config.get('dedup_storage', True) else None
+        self.resumable_uploads = ResumableUploads(ttl=config.get('resumable_upload_ttl', 86400),
+                                                  blob_store=self.blob_store,
+                                                  max_sessions=config.get('resumable_upload_max_sessions', 4),
+                                                  quota=config.get('resumable_upload_quota', 10 * 1024 ** 3))
+        metadata_workers = config.get('metadata_workers', 2)
+        self.metadata_extractor = MetadataExtractor(
+            self.catalog, metadata_workers, config.get('catalog_rescan_interval', 60)) if metadata_workers else None
+        self.url_signer = URLSigner(keys=config.get('url_signing_keys'))
+        self.bandwidth = BandwidthShaper(
+            global_rate=config.get('bandwidth_limit', 0),
+            connection_rate=config.get('bandwidth_connection_limit', 0),
+            user_rate=config.get('bandwidth_user_limit', 0),
+            user_rates=config.get('bandwidth_user_limits'),
+            bulk_threshold=config.get('bandwidth_bulk_threshold', 1024 * 1024),
+            processes=config.get('workers', 1)
+        )
+        self.listings = ListingCache(max_directories=config.get('listing_cache_size', 256),
+                                     poll_interval=config.get('listing_poll_interval', 2.0))
+        self.metrics = Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+        self.profiler = SamplingProfiler(config['profile']) if config.get('profile') else None
+        if listen_fd is None:
+            super().__init__(server_address, handler_class)
+        else:
+            # Take over the listening socket of the server being replaced
+            super().__init__(server_address, handler_class, bind_and_activate=False)
+            self.socket.close()
+            self.socket = socket.socket(fileno=listen_fd)
+            self.server_address = self.socket.getsockname()
+    
+    def reload(self, config):
+        """Apply a freshly loaded config and re-read users without dropping connections.
+
+        Returns the names of changed settings that need a restart. Raises
+        ValueError, leaving the running settings alone, if config is invalid.
+        """
+        cache_policy = CachePolicy(config.get('cache_control'))
+        url_signer = self.url_signer
+        if config.get('url_signing_keys') != self.config.get('url_signing_keys'):
+            url_signer = URLSigner(keys=config.get('url_signing_keys'))
+        self.user_manager.reload_users()
+        
+        self.cache_policy = cache_policy
+        self.url_signer = url_signer
+        self.login_ip_limiter.rate = config.get('login_ip_rate', 1.0)
+        self.login_ip_limiter.burst = config.get('login_ip_burst', 10)
+        self.login_user_limiter.rate = config.get('login_user_rate', 0.2)
+        self.login_user_limiter.burst = config.get('login_user_burst', 5)
+        self.user_manager.hasher.iterations = config.get('kdf_iterations', 100000)
+        self.resumable_uploads.ttl = config.get('resumable_upload_ttl', 86400)
+        self.resumable_uploads.max_sessions = config.get('resumable_upload_max_sessions', 4)
+        self.resumable_uploads.quota = config.get('resumable_upload_quota', 10 * 1024 ** 3)
+        self.bandwidth.configure(
+            global_rate=config.get('bandwidth_limit', 0),
+            connection_rate=config.get('bandwidth_connection_limit', 0),
+            user_rate=config.get('bandwidth_user_limit', 0),
+            user_rates=config.get('bandwidth_user_limits'),
+            bulk_threshold=config.get('bandwidth_bulk_threshold', 1024 * 1024),
+            processes=config.get('workers', 1)
+        )
+        self.listings.poll_interval = config.get('listing_poll_interval', 2.0)
+        self.listings.reload_config()
+        
+        restart = sorted(key for key in set(config) | set(self.config)
+                         if key not in RELOADABLE_SETTINGS and not key.startswith('_')
+                         and config.get(key) != self.config.get(key))
+        # Handlers read per-request settings from here
+        self.config = config
+        return restart
+
+    def start_background_tasks(self):
+        """Start the helper threads of the process that serves requests"""
+        self.catalog.start_reconciler()
+        self.user_manager.sessions.start()
+        self.resumable_uploads.start_collector()
+        if self.blob_store is not None:
+            self.blob_store.start_collector()
+        if self.hot_cache is not None:
+            self.hot_cache.start_revalidator()
+        if self.metadata_extractor is not None:
+            self.metadata_extractor.start()
+        self.listings.start()
+        self.metrics.start_sharing()
+        if self.profiler is not None:
+            self.profiler.start()
+    
+    def collect_metrics(self):
+        """Cache, session and password hashing figures for the metrics endpoint"""
+        hasher = self.user_manager.hasher.stats()
+        file_metadata = self.file_metadata.stats()
+        sessions = self.user_manager.sessions
+        collected = {
+            'sessions': ('gauge', 'Live login sessions', {'': len(sessions)},
+                         'max' if sessions.shared else 'sum'),
+            'pbkdf2_seconds': ('histogram', 'Time per PBKDF2 derivation', {'': hasher['timings']}),
+            'pbkdf2_pending': ('gauge', 'Password hashes running or queued', {'': hasher['pending']}),
+            'pbkdf2_rejected_total': ('counter', 'Logins refused because hashing was saturated',
+                                      {'': hasher['rejected']}),
+            'file_metadata_cache_hits_total': ('counter', 'Static file metadata cache hits',
+                                               {'': file_metadata['hits']}),
+            'file_metadata_cache_misses_total': ('counter', 'Static file metadata cache misses',
+                                                 {'': file_metadata['misses']}),
+        }
+        if isinstance(sessions, SQLiteSessionStore):
+            collected['session_writes_total'] = ('counter', 'Session expiry updates written in batches',
+                                                 {'': sessions.writes})
+        bandwidth = self.bandwidth.stats()
+        collected.update({
+            'bandwidth_bytes_per_second': ('gauge', 'Response bytes per second, bulk downloads or everything else',
+                                           {format_labels(kind=kind): rate for kind, rate in bandwidth['rates'].items()}),
+            'bandwidth_bytes_total': ('counter', 'Response body bytes, bulk downloads or everything else',
+                                      {format_labels(kind=kind): total for kind, total in bandwidth['totals'].items()}),
+            'bandwidth_client_bytes_per_second': ('gauge', 'Bulk download rate of each client with one in the last minute',
+                                                  {format_labels(client=client): rate
+                                                   for client, rate in bandwidth['clients'].items()}),
+            'bandwidth_active_transfers': ('gauge', 'Bulk downloads in progress', {'': bandwidth['active']}),
+            'bandwidth_throttled_seconds_total': ('counter', 'Time bulk downloads spent waiting on bandwidth limits',
+                                                  {'': bandwidth['throttled_seconds']}),
+        })
+        if self.metadata_extractor is not None:
+            collected['metadata_jobs'] = ('gauge', 'Video metadata extractions queued or running',
+                                          {'': self.metadata_extractor.queued})
+        if self.hot_cache is not None:
+            hot_cache = self.hot_cache.stats()
+            collected.update({
+                'hot_cache_hits_total': ('counter', 'Requests served from the hot file cache', {'': hot_cache['hits']}),
+                'hot_cache_misses_total': ('counter', 'Hot file cache lookups that missed', {'': hot_cache['misses']}),
+                'hot_cache_evictions_total': ('counter', 'Files evicted from the hot file cache',
+                                              {'': hot_cache['evictions']}),
+                'hot_cache_bytes': ('gauge', 'Bytes held by the hot file cache', {'': hot_cache['bytes']}),
+            })
+        return collected
+
+    def server_close(self):
+        self.catalog.stop_reconciler()
+        self.resumable_uploads.stop_collector()
+        if self.blob_store is not None:
+            self.blob_store.stop_collector()
+        if self.hot_cache is not None:
+            self.hot_cache.stop_revalidator()
+        if self.metadata_extractor is not None:
+            self.metadata_extractor.stop()
+        self.listings.stop()
+        self.metrics.stop_sharing()
+        if self.profiler is not None:
+            self.profiler.stop()
+        super().server_close()
+        self.user_manager.close()
+
+def create_session_store(config):
+    """Build the session backend named by config['session_backend']"""
+    ttl = config.get('session_ttl', 86400)
+    max_sessions = config.get('max_sessions', 10000)
+    backend = config.get('session_backend', 'memory')
+    if backend == 'sqlite':
+        return SQLiteSessionStore(
+            config.get('session_db', '.sessions.db'), ttl, max_sessions,
+            touch_interval=config.get('session_touch_interval', 30),
+            journal_mode=config.get('session_journal_mode', 'WAL')
+        )
+    if backend != 'memory':
+        raise ValueError(f"Unknown session_backend: {backend}")
+    return MemorySessionStore(ttl, max_sessions)
+
+class ThreadPoolMixIn(socketserver.ThreadingMixIn):
+    """Handle requests on a bounded pool of worker threads.
+
+    When every worker is busy the accept loop blocks, so further connections
+    wait in the listen backlog instead of spawning unbounded threads.
+    """
+    request_queue_size = 128
+
+    def __init__(self, *args, pool_size=16, **kwargs):
+        self.pool_size = pool_size
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(pool_size)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            # Created lazily so pre-forked workers don't inherit pool threads
+            self._pool = ThreadPoolExecutor(max_workers=self.pool_size,
+                                            thread_name_prefix='raf-cdn-worker')
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process_in_pool, request, client_address)
+        except RuntimeError:
+            # Pool is shutting down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process_in_pool(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def server_close(self):
+        if self._pool is not None:
+            # Let in-flight requests finish before the stores and logs
+            # they write to are closed
+            self._pool.shutdown(wait=True)
+        super().server_close()
+
+class ThreadedRAFCDNServer(ThreadPoolMixIn, RAFCDNServer):
+    """RAFCDNServer that serves requests from a bounded thread pool"""
+
+class AsyncRAFCDNRequestHandler(AsyncRequestHandlerMixIn, RAFCDNRequestHandler):
+    """RAFCDNRequestHandler driven by the asyncio engine, over HTTP/1.1 keep-alive"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server.metrics.connection_opened()
+    
+    def handle_request(self, request_line, head):
+        self.begin_request()
+        super().handle_request(request_line, head)
+    
+    def request_done(self):
+        self.end_request()
+    
+    def connection_lost(self):
+        self.server.metrics.connection_closed()
+    
+    def copyfile(self, source, outputfile):
+        """Leave file bodies, and their byte ranges, to the event loop's sendfile()"""
+        try:
+            fd = source.fileno()
+        except (AttributeError, OSError):
+            # Directory listings are built in memory
+            return http.server.SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+        if getattr(self, 'stream_encoding', None):
+            return super().copyfile(source, outputfile)
+        
+        if getattr(self, 'byte_ranges', None):
+            segments = [(part_header, start, end - start + 1) for start, end, part_header in self.byte_ranges]
+            trailer = self.byte_ranges_trailer if len(self.byte_ranges) > 1 else b''
+        else:
+            segments = [(b'', 0, os.fstat(fd).st_size)]
+            trailer = b''
+        # The caller closes source as soon as this returns
+        self.deferred_body = (os.fdopen(os.dup(fd), 'rb'), segments, trailer)
+
+class AsyncRAFCDNServer(AsyncServerMixIn, RAFCDNServer):
+    """RAFCDNServer that serves connections from an asyncio event loop"""
+
+def create_server(address, config, threads, listen_fd=None):
+    """Create the server for address using the configured engine.
+
+    With listen_fd the server serves that already listening socket instead
+    of binding its own.
+    """
+    if config.get('engine') == 'asyncio':
+        return AsyncRAFCDNServer(address, AsyncRAFCDNRequestHandler, config, pool_size=threads,
+                                 keepalive_timeout=config.get('keepalive_timeout', 15),
+                                 connection_timeout=config.get('connection_timeout', 60),
+                                 listen_fd=listen_fd)
+    if threads > 0:
+        return ThreadedRAFCDNServer(address, RAFCDNRequestHandler, config, pool_size=threads,
+                                    listen_fd=listen_fd)
+    return RAFCDNServer(address, RAFCDNRequestHandler, config, listen_fd=listen_fd)
+
+def install_shutdown_handler(httpd):
+    """Stop serve_forever() gracefully when SIGTERM arrives"""
+    def handle_sigterm(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it must not
+        # run on the thread that is serving
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+def reload_server(httpd, load, quiet=False):
+    """Reload httpd from load(), reporting the outcome unless quiet"""
+    try:
+        restart = httpd.reload(load())
+    except (OSError, ValueError) as e:
+        print(f"❌ Reload failed, keeping the running configuration: {e}")
+        return
+    if not quiet:
+        print("🔄 Reloaded configuration and users")
+        if restart:
+            print(f"   Restart to apply: {', '.join(restart)}")
+
+def install_reload_handler(httpd, load, quiet=False):
+    """Reload configuration and users when SIGHUP arrives"""
+    def handle_sighup(signum, frame):
+        # Off the serving thread, which may hold the locks reloading takes
+        threading.Thread(target=reload_server, args=(httpd, load, quiet), daemon=True).start()
+    signal.signal(signal.SIGHUP, handle_sighup)
+
+def hand_off(httpd):
+    """Start a new server process on httpd's listening socket, then stop this one.
+
+    The new process runs the code and configuration now on disk and
+    accepts alongside this one until it reports it is serving; this one
+    then finishes its in-flight requests and exits, so no connection is
+    refused. If the new process fails to start, this one carries on.
+    """
+    # Both processes accept until this one exits, so a blocking accept()
+    # here could wait for a connection the other one took; see serve_prefork()
+    httpd.socket.setblocking(False)
+    listen_fd = httpd.socket.fileno()
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ, **{LISTEN_FD_ENV: str(listen_fd), READY_FD_ENV: str(write_fd)})
+    try:
+        process = subprocess.Popen([sys.executable, SERVER_SCRIPT] + sys.argv[1:], cwd=STARTUP_DIR,
+                                   env=env, pass_fds=(listen_fd, write_fd))
+    except OSError as e:
+        os.close(read_fd)
+        print(f"❌ Could not start a replacement server: {e}")
+        return
+    finally:
+        os.close(write_fd)
+    
+    try:
+        ready, _, _ = select.select([read_fd], [], [], HANDOFF_TIMEOUT)
+        started = bool(ready) and os.read(read_fd, 1) == b'1'
+    finally:
+        os.close(read_fd)
+    if not started:
+        if process.poll() is None:
+            process.terminate()
+        print("❌ Replacement server did not start; still serving")
+        return
+    print(f"🔁 Process {process.pid} is now serving; finishing in-flight requests")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def install_handoff_handler(httpd):
+    """Hand the listening socket to a new server process when SIGUSR2 arrives"""
+    handing_off = threading.Lock()
+    
+    def run():
+        with handing_off:
+            hand_off(httpd)
+    
+    def handle_sigusr2(signum, frame):
+        if not handing_off.locked():
+            threading.Thread(target=run, daemon=True).start()
+    signal.signal(signal.SIGUSR2, handle_sigusr2)
+
+def serve_prefork(httpd, workers, load=None):
+    """Fork worker processes that all accept on the already-bound socket.
+
+    The parent only supervises: it restarts workers that die and, on Ctrl+C
+    or SIGTERM, asks every worker to finish its in-flight requests and exit.
+    On SIGHUP it reloads from load() and has every worker do the same.
+    """
+    children = set()
+    reloadable = load is not None and hasattr(signal, 'SIGHUP')
+
+    def spawn_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            install_shutdown_handler(httpd)
+            if reloadable:
+                install_reload_handler(httpd, load, quiet=True)
+            if hasattr(signal, 'SIGUSR2'):
+                # Handing off is the parent's job
+                signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+            httpd.start_background_tasks()
+            status = 0
+            try:
+                httpd.serve_forever()
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                httpd.server_close()
+            os._exit(status)
+        children.add(pid)
+
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    def handle_sighup(signum, frame):
+        # Reload here too, so workers restarted later start with the new settings
+        reload_server(httpd, load)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    # Every worker wakes up for each new connection but only one accept()
+    # succeeds; a blocking accept() would strand the others where shutdown()
+    # can't reach them
+    httpd.socket.setblocking(False)
+    # Workers publish metric snapshots here so any of them can report totals
+    httpd.metrics.share_dir = tempfile.mkdtemp(prefix='raf-cdn-metrics-')
+    for _ in range(workers):
+        spawn_worker()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if reloadable:
+        signal.signal(signal.SIGHUP, handle_sighup)
+
+    try:
+        while children:
+            pid, status = os.wait()
+            if pid not in children:
+                continue  # A replacement server that failed to start
+            children.discard(pid)
+            print(f"⚠️  Worker {pid} exited with status {status}, restarting")
+            spawn_worker()
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        raise
+    finally:
+        shutil.rmtree(httpd.metrics.share_dir, ignore_errors=True)
+
+# Settings that grant access to whoever can read them
+SECRET_SETTINGS = ('metrics_token', 'url_signing_keys')
+
+def check_config_secrets(config):
+    """Warn when server.config.json holds secrets other local users can read"""
+    found = [key for key in SECRET_SETTINGS if config.get(key)]
+    try:
+        mode = os.stat(os.path.join(STARTUP_DIR, 'server.config.json')).st_mode
+    except OSError:
+        return
+    if found and mode & 0o077:
+        print(f"Warning: server.config.json sets {', '.join(found)} but is readable by "
+              f"other users; run chmod 600 server.config.json")
+
+def load_config(strict=False):
+    """Load configuration from config file if it exists.
+
+    With strict, an unreadable config file raises OSError or ValueError
+    instead of falling back to the defaults.
+    """
+    config_file = os.path.join(STARTUP_DIR, 'server.config.json')
     default_config = {
         'host': '0.0.0.0',  # Changed to allow external connections
         'port': 8000,
         'debug': False,
-        'title': 'RAF-CDN Server'
+        'title': 'RAF-CDN Server',
+        'session_ttl': 86400,  # Seconds of inactivity before a session expires
+        'max_sessions': 10000,
+        'session_backend': 'memory',  # 'memory' (per process) or 'sqlite' (shared by workers and nodes)
+        'session_db': '.sessions.db',  # sqlite backend: database file, on shared disk for several nodes
+        'session_touch_interval': 30,  # sqlite backend: seconds between batched expiry updates
+        'session_journal_mode': 'WAL',  # sqlite backend: 'DELETE' when the database is on a network filesystem
+        'workers': 1,  # Worker processes (pre-fork); 1 serves from this process
+        'threads': 16,  # Request threads per process; 0 for single-threaded
+        'catalog_rescan_interval': 60,  # Seconds between video catalog rescans
+        'max_upload_size': 5 * 1024 ** 3,  # Bytes per uploaded file; 0 for no limit
+        'resumable_upload_ttl': 86400,  # Seconds before an idle resumable upload is discarded
+        'resumable_upload_max_sessions': 4,  # Open resumable uploads per user; 0 for no limit
+        'resumable_upload_quota': 10 * 1024 ** 3,  # Bytes a user's open resumable uploads may reserve; 0 for no limit
+        'activity_log_flush_interval': 1.0,  # Seconds between batched activity log writes
+        'activity_log_max_bytes': 10 * 1024 * 1024,  # Rotate activity_logs.jsonl past this size
+        'activity_log_backups': 3,
+        'kdf_iterations': 100000,  # PBKDF2 cost; existing hashes are upgraded on login
+        'kdf_workers': None,  # Password hashing threads (default: half the CPUs)
+        'kdf_max_pending': None,  # Hashes running or queued before 503 (default: 4 per worker)
+        'login_ip_rate': 1.0,  # Login attempts per second per client IP...
+        'login_ip_burst': 10,  # ...after an initial burst of this many
+        'login_user_rate': 0.2,  # Same, per username from each client IP
+        'login_user_burst': 5,
+        'trust_proxy_headers': False,  # Use X-Forwarded-For/X-Real-IP as the client IP
+        'compression': True,  # gzip/brotli for text assets, precompressed at startup
+        'hot_cache_size': 32 * 1024 * 1024,  # Bytes of small files kept in memory; 0 disables
+        'hot_cache_max_file': 1024 * 1024,  # Largest file the hot cache will hold
+        'engine': 'threads',  # 'threads' (socketserver) or 'asyncio'
+        'keepalive_timeout': 15,  # asyncio: seconds an idle keep-alive connection is kept
+        'connection_timeout': 60,  # asyncio: seconds a body read or write may stall
+        'metrics_token': None,  # Bearer token for /api/metrics scrapers; admins can always read it
+        'metadata_workers': 2,  # Processes parsing uploaded video headers; 0 disables
+        'dedup_storage': True,  # Store each distinct video once under .blobs/, hard-linked into Videos/
+        'require_signed_videos': False,  # Videos under /Videos/ need a URL from /api/sign-url
+        'signed_url_ttl': 3600,  # Default lifetime of a signed URL in seconds
+        'signed_url_max_ttl': 86400,  # Longest lifetime a client may ask for
+        'url_signing_keys': None,  # [{"id": ..., "secret": ...}] newest first; default, and safer: .url_signing_keys.json
+        'listing_cache_size': 256,  # Directory listings kept up to date in memory
+        'listing_poll_interval': 2.0,  # Seconds between rescans where inotify is unavailable
+        'bandwidth_limit': 0,  # Bytes/sec for all bulk downloads together; 0 for no limit
+        'bandwidth_connection_limit': 0,  # Bytes/sec per bulk download
+        'bandwidth_user_limit': 0,  # Bytes/sec per signed-in user, or per address for anonymous clients
+        'bandwidth_user_limits': {},  # {"username": bytes/sec} overrides; 0 for no limit
+        'bandwidth_bulk_threshold': 1024 * 1024,  # Responses this large are paced; smaller ones go first
+        'cache_control': None,  # [{"prefix"/"suffix": ..., "value": ...}] rules, first match wins; null for the built-in ones
+        'cors_origin': '*',  # Access-Control-Allow-Origin sent with every response
+        'pid_file': None  # Written with the serving process's pid, which changes on a SIGUSR2 handoff
     }
     
     if os.path.exists(config_file):
@@ -339,6 +1804,8 @@ def load_config():
                     config.setdefault(key, default_config[key])
                 return config
         except (json.JSONDecodeError, IOError) as e:
+            if strict:
+                raise
             print(f"Warning: Could not load config file: {e}")
             print("Using default configuration.")
     
@@ -351,6 +1818,50 @@ def create_sample_config():
         "port": 8000,
         "debug": False,
         "title": "RAF-CDN Server",
+        "session_ttl": 86400,
+        "max_sessions": 10000,
+        "session_backend": "memory",
+        "session_db": ".sessions.db",
+        "session_touch_interval": 30,
+        "session_journal_mode": "WAL",
+        "workers": 1,
+        "threads": 16,
+        "catalog_rescan_interval": 60,
+        "max_upload_size": 5368709120,
+        "resumable_upload_ttl": 86400,
+        "resumable_upload_max_sessions": 4,
+        "resumable_upload_quota": 10737418240,
+        "activity_log_flush_interval": 1.0,
+        "activity_log_max_bytes": 10485760,
+        "activity_log_backups": 3,
+        "kdf_iterations": 100000,
+        "login_ip_rate": 1.0,
+        "login_ip_burst": 10,
+        "login_user_rate": 0.2,
+        "login_user_burst": 5,
+        "trust_proxy_headers": False,
+        "compression": True,
+        "hot_cache_size": 33554432,
+        "hot_cache_max_file": 1048576,
+        "engine": "threads",
+        "keepalive_timeout": 15,
+        "connection_timeout": 60,
+        "metrics_token": None,
+        "metadata_workers": 2,
+        "dedup_storage": True,
+        "require_signed_videos": False,
+        "signed_url_ttl": 3600,
+        "signed_url_max_ttl": 86400,
+        "listing_cache_size": 256,
+        "listing_poll_interval": 2.0,
+        "bandwidth_limit": 0,
+        "bandwidth_connection_limit": 0,
+        "bandwidth_user_limit": 0,
+        "bandwidth_user_limits": {},
+        "bandwidth_bulk_threshold": 1048576,
+        "cache_control": DEFAULT_CACHE_RULES,
+        "cors_origin": "*",
+        "pid_file": None,
         "_comment": "host 0.0.0.0 allows external connections. Use 127.0.0.1 for localhost only."
     }
     
@@ -358,12 +1869,41 @@ def create_sample_config():
         json.dump(config, f, indent=2)
     print("Sample configuration created: server.config.json.sample")
 
+def print_storage_report(usage):
+    """Print the blob store's disk usage and the space deduplication saves"""
+    mib = 1024 * 1024
+    print(f"   Names: {usage['names']}  Blobs: {usage['blobs']}")
+    print(f"   Logical size: {usage['logical_bytes'] / mib:.1f} MiB")
+    print(f"   Stored size:  {usage['stored_bytes'] / mib:.1f} MiB")
+    print(f"   Saved:        {usage['saved_bytes'] / mib:.1f} MiB ({usage['dedup_ratio']:.2f}x)")
+
+def remove_pid_file(pid_file):
+    """Remove pid_file unless a replacement server has taken it over"""
+    if not pid_file:
+        return
+    try:
+        with open(pid_file) as f:
+            if f.read().strip() == str(os.getpid()):
+                os.remove(pid_file)
+    except OSError:
+        pass
+
 def main():
     parser = argparse.ArgumentParser(description='RAF-CDN HTTP Server')
     parser.add_argument('--host', default=None, help='Host to bind to (default: from config or 0.0.0.0)')
     parser.add_argument('--port', type=int, default=None, help='Port to bind to (default: from config or 8000)')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     parser.add_argument('--create-config', action='store_true', help='Create sample configuration file')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes to pre-fork (default: from config or 1)')
+    parser.add_argument('--cache-size', type=float, default=None, help='In-memory hot file cache size in MB, 0 to disable (default: from config or 32)')
+    parser.add_argument('--precompress', action='store_true', help='Build the compressed asset cache and exit')
+    parser.add_argument('--migrate-storage', action='store_true', help='Move existing videos into the deduplicated store, report disk usage and exit')
+    parser.add_argument('--storage-report', action='store_true', help='Report deduplicated storage disk usage and exit')
+    parser.add_argument('--rotate-signing-key', action='store_true', help='Start signing URLs with a new key, keeping the previous one, and exit')
+    parser.add_argument('--threads', type=int, default=None, help='Request threads per process, 0 for single-threaded (default: from config or 16)')
+    parser.add_argument('--profile', nargs='?', const='profile.folded', default=None, metavar='FILE',
+                        help='Sample busy stacks and dump them to FILE in folded format (default: profile.folded)')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default=None, help='Connection handling engine (default: from config or threads)')
     
     args = parser.parse_args()
     
@@ -373,12 +1913,47 @@ def main():
     
     # Load configuration
     config = load_config()
+    check_config_secrets(config)
+    
+    # Command line arguments override the config file, on reload too
+    overrides = {}
+    if args.host:
+        overrides['host'] = args.host
+    if args.port:
+        overrides['port'] = args.port
+    if args.debug:
+        overrides['debug'] = True
+    if args.workers is not None:
+        overrides['workers'] = args.workers
+    if args.threads is not None:
+        overrides['threads'] = args.threads
+    if args.cache_size is not None:
+        overrides['hot_cache_size'] = int(args.cache_size * 1024 * 1024)
+    if args.engine:
+        overrides['engine'] = args.engine
+    if args.profile:
+        overrides['profile'] = os.path.abspath(args.profile)
+    config.update(overrides)
+    if config.get('workers', 1) > 1 and not hasattr(os, 'fork'):
+        print("Warning: --workers requires fork(); running a single worker.")
+        config['workers'] = overrides['workers'] = 1
     
-    # Override with command line arguments
-    host = args.host or config['host']
-    port = args.port or config['port']
-    debug = args.debug or config.get('debug', False)
+    def reload_config():
+        new_config = load_config(strict=True)
+        new_config.update(overrides)
+        return new_config
+    
+    host = config['host']
+    port = config['port']
+    debug = config.get('debug', False)
     title = config.get('title', 'RAF-CDN Server')
+    # Server-wide limits are shared out between the workers
+    workers = config.get('workers', 1)
+    threads = config.get('threads', 16)
+    
+    # Set when this process replaces a running server; see hand_off()
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    ready_fd = os.environ.pop(READY_FD_ENV, None)
     
     # Change to the directory containing this script
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -392,12 +1967,55 @@ def main():
         print("Make sure you're running this script from the CDN root directory.")
         sys.exit(1)
     
+    if args.precompress:
+        prefixes = ListingCache().prefixes
+        files, saved = CompressedAssetCache().precompress(served_paths(prefixes))
+        print(f"🗜️  Precompressed {files} asset(s), saving {saved / 1024:.1f} KiB per full download")
+        return
+    
+    if args.rotate_signing_key:
+        try:
+            kid = URLSigner(keys=config.get('url_signing_keys')).rotate()
+        except ValueError as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        print(f"🔑 Now signing URLs with key {kid}; URLs signed with the previous key stay valid")
+        return
+    
+    if args.migrate_storage or args.storage_report:
+        blob_store = BlobStore()
+        if args.migrate_storage:
+            os.makedirs('Videos', exist_ok=True)
+            counts = blob_store.migrate()
+            collected = blob_store.collect()
+            print(f"📦 Migrated Videos/: {counts['adopted']} new, {counts['deduplicated']} duplicate(s) "
+                  f"linked, {counts['skipped']} skipped; removed {collected['blobs']} unused blob(s)")
+        print_storage_report(blob_store.usage())
+        return
+    
     try:
-        with socketserver.TCPServer((host, port), RAFCDNRequestHandler) as httpd:
+        with create_server((host, port), config, threads,
+                           listen_fd=int(listen_fd) if listen_fd else None) as httpd:
+            if listen_fd:
+                host, port = httpd.server_address[:2]
             print(f"🚀 {title} running at http://{host}:{port}")
             if host == '0.0.0.0':
                 print(f"   Also accessible via http://localhost:{port}")
             print(f"   Debug mode: {'ON' if debug else 'OFF'}")
+            if config.get('engine') == 'asyncio':
+                print(f"   Engine: asyncio, {workers} process(es) x {max(threads, 1)} handler thread(s)")
+                print(f"   Open file limit: {raise_fd_limit() or 'unknown'}")
+            else:
+                print(f"   Workers: {workers} process(es) x {threads or 1} thread(s)")
+            if workers > 1 and not httpd.user_manager.sessions.shared:
+                print("   Warning: sessions are per process; set session_backend to \"sqlite\" "
+                      "so a login works on every worker")
+            if httpd.compressed_assets is not None:
+                # Warm the sidecar index before workers fork so they share it
+                files, saved = httpd.compressed_assets.precompress(served_paths(httpd.listings.prefixes))
+                print(f"   Precompressed {files} asset(s), saving {saved / 1024:.1f} KiB per full download")
+            if httpd.profiler is not None:
+                print(f"   Profiling to {httpd.profiler.path}")
             print("   Press Ctrl+C to stop the server")
             print()
             
@@ -407,10 +2025,30 @@ def main():
                 print(f"  - Available directories: {[d for d in os.listdir('.') if os.path.isdir(d) and not d.startswith('.')]}")
                 print()
             
+            if hasattr(signal, 'SIGUSR2'):
+                install_handoff_handler(httpd)
+            pid_file = config.get('pid_file')
+            if pid_file:
+                with open(pid_file, 'w') as f:
+                    f.write(f"{os.getpid()}\n")
+            if ready_fd:
+                # The server being replaced can stop accepting now
+                os.write(int(ready_fd), b'1')
+                os.close(int(ready_fd))
+            
             try:
-                httpd.serve_forever()
+                if workers > 1:
+                    serve_prefork(httpd, workers, reload_config)
+                else:
+                    install_shutdown_handler(httpd)
+                    if hasattr(signal, 'SIGHUP'):
+                        install_reload_handler(httpd, reload_config)
+                    httpd.start_background_tasks()
+                    httpd.serve_forever()
             except KeyboardInterrupt:
                 print("\n✋ Server stopped by user.")
+            finally:
+                remove_pid_file(pid_file)
                 
     except OSError as e:
         if e.errno == 98:  # Address already in use
@@ -422,6 +2060,9 @@ def main():
         else:
             print(f"❌ Error starting server: {e}")
         sys.exit(1)
+    except ValueError as e:
+        print(f"❌ Error in configuration: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
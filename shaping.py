@@ -0,0 +1,222 @@
+# Bandwidth shaping for bulk transfers
+import math
+import time
+import threading
+from typing import Dict, List, Optional
+
+# Largest piece of a bulk body sent between bucket reservations
+TRANSFER_CHUNK = 1024 * 1024
+# Smallest piece, so slow limits still send in reasonably sized writes
+MIN_TRANSFER_CHUNK = 16 * 1024
+# Seconds over which the reported rates average
+RATE_HALF_LIFE = 2.0
+# Seconds a client's bucket is kept after its last transfer closes, so
+# back-to-back range requests share one budget instead of each starting
+# with a fresh burst
+CLIENT_IDLE_TTL = 60.0
+
+class TokenBucket:
+    """Byte budget refilled at rate per second, holding at most burst.
+
+    reserve() always takes what it asks for, going into debt if need be,
+    and returns how long the caller must wait before sending. Callers that
+    must not wait use charge(), and whoever reserves next waits off the debt.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate  # One second's worth
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """Take nbytes; returns seconds to wait before sending them"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - nbytes
+            self._last = now
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def charge(self, nbytes: int):
+        """Take nbytes already sent, without waiting.
+
+        The debt this leaves is capped at one burst, so a flood of small
+        responses delays bulk transfers without stalling them indefinitely.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._tokens = max(tokens - nbytes, min(tokens, -self.burst))
+            self._last = now
+
+class RateMeter:
+    """Exponentially decaying estimate of bytes per second"""
+
+    def __init__(self, half_life: float = RATE_HALF_LIFE):
+        self.half_life = half_life
+        self.total = 0
+        self._rate = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decay(self, now: float):
+        # Callers hold self._lock
+        self._rate *= 0.5 ** ((now - self._last) / self.half_life)
+        self._last = now
+
+    def add(self, nbytes: int):
+        with self._lock:
+            self._decay(time.monotonic())
+            self.total += nbytes
+            self._rate += nbytes * math.log(2) / self.half_life
+
+    def rate(self) -> float:
+        with self._lock:
+            self._decay(time.monotonic())
+            return self._rate
+
+class Transfer:
+    """One bulk response body, paced by its own, its user's and the global bucket"""
+
+    def __init__(self, shaper: 'BandwidthShaper', client: str, buckets: List[TokenBucket],
+                 meter: RateMeter):
+        self.shaper = shaper
+        self.client = client
+        self.buckets = buckets
+        self.meter = meter
+        rates = [bucket.rate for bucket in buckets]
+        # A tenth of a second at the tightest limit, so pacing stays smooth
+        self.chunk_size = TRANSFER_CHUNK if not rates else \
+            max(MIN_TRANSFER_CHUNK, min(TRANSFER_CHUNK, int(min(rates) / 10)))
+
+    def reserve(self, nbytes: int) -> float:
+        """Account for nbytes about to be sent; returns seconds to wait first"""
+        delay = max([bucket.reserve(nbytes) for bucket in self.buckets], default=0.0)
+        self.meter.add(nbytes)
+        self.shaper.sent(nbytes, delay)
+        return delay
+
+    def wait(self, nbytes: int):
+        """Block until nbytes may be sent"""
+        delay = self.reserve(nbytes)
+        if delay:
+            time.sleep(delay)
+
+    def close(self):
+        self.shaper.release(self)
+
+class BandwidthShaper:
+    """Token bucket limits on bulk downloads, ahead of which everything else goes.
+
+    Responses of at least bulk_threshold bytes are bulk: each one is sent
+    in chunks through open(), paced by a bucket of its own
+    (connection_rate), one shared by the same client (user_rate, or a
+    user_rates override for that username) and one shared by the whole
+    process (global_rate). Smaller responses, API answers included, are
+    never delayed; they are charged to the global bucket afterwards, so
+    bulk transfers give way to them. A rate of 0 means no limit.
+
+    global_rate is for the whole server and is divided between its
+    processes. Per-client rates are enforced by each process separately, so
+    a client's single download gets its full rate wherever it lands. A
+    client's bucket outlives its transfers by CLIENT_IDLE_TTL seconds.
+    """
+
+    def __init__(self, global_rate: float = 0, connection_rate: float = 0, user_rate: float = 0,
+                 user_rates: Optional[Dict[str, float]] = None, bulk_threshold: int = 1024 * 1024,
+                 processes: int = 1):
+        self.bulk = RateMeter()
+        self.priority = RateMeter()
+        self.throttled_seconds = 0.0
+        self._clients = {}  # client -> [bucket or None, meter, active transfers, last used, rate]
+        self._swept = time.monotonic()
+        self._lock = threading.Lock()
+        self.configure(global_rate, connection_rate, user_rate, user_rates, bulk_threshold, processes)
+    
+    def configure(self, global_rate: float = 0, connection_rate: float = 0, user_rate: float = 0,
+                  user_rates: Optional[Dict[str, float]] = None, bulk_threshold: int = 1024 * 1024,
+                  processes: int = 1):
+        """Change the limits; transfers already open keep the ones they started with"""
+        processes = max(1, processes)
+        with self._lock:
+            self.connection_rate = connection_rate
+            self.user_rate = user_rate
+            self.user_rates = dict(user_rates or {})
+            self.bulk_threshold = bulk_threshold
+            self.global_bucket = TokenBucket(global_rate / processes) if global_rate else None
+
+    def is_bulk(self, nbytes: int) -> bool:
+        return nbytes >= self.bulk_threshold
+
+    def open(self, client: str, username: Optional[str] = None) -> Transfer:
+        """Start a bulk transfer for client, a username or address.
+
+        username selects a user_rates override. Close the transfer when
+        the body has been sent.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            rate = self.user_rates.get(username, self.user_rate) if username else self.user_rate
+            state = self._clients.get(client)
+            if state is None:
+                state = self._clients[client] = [None, RateMeter(), 0, now, None]
+            if state[4] != rate:
+                # New, or the limit was reconfigured; open transfers keep the old bucket
+                state[0], state[4] = TokenBucket(rate) if rate else None, rate
+            state[2] += 1
+            state[3] = now
+        buckets = [bucket for bucket in (
+            TokenBucket(self.connection_rate) if self.connection_rate else None,
+            state[0],
+            self.global_bucket
+        ) if bucket is not None]
+        return Transfer(self, client, buckets, state[1])
+
+    def release(self, transfer: Transfer):
+        now = time.monotonic()
+        with self._lock:
+            state = self._clients.get(transfer.client)
+            if state is not None:
+                state[2] -= 1
+                state[3] = now
+            self._expire(now)
+
+    def _expire(self, now: float):
+        # Drop clients idle for CLIENT_IDLE_TTL, checking at most that often.
+        # Callers hold self._lock.
+        if now - self._swept < CLIENT_IDLE_TTL:
+            return
+        self._swept = now
+        idle = [client for client, state in self._clients.items()
+                if state[2] <= 0 and now - state[3] > CLIENT_IDLE_TTL]
+        for client in idle:
+            del self._clients[client]
+
+    def sent(self, nbytes: int, delay: float):
+        # Called by transfers for each chunk
+        self.bulk.add(nbytes)
+        if delay:
+            with self._lock:
+                self.throttled_seconds += delay
+
+    def charge(self, nbytes: int):
+        """Record a small response that has already been sent"""
+        self.priority.add(nbytes)
+        if self.global_bucket is not None:
+            self.global_bucket.charge(nbytes)
+
+    def stats(self) -> Dict:
+        """Current rates and totals for the metrics endpoint"""
+        with self._lock:
+            clients = {client: state[1].rate() for client, state in self._clients.items()}
+            active = sum(state[2] for state in self._clients.values())
+            throttled = self.throttled_seconds
+        return {
+            'rates': {'bulk': self.bulk.rate(), 'priority': self.priority.rate()},
+            'totals': {'bulk': self.bulk.total, 'priority': self.priority.total},
+            'clients': clients,
+            'active': active,
+            'throttled_seconds': throttled
+        }
@@ -0,0 +1,142 @@
+# Signed, expiring download URLs
+import os
+import json
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+class SignatureError(Exception):
+    """Raised when a signed URL is malformed, expired or forged"""
+
+def encode_signature(digest: bytes) -> str:
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+class URLSigner:
+    """Issues and verifies HMAC-SHA256 signed, time-limited URLs.
+
+    A signature covers the URL path and its expiry time, so checking one
+    needs the keys and nothing else: no session or database lookup, and any
+    process or host holding the same keys accepts URLs issued by any other.
+
+    Keys are a list, newest first, each with an id that signed URLs carry
+    as kid. URLs are signed with the newest key and verified with whichever
+    key they name, so after rotate() URLs issued under an older key keep
+    working until they expire or that key is dropped. Keys come from the
+    keys argument when given (for sharing between hosts), otherwise from
+    key_file, which is created on first use and re-read whenever it
+    changes on disk.
+    """
+
+    def __init__(self, key_file: str = '.url_signing_keys.json', keys: Optional[List[Dict]] = None):
+        self.key_file = key_file
+        self._static = keys is not None
+        self._lock = threading.Lock()
+        self._keys_mtime = None
+        self._keys = [(key['id'], key['secret'].encode('utf-8')) for key in keys] if keys else []
+        if self._static and not self._keys:
+            raise ValueError('url_signing_keys must contain at least one key')
+        if not self._static:
+            self._keys = self.load_keys()
+
+    @property
+    def keys(self) -> List[Tuple[str, bytes]]:
+        """Current (id, secret) pairs, newest first"""
+        if self._static:
+            return self._keys
+        try:
+            mtime = os.stat(self.key_file).st_mtime_ns
+        except OSError:
+            return self._keys
+        if mtime != self._keys_mtime:
+            with self._lock:
+                if mtime != self._keys_mtime:
+                    self._keys = self.load_keys()
+        return self._keys
+
+    def load_keys(self) -> List[Tuple[str, bytes]]:
+        """Read key_file, creating it with a fresh key if it doesn't exist"""
+        try:
+            with open(self.key_file, 'r') as f:
+                self._keys_mtime = os.fstat(f.fileno()).st_mtime_ns
+                stored = json.load(f)
+        except FileNotFoundError:
+            stored = [self.new_key()]
+            self.save_keys(stored)
+        return [(key['id'], bytes.fromhex(key['secret'])) for key in stored]
+
+    def save_keys(self, stored: List[Dict]):
+        """Replace key_file atomically, readable by its owner only"""
+        directory = os.path.dirname(os.path.abspath(self.key_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stored, f, indent=2)
+        os.replace(temp_path, self.key_file)
+        self._keys_mtime = os.stat(self.key_file).st_mtime_ns
+
+    @staticmethod
+    def new_key() -> Dict:
+        """A random 256-bit key as stored in key_file"""
+        return {'id': secrets.token_hex(4), 'secret': secrets.token_hex(32), 'created_at': time.time()}
+
+    def rotate(self, keep: int = 2) -> str:
+        """Make a new signing key, keeping the keep - 1 newest old ones.
+
+        Returns the new key's id. Only keys from key_file can be rotated.
+        """
+        if self._static:
+            raise ValueError('Keys from url_signing_keys are rotated by editing the config')
+        with self._lock:
+            try:
+                with open(self.key_file, 'r') as f:
+                    stored = json.load(f)
+            except FileNotFoundError:
+                stored = []
+            key = self.new_key()
+            stored = [key] + stored[:max(keep, 1) - 1]
+            self.save_keys(stored)
+            self._keys = [(k['id'], bytes.fromhex(k['secret'])) for k in stored]
+        return key['id']
+
+    @staticmethod
+    def _signature(secret: bytes, path: str, expires: int) -> str:
+        message = f'{path}\n{expires}'.encode('utf-8')
+        return encode_signature(hmac.new(secret, message, hashlib.sha256).digest())
+
+    def sign(self, path: str, ttl: float) -> Tuple[str, int]:
+        """Return a URL for path valid for ttl seconds, and its expiry time.
+
+        path is the decoded URL path, e.g. '/Videos/my clip.mp4'.
+        """
+        expires = int(time.time() + ttl)
+        kid, secret = self.keys[0]
+        query = urlencode({'expires': expires, 'kid': kid, 'sig': self._signature(secret, path, expires)})
+        return f'{quote(path)}?{query}', expires
+
+    def verify(self, path: str, params: Dict[str, str]) -> int:
+        """Check the expires, kid and sig parameters of a request for path.
+
+        Returns the expiry time. Raises SignatureError if the signature is
+        missing, malformed, made with an unknown key, wrong or expired.
+        """
+        try:
+            expires = int(params['expires'])
+            kid = params['kid']
+            signature = params['sig']
+        except (KeyError, ValueError):
+            raise SignatureError('Missing or malformed signature')
+        secret = dict(self.keys).get(kid)
+        if secret is None:
+            raise SignatureError('Unknown signing key')
+        # Compared as bytes: compare_digest() rejects non-ASCII strings
+        if not hmac.compare_digest(signature.encode('utf-8', 'surrogatepass'),
+                                   self._signature(secret, path, expires).encode('ascii')):
+            raise SignatureError('Invalid signature')
+        if expires < time.time():
+            raise SignatureError('Signed URL has expired')
+        return expires
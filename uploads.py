@@ -0,0 +1,584 @@
+# Streaming upload handling
+import os
+import time
+import errno
+import hmac
+import hashlib
+import secrets
+import sqlite3
+import tempfile
+import threading
+from email.message import Message
+from email.parser import HeaderParser
+from email.utils import collapse_rfc2231_value
+from typing import Dict, Iterator, NamedTuple, Optional
+
+# Bytes read from the socket at a time; also the parser's working buffer size
+CHUNK_SIZE = 256 * 1024
+# Limits for the non-file parts of a multipart body
+MAX_HEADER_SIZE = 16 * 1024
+MAX_PREAMBLE_SIZE = 64 * 1024
+# Bytes of stored content a client hashes to prove it has a file
+PROOF_LENGTH = 64 * 1024
+
+class UploadError(Exception):
+    """Raised when an upload is malformed or rejected"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class UploadResult(NamedTuple):
+    """Outcome of a stored upload"""
+    filename: str
+    size: int
+    sha256: str
+    seconds: float
+    deduplicated: bool = False  # Content was already stored
+
+    @property
+    def throughput(self) -> float:
+        """Bytes written per second"""
+        return self.size / self.seconds if self.seconds > 0 else float(self.size)
+
+def parse_boundary(content_type: str) -> str:
+    """Return the boundary of a multipart/form-data Content-Type header"""
+    msg = Message()
+    msg['Content-Type'] = content_type or ''
+    boundary = msg.get_param('boundary')
+    if msg.get_content_type() != 'multipart/form-data' or not boundary:
+        raise UploadError('Expected multipart/form-data with a boundary')
+    if len(boundary) > 200:
+        raise UploadError('Multipart boundary too long')
+    return boundary
+
+def safe_filename(filename: str) -> str:
+    """Reduce a client-supplied filename to a plain name inside the target directory"""
+    name = os.path.basename(filename.replace('\\', '/')).strip()
+    if not name or name.startswith('.'):
+        raise UploadError('Invalid filename')
+    return name
+
+class MultipartPart:
+    """One part of a multipart body whose payload is read incrementally"""
+
+    def __init__(self, reader: 'MultipartReader', headers: Message):
+        self._reader = reader
+        self.headers = headers
+        name = headers.get_param('name', header='content-disposition')
+        self.name = collapse_rfc2231_value(name) if name is not None else None
+        self.filename = headers.get_filename()
+        self.consumed = False
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield the part's payload in chunks of at most CHUNK_SIZE bytes"""
+        return self._reader._read_body(self)
+
+    def drain(self):
+        """Discard whatever is left of the payload"""
+        for _ in self.chunks():
+            pass
+
+class MultipartReader:
+    """Incremental multipart/form-data parser over a request body.
+
+    Memory use is bounded by the chunk size regardless of how large the
+    parts are; each part must be consumed before the next one is read.
+    """
+
+    def __init__(self, fp, boundary: str, content_length: int,
+                 chunk_size: int = CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self._remaining = content_length
+        self._buf = bytearray()
+        self._delimiter = b'\r\n--' + boundary.encode('latin-1')
+
+    def _fill(self) -> bool:
+        """Read more of the body into the buffer; False at end of body"""
+        if self._remaining <= 0:
+            return False
+        data = self.fp.read(min(self.chunk_size, self._remaining))
+        if not data:
+            raise UploadError('Upload body ended early')
+        self._remaining -= len(data)
+        self._buf += data
+        return True
+
+    def _read_until(self, marker: bytes, limit: int) -> bytes:
+        """Return bytes up to marker and consume the marker too"""
+        start = 0
+        while True:
+            index = self._buf.find(marker, start)
+            if index >= 0:
+                data = bytes(self._buf[:index])
+                del self._buf[:index + len(marker)]
+                return data
+            if len(self._buf) > limit:
+                raise UploadError('Multipart headers too large')
+            start = max(0, len(self._buf) - len(marker) + 1)
+            if not self._fill():
+                raise UploadError('Malformed multipart body')
+
+    def _read_exact(self, size: int) -> bytes:
+        while len(self._buf) < size:
+            if not self._fill():
+                raise UploadError('Malformed multipart body')
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def parts(self) -> Iterator[MultipartPart]:
+        """Yield each part of the body in order"""
+        # The first delimiter has no leading CRLF
+        self._buf[:0] = b'\r\n'
+        self._read_until(self._delimiter, MAX_PREAMBLE_SIZE)
+        while self._read_exact(2) == b'\r\n':
+            raw_headers = self._read_until(b'\r\n\r\n', MAX_HEADER_SIZE)
+            headers = HeaderParser().parsestr(raw_headers.decode('utf-8', 'replace'))
+            part = MultipartPart(self, headers)
+            yield part
+            if not part.consumed:
+                part.drain()
+        # Anything after the closing delimiter is epilogue and is ignored
+
+    def _read_body(self, part: MultipartPart) -> Iterator[bytes]:
+        if part.consumed:
+            return
+        delimiter = self._delimiter
+        # Hold back enough bytes to catch a delimiter split across reads
+        keep = len(delimiter) - 1
+        while True:
+            index = self._buf.find(delimiter)
+            if index >= 0:
+                if index:
+                    yield bytes(self._buf[:index])
+                del self._buf[:index + len(delimiter)]
+                part.consumed = True
+                return
+            if len(self._buf) > keep:
+                yield bytes(self._buf[:-keep])
+                del self._buf[:-keep]
+            if not self._fill():
+                raise UploadError('Malformed multipart body')
+
+def store_upload(chunks: Iterator[bytes], directory: str, filename: str,
+                 max_size: Optional[int] = None, blob_store=None) -> UploadResult:
+    """Stream chunks into directory/filename in a single pass.
+
+    Data goes to a temporary file in the same directory, hashed as it is
+    written, and is renamed into place only once complete, so readers never
+    see a partial file. With a blob_store the file is published through it
+    instead, which may rename it or discard it as a duplicate; the result
+    carries the final name. Raises UploadError(413) once max_size is exceeded.
+    """
+    started = time.monotonic()
+    digest = hashlib.sha256()
+    size = 0
+    temp_dir = blob_store.temp_dir if blob_store is not None else directory
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, prefix='.upload-', suffix='.part')
+    deduplicated = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise UploadError(f'File exceeds the {max_size} byte upload limit', 413)
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        if blob_store is not None:
+            filename, deduplicated = blob_store.publish(temp_path, filename, digest.hexdigest(), size)
+        else:
+            os.replace(temp_path, os.path.join(directory, filename))
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return UploadResult(filename, size, digest.hexdigest(), time.monotonic() - started, deduplicated)
+
+class ResumableUploads:
+    """Resumable upload sessions assembled in place on the server.
+
+    A session preallocates a hidden part file in the target directory.
+    Clients send chunks at explicit offsets, possibly in parallel and out of
+    order; each is written with pwrite() and its byte range recorded in
+    SQLite so any worker process can report progress or finish the upload.
+    Each owner may hold at most max_sessions open sessions reserving at most
+    quota bytes between them (0 for no limit); idle sessions are discarded
+    after ttl seconds, which frees their reservation.
+    """
+
+    def __init__(self, directory: str = 'Videos', db_file: str = 'video_catalog.db',
+                 ttl: float = 86400, gc_interval: float = 3600, blob_store=None,
+                 max_sessions: int = 4, quota: int = 10 * 1024 ** 3):
+        self.directory = directory
+        self.blob_store = blob_store
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.quota = quota
+        self.gc_interval = gc_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._stop = threading.Event()
+        self._collector = None
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not cross fork(), so each process opens its own.
+        # Callers hold self._lock.
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finalizing INTEGER NOT NULL DEFAULT 0,
+                sha256 TEXT
+            );
+            CREATE TABLE IF NOT EXISTS upload_ranges (
+                upload_id TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS upload_ranges_by_upload ON upload_ranges (upload_id, start);
+            CREATE INDEX IF NOT EXISTS uploads_by_updated ON uploads (updated_at);
+        ''')
+        # Columns added since the table was first created
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(uploads)')]
+        if 'finalizing' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN finalizing INTEGER NOT NULL DEFAULT 0')
+        if 'sha256' not in columns:
+            conn.execute('ALTER TABLE uploads ADD COLUMN sha256 TEXT')
+        conn.commit()
+        self._conn = conn
+        self._conn_pid = os.getpid()
+        return conn
+
+    def part_path(self, upload_id: str) -> str:
+        """Path of the file an upload is assembled in"""
+        return os.path.join(self.directory, f'.resumable-{upload_id}.part')
+
+    def create(self, owner: str, filename: str, size: int, sha256: Optional[str] = None) -> Dict:
+        """Start a session for a file of the given size and preallocate it.
+
+        With the file's sha256 and a blob store, the session also carries a
+        proof-of-possession challenge; see prove(). Raises UploadError(429) when the owner already has max_sessions open
+        and UploadError(507) when the file would take the owner past quota
+        or the disk is full.
+        """
+        filename = safe_filename(filename)
+        if size < 0:
+            raise UploadError('Invalid upload size')
+        upload_id = secrets.token_hex(16)
+
+        # Reserve the session before allocating space, in one write
+        # transaction so concurrent creates in other workers can't both fit
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                sessions, reserved = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads '
+                                                  'WHERE owner = ?', (owner,)).fetchone()
+                if self.max_sessions and sessions >= self.max_sessions:
+                    raise UploadError(f'Too many open uploads (at most {self.max_sessions})', 429)
+                if self.quota and reserved + size > self.quota:
+                    raise UploadError(f'Open uploads would exceed the {self.quota} byte quota', 507)
+                conn.execute('INSERT INTO uploads (id, owner, filename, size, created_at, updated_at, sha256) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', (upload_id, owner, filename, size, now, now, sha256))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+        path = self.part_path(upload_id)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                if size:
+                    if hasattr(os, 'posix_fallocate'):
+                        os.posix_fallocate(fd, 0, size)
+                    else:
+                        os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.abort(upload_id)
+            if e.errno == errno.ENOSPC:
+                raise UploadError('Not enough disk space', 507) from e
+            raise
+        upload = {'upload_id': upload_id, 'filename': filename, 'size': size, 'offset': 0}
+        if sha256 and self.blob_store is not None:
+            upload['challenge'] = self.challenge(upload_id, size)
+        return upload
+
+    def get(self, upload_id: str) -> Optional[Dict]:
+        """Return a session with its received ranges and contiguous offset"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT owner, filename, size, created_at, updated_at, finalizing, sha256 '
+                               'FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+            if row is None:
+                return None
+            ranges = conn.execute('SELECT start, end FROM upload_ranges WHERE upload_id = ? ORDER BY start',
+                                  (upload_id,)).fetchall()
+        owner, filename, size, created_at, updated_at, finalizing, sha256 = row
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return {
+            'upload_id': upload_id,
+            'owner': owner,
+            'filename': filename,
+            'size': size,
+            'offset': offset,
+            'received': sum(end - start for start, end in ranges),
+            'ranges': [list(r) for r in ranges],
+            'created_at': created_at,
+            'updated_at': updated_at,
+            'finalizing': bool(finalizing),
+            'sha256': sha256
+        }
+
+    def write_chunk(self, upload_id: str, offset: int, length: int, fp) -> Dict:
+        """Copy length bytes from fp into the upload at offset with pwrite().
+
+        Returns the updated session. Raises UploadError(404) for an unknown
+        or just discarded session, UploadError(409) while it is being
+        completed and UploadError(400) for a chunk outside the file.
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError('Upload not found', 404)
+        if upload['finalizing']:
+            raise UploadError('Upload is being completed', 409)
+        if offset < 0 or length < 0 or offset + length > upload['size']:
+            raise UploadError('Chunk outside the declared upload size')
+
+        try:
+            fd = os.open(self.part_path(upload_id), os.O_WRONLY)
+        except FileNotFoundError:
+            # Completed or collected since get()
+            raise UploadError('Upload not found', 404)
+        try:
+            written = 0
+            while written < length:
+                data = fp.read(min(CHUNK_SIZE, length - written))
+                if not data:
+                    raise UploadError('Chunk body ended early')
+                view = memoryview(data)
+                while view:
+                    n = os.pwrite(fd, view, offset + written)
+                    view = view[n:]
+                    written += n
+        finally:
+            os.close(fd)
+
+        if length:
+            self._record_range(upload_id, offset, offset + length)
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError('Upload not found', 404)
+        return upload
+
+    def _record_range(self, upload_id: str, start: int, end: int):
+        # Merge the new range with any it overlaps or touches so the table
+        # stays at one row per contiguous run of received bytes
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                finalizing = conn.execute('SELECT finalizing FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+                if finalizing is None:
+                    raise UploadError('Upload not found', 404)
+                if finalizing[0]:
+                    raise UploadError('Upload is being completed', 409)
+                overlapping = conn.execute('''
+                    SELECT rowid, start, end FROM upload_ranges
+                    WHERE upload_id = ? AND start <= ? AND end >= ?
+                ''', (upload_id, end, start)).fetchall()
+                for rowid, other_start, other_end in overlapping:
+                    start = min(start, other_start)
+                    end = max(end, other_end)
+                conn.executemany('DELETE FROM upload_ranges WHERE rowid = ?',
+                                 [(rowid,) for rowid, _, _ in overlapping])
+                conn.execute('INSERT INTO upload_ranges VALUES (?, ?, ?)', (upload_id, start, end))
+                conn.execute('UPDATE uploads SET updated_at = ? WHERE id = ?', (time.time(), upload_id))
+
+    def finalize(self, upload_id: str) -> UploadResult:
+        """Move a fully received upload into place and hash it.
+
+        Raises UploadError(409) if bytes are still missing or another
+        request is already completing it. The session is kept until the
+        file is published, so if publishing fails it can be retried, or
+        aborted and its part file reclaimed.
+        """
+        started = time.monotonic()
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError('Upload not found', 404)
+        if upload['offset'] != upload['size']:
+            raise UploadError(f"Upload incomplete: {upload['offset']} of {upload['size']} bytes", 409)
+
+        # Claim the session so concurrent chunks and finalize calls are refused
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                claimed = conn.execute('UPDATE uploads SET finalizing = 1, updated_at = ? '
+                                       'WHERE id = ? AND finalizing = 0', (time.time(), upload_id)).rowcount
+        if not claimed:
+            raise UploadError('Upload is being completed', 409)
+
+        path = self.part_path(upload_id)
+        try:
+            digest = hashlib.sha256()
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                # Discarded by an abort that raced this call
+                self.abort(upload_id)
+                raise UploadError('Upload not found', 404)
+            with f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                os.fsync(f.fileno())
+            filename = upload['filename']
+            deduplicated = False
+            if self.blob_store is not None:
+                filename, deduplicated = self.blob_store.publish(path, filename, digest.hexdigest(), upload['size'])
+            else:
+                os.replace(path, os.path.join(self.directory, filename))
+        except BaseException:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute('UPDATE uploads SET finalizing = 0 WHERE id = ?', (upload_id,))
+            raise
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+                conn.execute('DELETE FROM upload_ranges WHERE upload_id = ?', (upload_id,))
+        return UploadResult(filename, upload['size'], digest.hexdigest(),
+                            time.monotonic() - started, deduplicated)
+
+    @staticmethod
+    def challenge(upload_id: str, size: int) -> Dict:
+        """The byte range a client must hash to prove it has an upload's content.
+
+        The range depends on the random upload ID, so it can't be known,
+        or the proof computed, before the session exists.
+        """
+        length = min(size, PROOF_LENGTH)
+        seed = int.from_bytes(hashlib.sha256(b'proof:' + upload_id.encode()).digest()[:8], 'big')
+        return {'offset': seed % (size - length + 1), 'length': length}
+
+    def prove(self, upload_id: str, proof: str) -> UploadResult:
+        """Complete an upload from already stored content, without receiving it.
+
+        proof must be the hex SHA-256 of the upload ID followed by the bytes
+        of the file in the session's challenge range. Raises UploadError(403)
+        if it doesn't match stored content with the declared sha256 and size;
+        the session is kept so the file can still be sent.
+        """
+        started = time.monotonic()
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError('Upload not found', 404)
+        sha256 = upload['sha256']
+        if not sha256 or self.blob_store is None or not self.blob_store.has_blob(sha256, upload['size']):
+            raise UploadError('Content not stored; send the file instead', 403)
+        challenge = self.challenge(upload_id, upload['size'])
+        try:
+            with open(self.blob_store.blob_path(sha256), 'rb') as f:
+                f.seek(challenge['offset'])
+                data = f.read(challenge['length'])
+        except FileNotFoundError:
+            data = b''
+        if len(data) < challenge['length']:
+            raise UploadError('Content not stored; send the file instead', 403)
+        expected = hashlib.sha256(upload_id.encode() + data).hexdigest()
+        if not hmac.compare_digest(expected.encode(), proof.encode()):
+            raise UploadError('Proof of possession failed', 403)
+
+        # Claim the session like finalize() so chunks and other calls are refused
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                claimed = conn.execute('UPDATE uploads SET finalizing = 1, updated_at = ? '
+                                       'WHERE id = ? AND finalizing = 0', (time.time(), upload_id)).rowcount
+        if not claimed:
+            raise UploadError('Upload is being completed', 409)
+        try:
+            filename = self.blob_store.link(upload['filename'], sha256)
+        except BaseException as e:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute('UPDATE uploads SET finalizing = 0 WHERE id = ?', (upload_id,))
+            if isinstance(e, KeyError):
+                # Deleted since has_blob()
+                raise UploadError('Content not stored; send the file instead', 403) from e
+            raise
+        self.abort(upload_id)
+        return UploadResult(filename, upload['size'], sha256, time.monotonic() - started, True)
+
+    def abort(self, upload_id: str) -> bool:
+        """Discard a session and its partial file"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                deleted = conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,)).rowcount
+                conn.execute('DELETE FROM upload_ranges WHERE upload_id = ?', (upload_id,))
+        try:
+            os.unlink(self.part_path(upload_id))
+        except FileNotFoundError:
+            pass
+        return bool(deleted)
+
+    def collect_stale(self) -> int:
+        """Abort sessions idle for longer than ttl; returns how many"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            stale = [row[0] for row in self._connect().execute(
+                'SELECT id FROM uploads WHERE updated_at < ?', (cutoff,))]
+        for upload_id in stale:
+            self.abort(upload_id)
+        return len(stale)
+
+    def start_collector(self):
+        """Garbage-collect stale sessions every gc_interval seconds in the background"""
+        if self._collector is not None and self._collector.is_alive():
+            return
+        self._stop.clear()
+        self._collector = threading.Thread(target=self._collect_loop,
+                                           name='resumable-upload-collector', daemon=True)
+        self._collector.start()
+
+    def stop_collector(self):
+        """Stop the background collector"""
+        self._stop.set()
+        if self._collector is not None:
+            self._collector.join()
+            self._collector = None
+
+    def _collect_loop(self):
+        while True:
+            try:
+                self.collect_stale()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Resumable upload cleanup error: {e}")
+            if self._stop.wait(self.gc_interval):
+                return
@@ -0,0 +1,403 @@
+# Video container metadata extraction
+import os
+import struct
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, Optional, Tuple
+
+# ISO BMFF boxes that only contain other boxes
+MP4_CONTAINER_BOXES = frozenset((b'moov', b'trak', b'mdia', b'minf', b'stbl'))
+MP4_TOP_LEVEL_BOXES = frozenset((b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'))
+# Deepest nesting of container boxes followed; real files use five levels
+MAX_MP4_DEPTH = 8
+
+# Matroska element IDs (marker bits included)
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+# Largest header values read, whatever size a file declares for them
+MAX_EBML_UINT = 8
+MAX_EBML_STRING = 256
+
+# WAVE format tags commonly found in AVI audio streams
+AVI_AUDIO_FORMATS = {0x0001: 'pcm', 0x0055: 'mp3', 0x00FF: 'aac', 0x2000: 'ac3', 0x2001: 'dts'}
+
+def empty_metadata(container: str) -> Dict:
+    return {
+        'container': container,
+        'duration': None,
+        'width': None,
+        'height': None,
+        'video_codec': None,
+        'audio_codec': None
+    }
+
+def _mp4_boxes(f, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, data start, box end) for each box between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # Box runs to the end of its parent
+        if size < header_size:
+            raise ValueError('Corrupt MP4 box')
+        yield kind, pos + header_size, min(pos + size, end)
+        pos += size
+
+def _read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError('Truncated box')
+    return data
+
+def parse_mp4(f, file_size: int) -> Dict:
+    """Read duration, dimensions and codecs from an MP4/MOV moov box"""
+    metadata = empty_metadata('mp4')
+    moov = next(((start, end) for kind, start, end in _mp4_boxes(f, 0, file_size) if kind == b'moov'), None)
+    if moov is None:
+        raise ValueError('No moov box')
+
+    def walk(start, end, track, depth=0):
+        if depth > MAX_MP4_DEPTH:
+            raise ValueError('MP4 boxes nested too deeply')
+        for kind, data_start, data_end in _mp4_boxes(f, start, end):
+            if kind == b'trak':
+                found = {}
+                walk(data_start, data_end, found, depth + 1)
+                if found.get('handler') == b'vide':
+                    metadata['video_codec'] = metadata['video_codec'] or found.get('codec')
+                    if found.get('width'):
+                        metadata['width'] = metadata['width'] or found['width']
+                        metadata['height'] = metadata['height'] or found['height']
+                elif found.get('handler') == b'soun':
+                    metadata['audio_codec'] = metadata['audio_codec'] or found.get('codec')
+            elif kind in MP4_CONTAINER_BOXES:
+                walk(data_start, data_end, track, depth + 1)
+            elif kind == b'mvhd':
+                version = _read_at(f, data_start, 1)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack('>IQ', _read_at(f, data_start + 20, 12))
+                else:
+                    timescale, duration = struct.unpack('>II', _read_at(f, data_start + 12, 8))
+                if timescale:
+                    metadata['duration'] = duration / timescale
+            elif kind == b'tkhd' and track is not None:
+                version = _read_at(f, data_start, 1)[0]
+                width, height = struct.unpack('>II', _read_at(f, data_start + (88 if version == 1 else 76), 8))
+                track['width'], track['height'] = width >> 16, height >> 16
+            elif kind == b'hdlr' and track is not None:
+                track['handler'] = _read_at(f, data_start + 8, 4)
+            elif kind == b'stsd' and track is not None:
+                track['codec'] = _read_at(f, data_start + 12, 4).decode('latin-1').strip()
+
+    walk(moov[0], moov[1], None)
+    return metadata
+
+def _ebml_vint(f, keep_marker: bool) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-length integer; returns (value, length)"""
+    first = f.read(1)
+    if not first:
+        raise ValueError('Truncated EBML element')
+    length = 9 - first[0].bit_length()
+    if length > 8:
+        raise ValueError('Invalid EBML length')
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise ValueError('Truncated EBML element')
+    value = int.from_bytes(first + rest, 'big')
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return None, length  # Unknown size
+    return value, length
+
+def _ebml_elements(f, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """Yield (id, data start, data end) for each element between start and end"""
+    pos = start
+    while pos < end:
+        f.seek(pos)
+        element_id, id_length = _ebml_vint(f, keep_marker=True)
+        size, size_length = _ebml_vint(f, keep_marker=False)
+        data_start = pos + id_length + size_length
+        data_end = end if size is None else min(data_start + size, end)
+        yield element_id, data_start, data_end
+        if size is None:
+            return  # Can't skip an element of unknown size
+        pos = data_end
+
+def _ebml_value(f, start: int, end: int, limit: int) -> bytes:
+    if end - start > limit:
+        raise ValueError(f'Matroska element of {end - start} bytes exceeds {limit}')
+    return _read_at(f, start, end - start)
+
+def _ebml_uint(f, start: int, end: int) -> int:
+    return int.from_bytes(_ebml_value(f, start, end, MAX_EBML_UINT), 'big')
+
+def _ebml_string(f, start: int, end: int) -> str:
+    return _ebml_value(f, start, end, MAX_EBML_STRING).rstrip(b'\0').decode('ascii', 'replace')
+
+def _ebml_float(f, start: int, end: int) -> float:
+    data = _ebml_value(f, start, end, 8)
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    return 0.0
+
+def parse_matroska(f, file_size: int) -> Dict:
+    """Read duration, dimensions and codecs from Matroska/WebM headers"""
+    metadata = None
+    for element_id, start, end in _ebml_elements(f, 0, file_size):
+        if element_id == EBML_HEADER:
+            doc_type = next((_ebml_string(f, s, e) for i, s, e in _ebml_elements(f, start, end)
+                             if i == EBML_DOCTYPE), 'matroska')
+            metadata = empty_metadata(doc_type)
+        elif element_id == MKV_SEGMENT:
+            break
+    else:
+        raise ValueError('No Matroska segment')
+    if metadata is None:
+        raise ValueError('No EBML header')
+
+    scale, duration = 1000000, None
+    for element_id, child_start, child_end in _ebml_elements(f, start, end):
+        if element_id == MKV_INFO:
+            for i, s, e in _ebml_elements(f, child_start, child_end):
+                if i == MKV_TIMESTAMP_SCALE:
+                    scale = _ebml_uint(f, s, e)
+                elif i == MKV_DURATION:
+                    duration = _ebml_float(f, s, e)
+        elif element_id == MKV_TRACKS:
+            for i, s, e in _ebml_elements(f, child_start, child_end):
+                if i == MKV_TRACK_ENTRY:
+                    _parse_matroska_track(f, s, e, metadata)
+        elif element_id == MKV_CLUSTER:
+            break  # Headers precede the media data
+    if duration is not None:
+        metadata['duration'] = duration * scale / 1e9
+    return metadata
+
+def _parse_matroska_track(f, start: int, end: int, metadata: Dict):
+    track_type, codec, width, height = None, None, None, None
+    for element_id, s, e in _ebml_elements(f, start, end):
+        if element_id == MKV_TRACK_TYPE:
+            track_type = _ebml_uint(f, s, e)
+        elif element_id == MKV_CODEC_ID:
+            codec = _ebml_string(f, s, e)
+        elif element_id == MKV_VIDEO:
+            for i, vs, ve in _ebml_elements(f, s, e):
+                if i == MKV_PIXEL_WIDTH:
+                    width = _ebml_uint(f, vs, ve)
+                elif i == MKV_PIXEL_HEIGHT:
+                    height = _ebml_uint(f, vs, ve)
+    if track_type == 1 and metadata['video_codec'] is None:
+        metadata.update(video_codec=codec, width=width, height=height)
+    elif track_type == 2 and metadata['audio_codec'] is None:
+        metadata['audio_codec'] = codec
+
+def _riff_chunks(f, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (id, data start, data end) for each RIFF chunk between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        kind, size = struct.unpack('<4sI', f.read(8))
+        yield kind, pos + 8, min(pos + 8 + size, end)
+        pos += 8 + size + (size & 1)
+
+def parse_avi(f, file_size: int) -> Dict:
+    """Read duration, dimensions and codecs from AVI stream headers"""
+    metadata = empty_metadata('avi')
+    for kind, start, end in _riff_chunks(f, 12, file_size):
+        if kind == b'LIST' and _read_at(f, start, 4) == b'hdrl':
+            break
+    else:
+        raise ValueError('No AVI header list')
+
+    for kind, s, e in _riff_chunks(f, start + 4, end):
+        if kind == b'avih':
+            usec_per_frame, = struct.unpack('<I', _read_at(f, s, 4))
+            frames, = struct.unpack('<I', _read_at(f, s + 16, 4))
+            metadata['width'], metadata['height'] = struct.unpack('<II', _read_at(f, s + 32, 8))
+            metadata['duration'] = frames * usec_per_frame / 1e6
+        elif kind == b'LIST' and _read_at(f, s, 4) == b'strl':
+            stream_type = None
+            for chunk, cs, ce in _riff_chunks(f, s + 4, e):
+                if chunk == b'strh':
+                    stream_type, handler = struct.unpack('<4s4s', _read_at(f, cs, 8))
+                    if stream_type == b'vids' and metadata['video_codec'] is None:
+                        metadata['video_codec'] = handler.decode('latin-1').strip('\0 ') or None
+                elif chunk == b'strf' and stream_type == b'auds' and metadata['audio_codec'] is None:
+                    tag, = struct.unpack('<H', _read_at(f, cs, 2))
+                    metadata['audio_codec'] = AVI_AUDIO_FORMATS.get(tag, f'0x{tag:04x}')
+    return metadata
+
+def extract_metadata(path: str) -> Dict:
+    """Identify a video container by its magic bytes and parse its headers.
+
+    Only headers are read, never the media data. Raises ValueError for
+    unrecognised or corrupt files.
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        magic = f.read(12)
+        try:
+            if magic[:4] == b'\x1a\x45\xdf\xa3':
+                return parse_matroska(f, file_size)
+            if magic[:4] == b'RIFF' and magic[8:12] == b'AVI ':
+                return parse_avi(f, file_size)
+            if magic[4:8] in MP4_TOP_LEVEL_BOXES:
+                return parse_mp4(f, file_size)
+        except struct.error as e:
+            raise ValueError(f'Corrupt header: {e}') from e
+    raise ValueError('Unrecognised container')
+
+class MetadataExtractor:
+    """Bounded background queue that extracts video metadata into the catalog.
+
+    Jobs run in a process pool so parsing never competes with request
+    threads for the GIL. At most `workers` files are parsed at once; the
+    rest wait in an ordered, de-duplicated queue. Results are stored with
+    the file's size and mtime, so submitting a file that is unchanged since
+    its last extraction does nothing.
+    """
+
+    def __init__(self, catalog, workers: int = 2, scan_interval: float = 60.0):
+        self.catalog = catalog
+        self.workers = workers
+        self.scan_interval = scan_interval
+        self._pending = OrderedDict()  # name -> None, oldest first
+        self._running = set()
+        # Reentrant: a job that finishes instantly runs its callback inside _dispatch()
+        self._lock = threading.RLock()
+        self._pool = None
+        self._pool_pid = None
+        self._stop = threading.Event()
+        self._scanner = None
+
+    def submit(self, name: str):
+        """Queue a video for extraction unless it is already queued or running"""
+        with self._lock:
+            if name in self._running or name in self._pending:
+                return
+            self._pending[name] = None
+            self._dispatch()
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting or running"""
+        with self._lock:
+            return len(self._pending) + len(self._running)
+
+    def _dispatch(self):
+        # Callers hold self._lock
+        while self._pending and len(self._running) < self.workers:
+            name, _ = self._pending.popitem(last=False)
+            path = os.path.join(self.catalog.videos_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Deleted since it was queued
+            if self.catalog.has_metadata(name, stat.st_size, stat.st_mtime):
+                continue
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Spawned rather than forked: the server process has threads
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                self._pool_pid = os.getpid()
+            self._running.add(name)
+            pool = self._pool
+            try:
+                future = pool.submit(extract_metadata, path)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # Left for the next scan, with a fresh pool
+                print(f"Metadata extraction error for {name}: {e}")
+                self._running.discard(name)
+                self._discard_pool(pool)
+                continue
+            future.add_done_callback(
+                lambda future, name=name, stat=stat, pool=pool: self._finished(name, stat, pool, future))
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        # Callers hold self._lock; the next _dispatch() starts a new pool
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False)
+
+    def _finished(self, name: str, stat: os.stat_result, pool: ProcessPoolExecutor, future):
+        try:
+            try:
+                metadata, error = future.result(), None
+            except CancelledError:
+                return  # Stopped before it ran
+            except Exception as e:
+                # Recorded so the file isn't retried until it changes
+                metadata, error = None, str(e) or type(e).__name__
+                if isinstance(e, BrokenProcessPool):
+                    with self._lock:
+                        self._discard_pool(pool)
+            self.catalog.set_metadata(name, stat.st_size, stat.st_mtime, metadata, error)
+        except Exception as e:
+            print(f"Metadata extraction error for {name}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(name)
+                if not self._stop.is_set():
+                    self._dispatch()
+
+    def scan(self) -> int:
+        """Queue every catalogued video without current metadata; returns how many"""
+        names = self.catalog.missing_metadata()
+        for name in names:
+            self.submit(name)
+        return len(names)
+
+    def start(self):
+        """Scan now and then every scan_interval seconds in the background"""
+        if self._scanner is not None and self._scanner.is_alive():
+            return
+        self._stop.clear()
+        self._scanner = threading.Thread(target=self._scan_loop, name='video-metadata-scanner', daemon=True)
+        self._scanner.start()
+
+    def stop(self):
+        """Stop scanning, drop queued jobs and wait for running ones"""
+        self._stop.set()
+        if self._scanner is not None:
+            self._scanner.join()
+            self._scanner = None
+        with self._lock:
+            self._pending.clear()
+            pool = self._pool if self._pool_pid == os.getpid() else None
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _scan_loop(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Metadata scan error: {e}")
+            if self._stop.wait(self.scan_interval):
+                return